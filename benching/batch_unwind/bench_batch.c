@@ -0,0 +1,203 @@
+/** Compares the batch entry point of an eh_elf, `_eh_elf_batch`, to its scalar
+ * entry point, `_eh_elf` or `_fde_lookup`, on random PCs.
+ *
+ * The eh_elf must be generated with `--enable-batch`, and, if `-d` is passed,
+ * with `--enable-deref-arg`. The memory reads of the unwinding go to a
+ * zero-filled buffer, which the stack pointers of the contexts point to.
+ */
+
+#define _GNU_SOURCE
+
+#include <dlfcn.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+
+#include "../../shared/context_struct.h"
+
+#define STACK_SIZE (1 << 20)
+
+typedef _fde_func_t (*fde_lookup_t)(uintptr_t);
+typedef _fde_func_with_deref_t (*fde_lookup_with_deref_t)(uintptr_t);
+
+static uintptr_t stack[STACK_SIZE / sizeof(uintptr_t)];
+
+static uintptr_t deref(uintptr_t addr) {
+    uintptr_t beg = (uintptr_t) stack;
+    if(addr < beg || addr > beg + sizeof(stack) - sizeof(uintptr_t))
+        return 0;
+    return *((uintptr_t*) addr);
+}
+
+static uintptr_t deref_batch(size_t index, uintptr_t addr) {
+    (void) index;
+    return deref(addr);
+}
+
+static uint64_t rand_state = 0x2545f4914f6cdd1dULL;
+static uint64_t xorshift() {
+    rand_state ^= rand_state << 13;
+    rand_state ^= rand_state >> 7;
+    rand_state ^= rand_state << 17;
+    return rand_state;
+}
+
+static int cmp_pc(const void* lhs, const void* rhs) {
+    uintptr_t lhs_pc = *(const uintptr_t*) lhs, rhs_pc = *(const uintptr_t*) rhs;
+    return (lhs_pc > rhs_pc) - (lhs_pc < rhs_pc);
+}
+
+static double now() {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
+/** Whether `lhs` and `rhs` are the same unwinding outcome */
+static int same_outcome(const unwind_context_t* lhs, const unwind_context_t* rhs)
+{
+    if(lhs->flags != rhs->flags)
+        return 0;
+    if(lhs->flags & (1 << UNWF_ERROR))
+        return 1;
+    return (!(lhs->flags & (1 << UNWF_RIP)) || lhs->rip == rhs->rip)
+        && (!(lhs->flags & (1 << UNWF_RSP)) || lhs->rsp == rhs->rsp)
+        && (!(lhs->flags & (1 << UNWF_RBP)) || lhs->rbp == rhs->rbp)
+        && (!(lhs->flags & (1 << UNWF_RBX)) || lhs->rbx == rhs->rbx);
+}
+
+static void usage(const char* argv0) {
+    fprintf(stderr,
+            "Usage: %s [-d] [-s] [-n COUNT] [-r ROUNDS] EH_ELF LOW HIGH\n"
+            "Unwind COUNT random PCs in [LOW, HIGH) (hexadecimal, addresses\n"
+            "of the original ELF), ROUNDS times, through both entry points.\n"
+            "  -d: the eh_elf takes a dereferencing function\n"
+            "  -s: sort the PCs beforehand\n",
+            argv0);
+    exit(1);
+}
+
+int main(int argc, char** argv) {
+    size_t count = 1000000;
+    unsigned rounds = 10;
+    int with_deref = 0, sort_pcs = 0;
+
+    int opt;
+    while((opt = getopt(argc, argv, "dsn:r:")) != -1) {
+        switch(opt) {
+            case 'd': with_deref = 1; break;
+            case 's': sort_pcs = 1; break;
+            case 'n': count = strtoul(optarg, NULL, 10); break;
+            case 'r': rounds = strtoul(optarg, NULL, 10); break;
+            default: usage(argv[0]);
+        }
+    }
+    if(argc - optind != 3 || count == 0 || rounds == 0)
+        usage(argv[0]);
+    uintptr_t low = strtoull(argv[optind + 1], NULL, 16);
+    uintptr_t high = strtoull(argv[optind + 2], NULL, 16);
+    if(low >= high)
+        usage(argv[0]);
+
+    void* eh_elf = dlopen(argv[optind], RTLD_NOW);
+    if(eh_elf == NULL) {
+        fprintf(stderr, "Cannot load the eh_elf: %s\n", dlerror());
+        return 1;
+    }
+    void* batch_func = dlsym(eh_elf, "_eh_elf_batch");
+    void* global_func = dlsym(eh_elf, "_eh_elf");
+    void* fde_lookup = dlsym(eh_elf, "_fde_lookup");
+    if(batch_func == NULL || (global_func == NULL && fde_lookup == NULL)) {
+        fprintf(stderr, "The eh_elf lacks an entry point, was it generated "
+                "with --enable-batch?\n");
+        return 1;
+    }
+
+    uintptr_t* pcs = malloc(count * sizeof(uintptr_t));
+    unwind_context_t* ctxs = malloc(count * sizeof(unwind_context_t));
+    unwind_context_t* scalar_out = malloc(count * sizeof(unwind_context_t));
+    unwind_context_t* batch_out = malloc(count * sizeof(unwind_context_t));
+    if(!pcs || !ctxs || !scalar_out || !batch_out) {
+        fprintf(stderr, "Out of memory\n");
+        return 1;
+    }
+
+    for(size_t i = 0; i < count; ++i)
+        pcs[i] = low + xorshift() % (high - low);
+    if(sort_pcs)
+        qsort(pcs, count, sizeof(uintptr_t), cmp_pc);
+    for(size_t i = 0; i < count; ++i) {
+        ctxs[i].flags = 0;
+        ctxs[i].rip = pcs[i];
+        ctxs[i].rsp = (uintptr_t) stack + sizeof(stack) / 2;
+        ctxs[i].rbp = ctxs[i].rsp + 64;
+        ctxs[i].rbx = 0;
+    }
+
+    // The lookup of switch-per-func eh_elfs asserts on PCs outside of any FDE:
+    // only keep the PCs that the batch entry point does not flag as errors.
+    if(with_deref)
+        ((_eh_elf_batch_func_with_deref_t) batch_func)(
+                count, pcs, ctxs, batch_out, deref_batch);
+    else
+        ((_eh_elf_batch_func_t) batch_func)(count, pcs, ctxs, batch_out);
+    size_t kept = 0;
+    for(size_t i = 0; i < count; ++i) {
+        if(!(batch_out[i].flags & (1 << UNWF_ERROR))) {
+            pcs[kept] = pcs[i];
+            ctxs[kept] = ctxs[i];
+            ++kept;
+        }
+    }
+    count = kept;
+    if(count == 0) {
+        fprintf(stderr, "No PC in [LOW, HIGH) can be unwound\n");
+        return 1;
+    }
+
+    double scalar_time = 0, batch_time = 0;
+    for(unsigned round = 0; round < rounds; ++round) {
+        double start = now();
+        for(size_t i = 0; i < count; ++i) {
+            if(with_deref) {
+                _fde_func_with_deref_t func = global_func
+                    ? (_fde_func_with_deref_t) global_func
+                    : ((fde_lookup_with_deref_t) fde_lookup)(pcs[i]);
+                scalar_out[i] = func(ctxs[i], pcs[i], deref);
+            }
+            else {
+                _fde_func_t func = global_func
+                    ? (_fde_func_t) global_func
+                    : ((fde_lookup_t) fde_lookup)(pcs[i]);
+                scalar_out[i] = func(ctxs[i], pcs[i]);
+            }
+        }
+        scalar_time += now() - start;
+
+        start = now();
+        if(with_deref)
+            ((_eh_elf_batch_func_with_deref_t) batch_func)(
+                    count, pcs, ctxs, batch_out, deref_batch);
+        else
+            ((_eh_elf_batch_func_t) batch_func)(count, pcs, ctxs, batch_out);
+        batch_time += now() - start;
+    }
+
+    size_t mismatches = 0;
+    for(size_t i = 0; i < count; ++i)
+        mismatches += !same_outcome(&scalar_out[i], &batch_out[i]);
+
+    double unwinds = (double) count * rounds;
+    printf("%zu PCs%s, %u rounds\n", count, sort_pcs ? " (sorted)" : "", rounds);
+    printf("scalar: %.1f ns/unwind\n", scalar_time / unwinds * 1e9);
+    printf("batch:  %.1f ns/unwind\n", batch_time / unwinds * 1e9);
+    printf("speedup: %.2f\n", scalar_time / batch_time);
+    if(mismatches > 0) {
+        printf("MISMATCHES: %zu\n", mismatches);
+        return 1;
+    }
+    return 0;
+}
@@ -0,0 +1,243 @@
+/** Unwinds continuously from several threads at once, through the stack walker
+ * it is linked against, and reports the throughput and latency of the walks
+ * for each thread count.
+ *
+ * Each thread goes down the call graph generated by `gen_call_graph_src.py`,
+ * along a pseudo-random path, to the requested depth; there, it walks its
+ * whole stack several times, then goes down another path.
+ */
+
+#include <algorithm>
+#include <atomic>
+#include <cstdint>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <ctime>
+#include <string>
+#include <thread>
+#include <vector>
+#include <unistd.h>
+
+#include "stack_walker.hpp"
+
+#ifndef BACKEND
+#define BACKEND "unknown"
+#endif
+
+extern "C" {
+    uint64_t cg_0(unsigned depth, uint64_t path);
+    void cg_leaf(void);
+}
+
+/** Parameters of a run */
+struct BenchParams {
+    unsigned depth;
+    size_t walks; ///< Per thread
+    size_t walks_per_path;
+    size_t max_frames;
+};
+
+/** State and measurements of a thread */
+struct ThreadBench {
+    const BenchParams* params;
+    size_t walks_left;
+    std::vector<unwind_context_t> frames;
+    std::vector<uint32_t> latencies; ///< Of each walk, in nanoseconds
+    uint64_t frame_count;
+};
+
+static thread_local ThreadBench* cur_bench = nullptr;
+
+static uint64_t now_ns() {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000000ULL + ts.tv_nsec;
+}
+
+void cg_leaf(void) {
+    ThreadBench& bench = *cur_bench;
+    for(size_t walk = 0;
+            walk < bench.params->walks_per_path && bench.walks_left > 0;
+            ++walk)
+    {
+        uint64_t beg = now_ns();
+        size_t frames = walk_stack(bench.frames.data(), bench.frames.size());
+        uint64_t end = now_ns();
+
+        bench.latencies.push_back(end - beg);
+        bench.frame_count += frames;
+        --bench.walks_left;
+    }
+}
+
+static void run_thread(
+        ThreadBench* bench,
+        unsigned thread_id,
+        std::atomic<unsigned>* ready,
+        const std::atomic<bool>* go)
+{
+    cur_bench = bench;
+    ++*ready;
+    while(!go->load())
+        std::this_thread::yield();
+
+    uint64_t path = thread_id;
+    while(bench->walks_left > 0) {
+        path = path * 0x9e3779b97f4a7c15ULL + 1;
+        cg_0(bench->params->depth, path);
+    }
+    stack_walker_release_thread();
+}
+
+/** Measurements of a run, over all its threads */
+struct RunResult {
+    double duration; ///< Wall-clock, in seconds
+    uint64_t walks, frames;
+    double p50, p99; ///< Walk latencies, in microseconds
+};
+
+static RunResult run(const BenchParams& params, unsigned thread_count) {
+    std::vector<ThreadBench> benches(thread_count);
+    for(auto& bench: benches) {
+        bench.params = &params;
+        bench.walks_left = params.walks;
+        bench.frames.resize(params.max_frames);
+        bench.latencies.reserve(params.walks);
+        bench.frame_count = 0;
+    }
+
+    std::atomic<unsigned> ready(0);
+    std::atomic<bool> go(false);
+    std::vector<std::thread> threads;
+    for(unsigned thread_id = 0; thread_id < thread_count; ++thread_id) {
+        threads.emplace_back(
+                run_thread, &benches[thread_id], thread_id, &ready, &go);
+    }
+    while(ready.load() < thread_count)
+        std::this_thread::yield();
+
+    uint64_t beg = now_ns();
+    go.store(true);
+    for(auto& thread: threads)
+        thread.join();
+    uint64_t end = now_ns();
+
+    RunResult result;
+    result.duration = (end - beg) * 1e-9;
+    result.walks = 0;
+    result.frames = 0;
+    std::vector<uint32_t> latencies;
+    for(const auto& bench: benches) {
+        result.walks += bench.latencies.size();
+        result.frames += bench.frame_count;
+        latencies.insert(latencies.end(),
+                bench.latencies.begin(), bench.latencies.end());
+    }
+
+    auto percentile = [&latencies](double ratio) {
+        if(latencies.empty())
+            return 0.;
+        auto nth = latencies.begin() + (size_t) (ratio * (latencies.size() - 1));
+        std::nth_element(latencies.begin(), nth, latencies.end());
+        return *nth * 1e-3;
+    };
+    result.p50 = percentile(0.5);
+    result.p99 = percentile(0.99);
+    return result;
+}
+
+static std::vector<unsigned> parse_thread_counts(const char* arg) {
+    std::vector<unsigned> out;
+    std::string list(arg);
+    size_t pos = 0;
+    while(pos <= list.size()) {
+        size_t comma = list.find(',', pos);
+        if(comma == std::string::npos)
+            comma = list.size();
+        int count = atoi(list.substr(pos, comma - pos).c_str());
+        if(count <= 0)
+            return std::vector<unsigned>();
+        out.push_back(count);
+        pos = comma + 1;
+    }
+    return out;
+}
+
+static void usage(const char* argv0) {
+    fprintf(stderr,
+            "Usage: %s [-t THREADS] [-d DEPTH] [-n WALKS] [-w WALKS_PER_PATH]\n"
+            "          [-m MAX_FRAMES] [-c]\n"
+            "Unwind WALKS times from each thread, for each thread count of\n"
+            "the comma-separated list THREADS (default: 1,2,4,8).\n"
+            "  -d: depth of the walked call stacks in the call graph (32)\n"
+            "  -n: walks per thread (20000)\n"
+            "  -w: walks before going down another path (16)\n"
+            "  -m: frames per walk at most (256)\n"
+            "  -c: enable the stack walker's rule cache\n",
+            argv0);
+    exit(1);
+}
+
+int main(int argc, char** argv) {
+    BenchParams params;
+    params.depth = 32;
+    params.walks = 20000;
+    params.walks_per_path = 16;
+    params.max_frames = 256;
+    std::vector<unsigned> thread_counts = {1, 2, 4, 8};
+    bool rule_cache = false;
+
+    int opt;
+    while((opt = getopt(argc, argv, "t:d:n:w:m:c")) != -1) {
+        switch(opt) {
+            case 't': thread_counts = parse_thread_counts(optarg); break;
+            case 'd': params.depth = atoi(optarg); break;
+            case 'n': params.walks = atol(optarg); break;
+            case 'w': params.walks_per_path = atol(optarg); break;
+            case 'm': params.max_frames = atol(optarg); break;
+            case 'c': rule_cache = true; break;
+            default: usage(argv[0]);
+        }
+    }
+    if(optind != argc || thread_counts.empty() || params.walks == 0
+            || params.walks_per_path == 0 || params.max_frames == 0)
+    {
+        usage(argv[0]);
+    }
+
+    if(!stack_walker_init()) {
+        fprintf(stderr, "Cannot initialize the stack walker\n");
+        return 1;
+    }
+    stack_walker_set_rule_cache(rule_cache);
+
+    printf("Backend: %s%s\n", BACKEND, rule_cache ? ", rule cache" : "");
+    printf("Depth %u, %zu walks per thread, %zu walks per path\n\n",
+            params.depth, params.walks, params.walks_per_path);
+    printf("%7s %12s %12s %12s %10s %10s\n",
+            "threads", "walks/s", "frames/s", "frames/walk",
+            "p50 (us)", "p99 (us)");
+
+    for(unsigned thread_count: thread_counts) {
+        stack_walker_reset_cache_stats();
+        RunResult result = run(params, thread_count);
+        printf("%7u %12.0f %12.0f %12.1f %10.2f %10.2f\n",
+                thread_count,
+                result.walks / result.duration,
+                result.frames / result.duration,
+                (double) result.frames / result.walks,
+                result.p50,
+                result.p99);
+        if(rule_cache) {
+            StackWalkerCacheStats stats = stack_walker_cache_stats();
+            printf("%7s rule cache: %lu hits, %lu misses\n", "",
+                    (unsigned long) stats.hits,
+                    (unsigned long) stats.misses);
+        }
+        fflush(stdout);
+    }
+
+    stack_walker_close();
+    return 0;
+}
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+""" Generates the C source of a call graph for `bench_mt`.
+
+Each node of the graph is a function `cg_N(depth, path)`. Until `depth` reaches
+0, it calls one of its callees, chosen by the pseudo-random `path`; a function
+without callees calls the root again. At depth 0, it calls `cg_leaf()`, where
+the benchmark unwinds. The root is `cg_0`.
+
+The graph is either of a predefined shape, or read from the dot output of
+`../csmith/gen_call_graph.py`, in which case `main` is the root.
+"""
+
+import argparse
+import random
+import re
+import sys
+
+SHAPES = ["chain", "tree", "random"]
+
+
+def chain_graph(size):
+    """ Each function calls the next one """
+    return [[node + 1] if node + 1 < size else [] for node in range(size)]
+
+
+def tree_graph(size, fanout):
+    """ A complete `fanout`-ary tree """
+    return [
+        [child for child in range(fanout * node + 1, fanout * node + fanout + 1)
+         if child < size]
+        for node in range(size)
+    ]
+
+
+def random_graph(size, fanout, seed):
+    """ Each function calls `fanout` functions drawn at random """
+    rng = random.Random(seed)
+    return [
+        sorted(rng.sample(range(size), min(fanout, size)))
+        for _ in range(size)
+    ]
+
+
+def dot_graph(handle):
+    """ The graph of a dot file generated by `gen_call_graph.py` """
+    edge_re = re.compile(r"^\s*(\w+)\s*->\s*(\w+)")
+    ids = {"main": 0}
+    edges = []
+
+    def node_id(name):
+        if name not in ids:
+            ids[name] = len(ids)
+        return ids[name]
+
+    for line in handle:
+        match = edge_re.match(line)
+        if match:
+            edges.append((node_id(match.group(1)), node_id(match.group(2))))
+
+    graph = [[] for _ in ids]
+    for caller, callee in edges:
+        if callee not in graph[caller]:
+            graph[caller].append(callee)
+    return graph
+
+
+def gen_function(node, callees):
+    """ The C code of the function `node` """
+    # Various frame sizes, so that the functions do not all share a row
+    pad = 16 * (node % 4 + 1)
+    out = [
+        "uint64_t cg_{}(unsigned depth, uint64_t path) {{".format(node),
+        "\tvolatile char pad[{}];".format(pad),
+        "\tuint64_t ret;",
+        "\tpad[0] = (char) depth;",
+        "\tif(depth == 0) {",
+        "\t\tcg_leaf();",
+        "\t\treturn pad[0];",
+        "\t}",
+        "\tpath = path * 6364136223846793005ULL + 1442695040888963407ULL;",
+    ]
+    callees = callees or [0]
+    if len(callees) == 1:
+        out.append("\tret = cg_{}(depth - 1, path);".format(callees[0]))
+    else:
+        out.append("\tswitch((path >> 33) % {}) {{".format(len(callees)))
+        for pos, callee in enumerate(callees):
+            out.append(
+                "\t\tcase {}: ret = cg_{}(depth - 1, path); break;".format(
+                    pos, callee
+                )
+            )
+        out.append("\t\tdefault: ret = 0;")
+        out.append("\t}")
+    # Not a tail call: the frame must stay on the stack
+    out += ["\treturn ret + pad[0];", "}", ""]
+    return out
+
+
+def gen_source(graph, description):
+    out = [
+        "/* Generated by gen_call_graph_src.py: {} */".format(description),
+        "",
+        "#include <stdint.h>",
+        "",
+        "void cg_leaf(void);",
+        "",
+    ]
+    out += [
+        "__attribute__((noinline)) uint64_t cg_{}(unsigned depth, uint64_t path);"
+        .format(node)
+        for node in range(len(graph))
+    ]
+    out.append("")
+    for node, callees in enumerate(graph):
+        out += gen_function(node, callees)
+    return "\n".join(out)
+
+
+def process_args():
+    """ Process `sys.argv` arguments """
+    parser = argparse.ArgumentParser(
+        description="Generate the C source of a call graph for bench_mt"
+    )
+    parser.add_argument(
+        "--shape",
+        choices=SHAPES,
+        default="tree",
+        help="Shape of the generated call graph. Defaults to tree.",
+    )
+    parser.add_argument(
+        "--functions",
+        type=int,
+        default=64,
+        help="Number of functions of the graph. Defaults to 64.",
+    )
+    parser.add_argument(
+        "--fanout",
+        type=int,
+        default=2,
+        help="Callees per function, for tree and random. Defaults to 2.",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the random shape"
+    )
+    parser.add_argument(
+        "--dot",
+        metavar="file",
+        help=(
+            "Use the call graph of this dot file, as output by "
+            "../csmith/gen_call_graph.py, instead of a shape"
+        ),
+    )
+    parser.add_argument(
+        "-o", "--output", metavar="file", help="Output file. Defaults to stdout."
+    )
+
+    args = parser.parse_args()
+    if args.functions < 1 or args.fanout < 1:
+        parser.error("--functions and --fanout must be positive")
+    return args
+
+
+def main():
+    args = process_args()
+
+    if args.dot:
+        with open(args.dot, "r") as handle:
+            graph = dot_graph(handle)
+        description = "call graph of {}".format(args.dot)
+    elif args.shape == "chain":
+        graph = chain_graph(args.functions)
+        description = "chain of {} functions".format(args.functions)
+    elif args.shape == "tree":
+        graph = tree_graph(args.functions, args.fanout)
+        description = "tree of {} functions, fanout {}".format(
+            args.functions, args.fanout
+        )
+    else:
+        graph = random_graph(args.functions, args.fanout, args.seed)
+        description = "random graph of {} functions, fanout {}, seed {}".format(
+            args.functions, args.fanout, args.seed
+        )
+
+    source = gen_source(graph, description)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(source)
+    else:
+        sys.stdout.write(source)
+
+
+if __name__ == "__main__":
+    main()
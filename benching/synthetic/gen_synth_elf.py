@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+""" Generates a synthetic ELF shared object whose `.eh_frame` has a controlled
+size and shape, to measure how the eh_elfs scale.
+
+The object is written as assembly with CFI directives, then assembled by `$C`
+(gcc by default). Each FDE covers a function made of `nop`s: the code is not
+meant to be run, only its unwinding table matters. Every row of an FDE covers
+a few bytes, and differs from the previous one, so that dwarf-assembly does
+not merge them.
+
+Each FDE follows one of these kinds, drawn according to `--mix`:
+* `cfa`: the CFA offset from %rsp moves up and down, as with pushes and pops;
+* `rbp`: a frame-pointer prologue, then %rbx is saved and restored, then an
+  epilogue;
+* `plt`: the CFA alternates between an offset from %rsp and the standard PLT
+  expression.
+
+The number of rows of each FDE is drawn according to `--density`, until the
+total reaches `--rows`.
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+
+
+C_BIN = "gcc" if "C" not in os.environ else os.environ["C"]
+
+KINDS = ["cfa", "rbp", "plt"]
+DENSITIES = ["fixed", "uniform", "geometric"]
+
+# DW_CFA_def_cfa_expression of the standard PLT expression, as recognized by
+# dwarf-assembly
+PLT_EXPR_ESCAPE = (
+    ".cfi_escape 0x0f, 0x0b, 0x77, 0x08, 0x80, 0x00, 0x3f, 0x1a, 0x3b, 0x2a, "
+    "0x33, 0x24, 0x22"
+)
+
+# Deepest CFA offset of a `cfa` FDE, in pushes
+MAX_PUSHES = 16
+
+
+def parse_mix(mix):
+    """ Parse a `kind=weight,...` rule mix into a list of weights, one per
+    kind of `KINDS` """
+    weights = dict.fromkeys(KINDS, 0.0)
+    for item in mix.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in weights or not weight:
+            raise ValueError("bad rule mix item: {}".format(item))
+        weights[kind] = float(weight)
+    if sum(weights.values()) <= 0:
+        raise ValueError("the rule mix has no positive weight")
+    return [weights[kind] for kind in KINDS]
+
+
+def draw_row_count(rng, density, mean):
+    """ Number of rows of an FDE, at least 1 """
+    if density == "fixed":
+        return max(1, round(mean))
+    if density == "uniform":
+        return rng.randint(1, max(1, round(2 * mean - 1)))
+    if mean <= 1:
+        return 1
+    return 1 + int(rng.expovariate(1.0 / (mean - 1)))
+
+
+def cfa_rows(rng, count):
+    """ Directives starting each row but the first of a `cfa` FDE """
+    pushes = 0
+    for _ in range(count - 1):
+        if pushes == 0 or (pushes < MAX_PUSHES and rng.random() < 0.5):
+            pushes += 1
+        else:
+            pushes -= 1
+        yield [".cfi_def_cfa_offset {}".format(8 * (pushes + 1))]
+
+
+def rbp_rows(rng, count):
+    """ Directives starting each row but the first of an `rbp` FDE """
+    prologue = [
+        [".cfi_def_cfa_offset 16", ".cfi_offset %rbp, -16"],
+        [".cfi_def_cfa_register %rbp"],
+    ]
+    epilogue = [".cfi_def_cfa %rsp, 8", ".cfi_restore %rbp"]
+
+    body = count - 1 - len(prologue) - 1
+    if body < 0:
+        for row in prologue[: count - 1]:
+            yield row
+        return
+
+    for row in prologue:
+        yield row
+    for pos in range(body):
+        yield [".cfi_offset %rbx, -24" if pos % 2 == 0 else ".cfi_restore %rbx"]
+    yield epilogue
+
+
+def plt_rows(rng, count):
+    """ Directives starting each row but the first of a `plt` FDE """
+    for pos in range(count - 1):
+        if pos % 2 == 0:
+            yield [PLT_EXPR_ESCAPE]
+        else:
+            yield [".cfi_def_cfa %rsp, {}".format(8 * rng.randint(2, 3))]
+
+
+ROW_GENERATORS = {"cfa": cfa_rows, "rbp": rbp_rows, "plt": plt_rows}
+
+
+def gen_asm(out, args):
+    """ Write the assembly of the object to `out`. Returns the number of FDEs
+    and of rows generated. """
+    rng = random.Random(args.seed)
+    weights = parse_mix(args.mix)
+
+    def nops():
+        out.write("\t.fill {}, 1, 0x90\n".format(rng.randint(1, args.max_row_size)))
+
+    out.write("\t.text\n")
+    fde_count = 0
+    row_count = 0
+    while row_count < args.rows:
+        count = min(
+            draw_row_count(rng, args.density, args.rows_per_fde),
+            args.rows - row_count,
+        )
+        kind = rng.choices(KINDS, weights)[0]
+
+        out.write("\t.p2align 4\n\t.cfi_startproc\n")
+        nops()
+        for directives in ROW_GENERATORS[kind](rng, count):
+            for directive in directives:
+                out.write("\t{}\n".format(directive))
+            nops()
+        out.write("\t.cfi_endproc\n")
+        # Padding, so that consecutive FDEs are never adjacent
+        out.write("\tint3\n")
+
+        fde_count += 1
+        row_count += count
+    out.write('\t.section .note.GNU-stack,"",@progbits\n')
+    return fde_count, row_count
+
+
+def process_args():
+    """ Process `sys.argv` arguments """
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic ELF object with a controlled .eh_frame"
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=100000,
+        help="Total number of rows of the .eh_frame. Defaults to 100000.",
+    )
+    parser.add_argument(
+        "--rows-per-fde",
+        type=float,
+        default=8,
+        help="Average number of rows per FDE. Defaults to 8.",
+    )
+    parser.add_argument(
+        "--density",
+        choices=DENSITIES,
+        default="geometric",
+        help=(
+            "Distribution of the number of rows per FDE: always the average, "
+            "uniform around it, or geometric, ie. many small FDEs and a few "
+            "large ones. Defaults to geometric."
+        ),
+    )
+    parser.add_argument(
+        "--mix",
+        default="cfa=6,rbp=3,plt=1",
+        help=(
+            "Relative weights of the kinds of FDE, as `kind=weight,...`, kind "
+            "being one of {}. Defaults to cfa=6,rbp=3,plt=1."
+        ).format(", ".join(KINDS)),
+    )
+    parser.add_argument(
+        "--max-row-size",
+        type=int,
+        default=8,
+        help="Each row covers 1 to this many bytes of code. Defaults to 8.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "-S",
+        "--asm",
+        action="store_true",
+        help="Output the assembly instead of assembling a shared object",
+    )
+    parser.add_argument(
+        "-o", "--output", required=True, metavar="file", help="Output file"
+    )
+
+    args = parser.parse_args()
+    if args.rows < 1 or args.rows_per_fde < 1 or args.max_row_size < 1:
+        parser.error("--rows, --rows-per-fde and --max-row-size must be positive")
+    try:
+        parse_mix(args.mix)
+    except ValueError as exn:
+        parser.error(str(exn))
+    return args
+
+
+def main():
+    args = process_args()
+
+    asm_path = args.output if args.asm else args.output + ".s"
+    with open(asm_path, "w") as handle:
+        fde_count, row_count = gen_asm(handle, args)
+
+    if not args.asm:
+        try:
+            call_rc = subprocess.call(
+                [C_BIN, "-shared", "-nostdlib", "-o", args.output, asm_path]
+            )
+        finally:
+            os.remove(asm_path)
+        if call_rc != 0:
+            print("Cannot assemble {}".format(args.output), file=sys.stderr)
+            sys.exit(1)
+
+    print("{}: {} FDEs, {} rows".format(args.output, fde_count, row_count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+""" Sweeps synthetic objects of growing `.eh_frame` through
+`generate_eh_elf.py`, and outputs, for each of them, the time and memory taken
+to build its eh_elf, the size of the result, and its lookup latency.
+
+The output is a whitespace-separated table, one line per object and switch
+generation policy, with a commented header, as read by eg. gnuplot.
+"""
+
+import argparse
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+
+BENCHING_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROOT_DIR = os.path.dirname(BENCHING_DIR)
+sys.path.append(ROOT_DIR)
+
+from shared_python import (  # noqa: E402
+    get_elf_sections,
+    eh_frame_size,
+    invoke_objdump_headers,
+    to_eh_elf_path,
+)
+
+
+GEN_SYNTH_ELF = os.path.join(BENCHING_DIR, "synthetic", "gen_synth_elf.py")
+GENERATE_EH_ELF = os.path.join(ROOT_DIR, "generate_eh_elf.py")
+BATCH_UNWIND_DIR = os.path.join(BENCHING_DIR, "batch_unwind")
+BENCH_BATCH = os.path.join(BATCH_UNWIND_DIR, "bench_batch")
+
+POLICIES = ["global-switch", "switch-per-func"]
+
+COLUMNS = [
+    ("rows", "{}"),
+    ("density", "{}"),
+    ("policy", "{}"),
+    ("fdes", "{}"),
+    ("eh_frame_B", "{}"),
+    ("gen_c_s", "{:.2f}"),
+    ("c_size_B", "{}"),
+    ("compile_s", "{:.2f}"),
+    ("compile_rss_MiB", "{:.0f}"),
+    ("eh_elf_B", "{}"),
+    ("scalar_ns", "{:.1f}"),
+    ("batch_ns", "{:.1f}"),
+]
+
+
+def comma_list(arg):
+    return [item for item in arg.split(",") if item]
+
+
+def text_bounds(obj_path):
+    """ The `(beg, end)` addresses of the `.text` section of `obj_path` """
+    for line in invoke_objdump_headers(obj_path):
+        fields = line.split()
+        if len(fields) >= 4 and fields[1] == ".text":
+            beg = int(fields[3], 16)
+            return beg, beg + int(fields[2], 16)
+    raise Exception("{}: no .text section".format(obj_path))
+
+
+def gen_synth_object(rows, density, args, work_dir):
+    """ Generate the synthetic object of this point of the sweep. Returns its
+    path and its number of FDEs. """
+    obj_path = os.path.join(work_dir, "synth.{}.{}.so".format(rows, density))
+    output = subprocess.check_output(
+        [
+            GEN_SYNTH_ELF,
+            "--rows",
+            str(rows),
+            "--density",
+            density,
+            "--rows-per-fde",
+            str(args.rows_per_fde),
+            "--mix",
+            args.mix,
+            "--seed",
+            str(args.seed),
+            "-o",
+            obj_path,
+        ]
+    ).decode("utf-8")
+    fdes = int(re.search(r"(\d+) FDEs", output).group(1))
+    return obj_path, fdes
+
+
+def build_eh_elf(obj_path, policy, args, work_dir):
+    """ Build the eh_elf of `obj_path` with `policy`, returning its path and
+    the stage records of `generate_eh_elf.py --timings` """
+    out_dir = os.path.join(work_dir, policy)
+    timings_path = os.path.join(out_dir, os.path.basename(obj_path) + ".timings")
+    os.makedirs(out_dir, exist_ok=True)
+    subprocess.check_call(
+        [
+            GENERATE_EH_ELF,
+            "--force",
+            "--no-dft-aux",
+            "--enable-batch",
+            "--" + policy,
+            "-o",
+            out_dir,
+            "--timings",
+            timings_path,
+        ]
+        + shlex.split(args.gen_args)
+        + [obj_path],
+        stdout=subprocess.DEVNULL,
+    )
+
+    stages = {}
+    with open(timings_path, "r") as handle:
+        for line in handle:
+            record = json.loads(line)
+            stages[record["stage"]] = record
+    return to_eh_elf_path(obj_path, out_dir), stages
+
+
+def measure_lookups(eh_elf_path, obj_path, args):
+    """ The scalar and batch lookup latencies, in ns, of `eh_elf_path` """
+    beg, end = text_bounds(obj_path)
+    command = [BENCH_BATCH, "-n", str(args.lookups)]
+    if "--enable-deref-arg" in args.gen_args:
+        command.append("-d")
+    command += [
+        os.path.abspath(eh_elf_path),
+        "{:x}".format(beg),
+        "{:x}".format(end),
+    ]
+    output = subprocess.check_output(command).decode("utf-8")
+    scalar = float(re.search(r"scalar: ([\d.]+)", output).group(1))
+    batch = float(re.search(r"batch: *([\d.]+)", output).group(1))
+    return scalar, batch
+
+
+def sweep_point(rows, density, args, work_dir, out):
+    obj_path, fdes = gen_synth_object(rows, density, args, work_dir)
+    for policy in args.policy:
+        eh_elf_path, stages = build_eh_elf(obj_path, policy, args, work_dir)
+        compile_stages = [stages["compile_o"], stages["compile_so"]]
+        scalar_ns, batch_ns = measure_lookups(eh_elf_path, obj_path, args)
+        sections = get_elf_sections(eh_elf_path)
+
+        point = {
+            "rows": rows,
+            "density": density,
+            "policy": policy,
+            "fdes": fdes,
+            "eh_frame_B": eh_frame_size(obj_path),
+            "gen_c_s": stages["gen_c"]["wall"],
+            "c_size_B": stages["gen_c"].get("c_size", 0),
+            "compile_s": sum(stage["wall"] for stage in compile_stages),
+            "compile_rss_MiB": max(
+                stage.get("peak_rss_kb", 0) for stage in compile_stages
+            )
+            / 1024,
+            "eh_elf_B": sum(
+                sections.get(name, {}).get("size", 0)
+                for name in (".text", ".rodata")
+            ),
+            "scalar_ns": scalar_ns,
+            "batch_ns": batch_ns,
+        }
+        out.write(
+            " ".join(fmt.format(point[name]) for name, fmt in COLUMNS) + "\n"
+        )
+        out.flush()
+
+
+def process_args():
+    """ Process `sys.argv` arguments """
+    parser = argparse.ArgumentParser(
+        description=(
+            "Sweep synthetic objects through generate_eh_elf.py, measuring how "
+            "the eh_elfs scale"
+        )
+    )
+    parser.add_argument(
+        "--rows",
+        type=comma_list,
+        default=["1000", "10000", "100000", "1000000"],
+        help=(
+            "Comma-separated numbers of rows of the objects to sweep. Defaults "
+            "to 1000,10000,100000,1000000."
+        ),
+    )
+    parser.add_argument(
+        "--density",
+        type=comma_list,
+        default=["geometric"],
+        help=(
+            "Comma-separated row densities to sweep, see gen_synth_elf.py. "
+            "Defaults to geometric."
+        ),
+    )
+    parser.add_argument(
+        "--policy",
+        type=comma_list,
+        default=POLICIES,
+        help=(
+            "Comma-separated switch generation policies to sweep, among {}. "
+            "Defaults to all of them."
+        ).format(", ".join(POLICIES)),
+    )
+    parser.add_argument(
+        "--rows-per-fde",
+        type=float,
+        default=8,
+        help="Passed to gen_synth_elf.py. Defaults to 8.",
+    )
+    parser.add_argument(
+        "--mix",
+        default="cfa=6,rbp=3,plt=1",
+        help="Passed to gen_synth_elf.py. Defaults to cfa=6,rbp=3,plt=1.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--gen-args",
+        default="",
+        help=(
+            "Extra arguments to generate_eh_elf.py, eg. "
+            '"--eh-frame-reader -O2".'
+        ),
+    )
+    parser.add_argument(
+        "--lookups",
+        type=int,
+        default=100000,
+        help="Number of random PCs looked up by bench_batch. Defaults to 100000.",
+    )
+    parser.add_argument(
+        "--work-dir",
+        metavar="path",
+        help=(
+            "Keep the synthetic objects and their eh_elfs in this directory "
+            "instead of a temporary one"
+        ),
+    )
+    parser.add_argument(
+        "-o", "--output", metavar="file", help="Output file. Defaults to stdout."
+    )
+
+    args = parser.parse_args()
+    try:
+        args.rows = [int(rows) for rows in args.rows]
+    except ValueError:
+        parser.error("--rows must be a list of integers")
+    for policy in args.policy:
+        if policy not in POLICIES:
+            parser.error("unknown policy {}".format(policy))
+    return args
+
+
+def main():
+    args = process_args()
+
+    subprocess.check_call(["make", "-s", "-C", BATCH_UNWIND_DIR])
+
+    out = sys.stdout if args.output is None else open(args.output, "w")
+    out.write("# " + " ".join(name for name, _ in COLUMNS) + "\n")
+    out.flush()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = tmp_dir if args.work_dir is None else args.work_dir
+        os.makedirs(work_dir, exist_ok=True)
+        for density in args.density:
+            for rows in args.rows:
+                sweep_point(rows, density, args, work_dir, out)
+
+    if out is not sys.stdout:
+        out.close()
+
+
+if __name__ == "__main__":
+    main()
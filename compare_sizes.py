@@ -6,10 +6,14 @@ the .text in the generated .eh_elf.so. """
 
 import argparse
 import os
-import subprocess
 from collections import namedtuple
 
-from shared_python import elf_so_deps, readlink_rec, DEFAULT_AUX_DIRS
+from shared_python import (
+    elf_so_deps,
+    readlink_rec,
+    get_elf_sections,
+    DEFAULT_AUX_DIRS,
+)
 
 
 ''' An ELF object, including the path to the ELF itself, and the path to its
@@ -29,41 +33,6 @@ def format_size(size):
     return '{:.1f} {}'.format(size, units[cur_unit])
 
 
-def invoke_objdump_headers(elf_loc):
-    ''' Call objdump -h, returning the list of lines outputted '''
-
-    if not os.path.isfile(elf_loc):
-        raise FileNotFoundError
-
-    try:
-        objdump_out = subprocess.check_output(['objdump', '-h', elf_loc]) \
-            .decode('utf-8')
-    except subprocess.CalledProcessError as exn:
-        raise Exception(("Cannot run objdump on {}: objdump "
-                         "terminated with exit code {}.").format(
-                             elf_loc, exn.returncode))
-
-    return objdump_out.split('\n')
-
-
-def get_elf_sections(elf_loc):
-    ''' List the ELF sections of the given ELF '''
-
-    sections = {}
-    for line in invoke_objdump_headers(elf_loc):
-        line = line.strip()
-        if not line or not '0' <= line[0] <= '9':  # not a section line
-            continue
-
-        spl = line.split()
-        sections[spl[1]] = {
-            'name': spl[1],
-            'size': int(spl[2], 0x10),
-        }
-
-    return sections
-
-
 def matching_eh_elf(eh_locs, elf_name):
     ''' Get the .eh_elf.so file matching elf_name in the list of directories
     eh_locs.
@@ -0,0 +1,262 @@
+#include "batch_unwind.h"
+#include "../shared/context_struct.h"
+
+#include <pthread.h>
+#include <string.h>
+#include <time.h>
+
+typedef _fde_func_with_deref_t (*_fde_lookup_t)(uintptr_t);
+typedef _fde_func_t (*_fde_lookup_no_deref_t)(uintptr_t);
+
+/// The stack copy read by `deref`, for the sample this thread is unwinding
+static __thread const uint8_t* cur_stack;
+static __thread uint64_t cur_stack_beg, cur_stack_size;
+static __thread int cur_deref_failed;
+
+/** Reads from the current sample's stack copy, or flags a failure */
+static uintptr_t deref(uintptr_t addr) {
+    uintptr_t value;
+    if(addr < cur_stack_beg
+            || addr - cur_stack_beg > cur_stack_size
+            || cur_stack_size - (addr - cur_stack_beg) < sizeof(value))
+    {
+        cur_deref_failed = 1;
+        return 0;
+    }
+    memcpy(&value, cur_stack + (addr - cur_stack_beg), sizeof(value));
+    return value;
+}
+
+static const eh_elf_mapping_t* find_mapping(
+        const eh_elf_mapping_t* mappings, size_t mapping_count, uint64_t pc)
+{
+    size_t low = 0, high = mapping_count;
+    while(low < high) {
+        size_t mid = (low + high) / 2;
+        if(pc < mappings[mid].beg)
+            high = mid;
+        else if(pc >= mappings[mid].end)
+            low = mid + 1;
+        else
+            return &mappings[mid];
+    }
+    return NULL;
+}
+
+/** Whether the address in the ELF file `tr_pc` is covered by one of the FDEs
+ * of `mapping` */
+static int covered_by_fde(const eh_elf_mapping_t* mapping, uint64_t tr_pc) {
+    size_t low = 0, high = mapping->fde_range_count;
+    while(low < high) {
+        size_t mid = (low + high) / 2;
+        if(tr_pc < mapping->fde_ranges[2 * mid])
+            high = mid;
+        else if(tr_pc >= mapping->fde_ranges[2 * mid + 1])
+            low = mid + 1;
+        else
+            return 1;
+    }
+    return 0;
+}
+
+/** Unwinds a single sample, returns its number of frames */
+static uint32_t unwind_sample(
+        const eh_elf_mapping_t* mappings, size_t mapping_count,
+        const uint64_t* regs,
+        const uint8_t* stack, uint64_t stack_size,
+        size_t max_depth,
+        uint64_t* out_pcs)
+{
+    unwind_context_t ctx;
+    ctx.flags = 0;
+    ctx.rip = regs[EH_ELF_REG_RIP];
+    ctx.rsp = regs[EH_ELF_REG_RSP];
+    ctx.rbp = regs[EH_ELF_REG_RBP];
+    ctx.rbx = regs[EH_ELF_REG_RBX];
+
+    cur_stack = stack;
+    cur_stack_beg = ctx.rsp;
+    cur_stack_size = stack_size;
+
+    uint32_t depth = 0;
+    while(depth < max_depth) {
+        out_pcs[depth++] = ctx.rip;
+
+        // Past the first frame, `rip` is a return address, which may lie past
+        // the end of the calling function
+        uint64_t pc = (depth > 1) ? ctx.rip - 1 : ctx.rip;
+        const eh_elf_mapping_t* mapping =
+            find_mapping(mappings, mapping_count, pc);
+        if(mapping == NULL)
+            break;
+        uintptr_t tr_pc = pc - mapping->bias;
+
+        _fde_func_with_deref_t fde_func = NULL;
+        if(mapping->eh_elf_func != NULL)
+            fde_func = (_fde_func_with_deref_t) mapping->eh_elf_func;
+        else if(mapping->fde_lookup != NULL && covered_by_fde(mapping, tr_pc))
+            fde_func = ((_fde_lookup_t) mapping->fde_lookup)(tr_pc);
+        if(fde_func == NULL)
+            break;
+
+        cur_deref_failed = 0;
+        unwind_context_t next = fde_func(ctx, tr_pc, deref);
+        if(cur_deref_failed
+                || (next.flags & (1 << UNWF_ERROR))
+                || !(next.flags & (1 << UNWF_RIP))
+                || !(next.flags & (1 << UNWF_RSP))
+                || next.rsp <= ctx.rsp) // The stack must be going up
+            break;
+
+        // Registers without a rule keep their value
+        if(!(next.flags & (1 << UNWF_RBP)))
+            next.rbp = ctx.rbp;
+        if(!(next.flags & (1 << UNWF_RBX)))
+            next.rbx = ctx.rbx;
+        ctx = next;
+    }
+
+    return depth;
+}
+
+/// The share of a batch unwound by a thread
+typedef struct {
+    const eh_elf_mapping_t* mappings;
+    size_t mapping_count;
+    size_t first_sample, last_sample; // last excluded
+    const uint64_t* regs;
+    const uint8_t* stack_data;
+    const uint64_t* stack_offsets;
+    const uint64_t* stack_sizes;
+    size_t max_depth;
+    uint64_t* out_pcs;
+    uint32_t* out_depths;
+    uint64_t frame_count;
+} unwind_job_t;
+
+static void* run_job(void* data) {
+    unwind_job_t* job = (unwind_job_t*) data;
+    job->frame_count = 0;
+    for(size_t sample = job->first_sample; sample < job->last_sample; ++sample)
+    {
+        uint32_t depth = unwind_sample(
+                job->mappings, job->mapping_count,
+                job->regs + sample * EH_ELF_REG_COUNT,
+                job->stack_data + job->stack_offsets[sample],
+                job->stack_sizes[sample],
+                job->max_depth,
+                job->out_pcs + sample * job->max_depth);
+        job->out_depths[sample] = depth;
+        job->frame_count += depth;
+    }
+    return NULL;
+}
+
+uint64_t eh_elf_unwind_batch(
+        const eh_elf_mapping_t* mappings, size_t mapping_count,
+        size_t sample_count,
+        const uint64_t* regs,
+        const uint8_t* stack_data,
+        const uint64_t* stack_offsets,
+        const uint64_t* stack_sizes,
+        size_t max_depth,
+        uint64_t* out_pcs,
+        uint32_t* out_depths,
+        unsigned threads)
+{
+    if(threads == 0)
+        threads = 1;
+    if(threads > sample_count)
+        threads = (sample_count > 0) ? sample_count : 1;
+
+    unwind_job_t jobs[threads];
+    pthread_t thread_ids[threads];
+    for(unsigned thread = 0; thread < threads; ++thread) {
+        unwind_job_t* job = &jobs[thread];
+        job->mappings = mappings;
+        job->mapping_count = mapping_count;
+        job->first_sample = sample_count * thread / threads;
+        job->last_sample = sample_count * (thread + 1) / threads;
+        job->regs = regs;
+        job->stack_data = stack_data;
+        job->stack_offsets = stack_offsets;
+        job->stack_sizes = stack_sizes;
+        job->max_depth = max_depth;
+        job->out_pcs = out_pcs;
+        job->out_depths = out_depths;
+    }
+
+    // The calling thread takes the first share. If a thread cannot be
+    // started, its share is unwound here as well.
+    int started[threads];
+    for(unsigned thread = 1; thread < threads; ++thread)
+        started[thread] = (pthread_create(
+                    &thread_ids[thread], NULL, run_job, &jobs[thread]) == 0);
+    run_job(&jobs[0]);
+
+    uint64_t frame_count = jobs[0].frame_count;
+    for(unsigned thread = 1; thread < threads; ++thread) {
+        if(started[thread])
+            pthread_join(thread_ids[thread], NULL);
+        else
+            run_job(&jobs[thread]);
+        frame_count += jobs[thread].frame_count;
+    }
+    return frame_count;
+}
+
+/// The memory read by `eh_elf_time_lookups`' unwindings
+static uintptr_t lookup_stack[(1 << 20) / sizeof(uintptr_t)];
+
+static uintptr_t lookup_deref(uintptr_t addr) {
+    uintptr_t beg = (uintptr_t) lookup_stack;
+    if(addr < beg || addr - beg > sizeof(lookup_stack) - sizeof(uintptr_t))
+        return 0;
+    return *((uintptr_t*) addr);
+}
+
+double eh_elf_time_lookups(
+        void* eh_elf_func, void* fde_lookup, int with_deref,
+        size_t pc_count, const uint64_t* pcs,
+        unsigned rounds)
+{
+    if(pc_count == 0 || rounds == 0
+            || (eh_elf_func == NULL && fde_lookup == NULL))
+        return 0;
+
+    unwind_context_t ctx;
+    ctx.flags = 0;
+    ctx.rsp = (uintptr_t) lookup_stack + sizeof(lookup_stack) / 2;
+    ctx.rbp = ctx.rsp + 64;
+    ctx.rbx = 0;
+
+    // Keeps the unwindings from being optimized away
+    volatile uint8_t sink = 0;
+
+    struct timespec beg, end;
+    clock_gettime(CLOCK_MONOTONIC, &beg);
+    for(unsigned round = 0; round < rounds; ++round) {
+        for(size_t pos = 0; pos < pc_count; ++pos) {
+            unwind_context_t out;
+            ctx.rip = pcs[pos];
+            if(with_deref) {
+                _fde_func_with_deref_t func = eh_elf_func
+                    ? (_fde_func_with_deref_t) eh_elf_func
+                    : ((_fde_lookup_t) fde_lookup)(pcs[pos]);
+                out = func(ctx, pcs[pos], lookup_deref);
+            }
+            else {
+                _fde_func_t func = eh_elf_func
+                    ? (_fde_func_t) eh_elf_func
+                    : ((_fde_lookup_no_deref_t) fde_lookup)(pcs[pos]);
+                out = func(ctx, pcs[pos]);
+            }
+            sink ^= out.flags;
+        }
+    }
+    clock_gettime(CLOCK_MONOTONIC, &end);
+
+    double elapsed = (end.tv_sec - beg.tv_sec) * 1e9
+        + (end.tv_nsec - beg.tv_nsec);
+    return elapsed / ((double) pc_count * rounds);
+}
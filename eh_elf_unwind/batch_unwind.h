@@ -0,0 +1,84 @@
+/** Unwinds batches of captured samples — registers and a copy of the top of
+ * the stack, as recorded by `perf record --call-graph dwarf` — through eh_elfs
+ * generated with `--enable-deref-arg`.
+ *
+ * The memory reads of the eh_elfs go to the stack copy of the sample being
+ * unwound; reading outside of it stops the unwinding of this sample.
+ */
+
+#pragma once
+
+#include <stddef.h>
+#include <stdint.h>
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+/** A memory mapping of the unwound process, and the eh_elf of its object */
+typedef struct {
+    uint64_t beg, end; ///< Runtime address range, end excluded
+    uint64_t bias; ///< Runtime address minus address in the ELF file
+    void* eh_elf_func; ///< `_eh_elf` of a global switch eh_elf, or NULL
+    void* fde_lookup; ///< `_fde_lookup` of a switch-per-func eh_elf, or NULL
+    /// With `fde_lookup`, the `[beg, end)` ranges of addresses in the ELF file
+    /// covered by an FDE, as `fde_range_count` pairs, sorted and disjoint.
+    /// `fde_lookup` aborts on any other address: it is never called on them.
+    const uint64_t* fde_ranges;
+    size_t fde_range_count;
+} eh_elf_mapping_t;
+
+/** Registers of a sample, in this order in `regs` */
+enum {
+    EH_ELF_REG_RIP,
+    EH_ELF_REG_RSP,
+    EH_ELF_REG_RBP,
+    EH_ELF_REG_RBX,
+    EH_ELF_REG_COUNT
+};
+
+/** Unwind `sample_count` samples.
+ *
+ * \param mappings the mappings, sorted by address and disjoint.
+ * \param regs `EH_ELF_REG_COUNT` registers per sample.
+ * \param stack_data the stack copies of all the samples.
+ * \param stack_offsets, stack_sizes the position of each sample's stack copy
+ *   in `stack_data`. Each copy starts at the sample's `rsp`.
+ * \param max_depth the maximal number of frames of a sample.
+ * \param out_pcs filled with `max_depth` PCs per sample, most recent first.
+ * \param out_depths filled with the number of frames of each sample.
+ * \param threads the number of threads to spread the samples on.
+ *
+ * \return the total number of frames.
+ */
+uint64_t eh_elf_unwind_batch(
+        const eh_elf_mapping_t* mappings, size_t mapping_count,
+        size_t sample_count,
+        const uint64_t* regs,
+        const uint8_t* stack_data,
+        const uint64_t* stack_offsets,
+        const uint64_t* stack_sizes,
+        size_t max_depth,
+        uint64_t* out_pcs,
+        uint32_t* out_depths,
+        unsigned threads);
+
+/** Average time, in nanoseconds, of an unwinding through the scalar entry
+ * point of an eh_elf, `eh_elf_func` or else `fde_lookup`.
+ *
+ * \param with_deref whether the eh_elf was generated with
+ *   `--enable-deref-arg`.
+ * \param pcs the PCs to unwind from, as addresses in the ELF file. Each must
+ *   be covered by an FDE, or `fde_lookup` may abort.
+ * \param rounds the number of times all of `pcs` are unwound.
+ *
+ * The memory reads of the unwinding go to a zero-filled buffer.
+ */
+double eh_elf_time_lookups(
+        void* eh_elf_func, void* fde_lookup, int with_deref,
+        size_t pc_count, const uint64_t* pcs,
+        unsigned rounds);
+
+#ifdef __cplusplus
+}
+#endif
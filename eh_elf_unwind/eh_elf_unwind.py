@@ -0,0 +1,394 @@
+""" Python bindings for batch unwinding through eh_elfs.
+
+Captured samples — registers and a copy of the top of the stack, as recorded by
+`perf record --call-graph dwarf` — are accumulated in a `SampleBatch`, then
+unwound all at once in C by a `BatchUnwinder`, which knows the memory mappings
+of the sampled process and loads the eh_elf of each mapped object.
+
+The eh_elfs must be generated with `--enable-deref-arg`: their memory reads go
+to the stack copy of the sample being unwound.
+"""
+
+import ctypes
+import os
+import struct
+import sys
+from array import array
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared_python import fde_ranges, to_eh_elf_path  # noqa: E402
+
+LIB_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "libeh_elf_unwind.so"
+)
+DEFAULT_MAX_DEPTH = 128
+DEFAULT_LOOKUP_ROUNDS = 10
+
+# The ELF note in which `generate_eh_elf.py` records the GNU build-id of the
+# object an eh_elf was generated from. The eh_elf keeps a build-id of its own.
+SOURCE_NOTE_SECTION = ".note.eh_elf.source"
+SOURCE_NOTE_NAME = b"eh_elf"
+SOURCE_NOTE_TYPE = 1
+
+
+class EhElfMapping(ctypes.Structure):
+    """ `eh_elf_mapping_t` """
+
+    _fields_ = [
+        ("beg", ctypes.c_uint64),
+        ("end", ctypes.c_uint64),
+        ("bias", ctypes.c_uint64),
+        ("eh_elf_func", ctypes.c_void_p),
+        ("fde_lookup", ctypes.c_void_p),
+        ("fde_ranges", ctypes.c_void_p),
+        ("fde_range_count", ctypes.c_size_t),
+    ]
+
+
+def _u64_array(values):
+    """ A ctypes view of the `array('Q')` `values`, without copy """
+    return (ctypes.c_uint64 * len(values)).from_buffer(values)
+
+
+def _entry_point(eh_elf, name):
+    """ The address of the symbol `name` of the loaded `eh_elf`, or None """
+    if not hasattr(eh_elf, name):
+        return None
+    return ctypes.cast(getattr(eh_elf, name), ctypes.c_void_p).value
+
+
+def _read_ehdr(handle, obj_path):
+    """ The ELF header of the 64-bit ELF file open as `handle` """
+    handle.seek(0)
+    ident = handle.read(64)
+    if len(ident) < 64 or ident[:4] != b"\x7fELF" or ident[4] != 2:
+        raise ValueError("{}: not a 64-bit ELF file".format(obj_path))
+    return ident
+
+
+def _read_phdrs(handle, obj_path):
+    """ The `(p_type, p_offset, p_vaddr, p_filesz)` of the program headers of
+    the ELF file open as `handle` """
+    ident = _read_ehdr(handle, obj_path)
+    phoff, = struct.unpack_from("<Q", ident, 0x20)
+    phentsize, phnum = struct.unpack_from("<HH", ident, 0x36)
+    handle.seek(phoff)
+    phdrs = handle.read(phentsize * phnum)
+
+    out = []
+    for pos in range(phnum):
+        p_type, _, p_offset, p_vaddr, _, p_filesz = struct.unpack_from(
+            "<IIQQQQ", phdrs, pos * phentsize
+        )
+        out.append((p_type, p_offset, p_vaddr, p_filesz))
+    return out
+
+
+def load_bias(obj_path, beg, pgoff):
+    """ The difference between the runtime addresses of the object at `obj_path`,
+    mapped at `beg` from the file offset `pgoff`, and its addresses in the ELF
+    file """
+    with open(obj_path, "rb") as handle:
+        phdrs = _read_phdrs(handle, obj_path)
+
+    for p_type, p_offset, p_vaddr, p_filesz in phdrs:
+        if p_type == 1 and p_offset <= pgoff < p_offset + max(p_filesz, 1):  # LOAD
+            return beg - pgoff - p_vaddr + p_offset
+    return beg - pgoff
+
+
+def _read_section(handle, obj_path, name):
+    """ The contents of the section `name` of the ELF file open as `handle`, or
+    None if it has none """
+    ident = _read_ehdr(handle, obj_path)
+    shoff, = struct.unpack_from("<Q", ident, 0x28)
+    shentsize, shnum, shstrndx = struct.unpack_from("<HHH", ident, 0x3A)
+    if shoff == 0 or shstrndx >= shnum:
+        return None
+    handle.seek(shoff)
+    shdrs = handle.read(shentsize * shnum)
+
+    def shdr(pos):  # `(sh_name, sh_offset, sh_size)`
+        sh_name, _, _, _, sh_offset, sh_size = struct.unpack_from(
+            "<IIQQQQ", shdrs, pos * shentsize
+        )
+        return sh_name, sh_offset, sh_size
+
+    _, strtab_offset, strtab_size = shdr(shstrndx)
+    handle.seek(strtab_offset)
+    strtab = handle.read(strtab_size)
+    wanted = name.encode() + b"\0"
+    for pos in range(shnum):
+        sh_name, sh_offset, sh_size = shdr(pos)
+        if strtab[sh_name : sh_name + len(wanted)] == wanted:
+            handle.seek(sh_offset)
+            return handle.read(sh_size)
+    return None
+
+
+def _find_note(notes, name, n_type):
+    """ The descriptor of the note `name` of type `n_type` in the notes
+    `notes`, or None """
+    name += b"\0"
+    pos = 0
+    while pos + 12 <= len(notes):
+        namesz, descsz, cur_type = struct.unpack_from("<III", notes, pos)
+        name_pos = pos + 12
+        desc_pos = name_pos + ((namesz + 3) & ~3)
+        if cur_type == n_type and notes[name_pos : name_pos + namesz] == name:
+            return notes[desc_pos : desc_pos + descsz]
+        pos = desc_pos + ((descsz + 3) & ~3)
+    return None
+
+
+def read_build_id(obj_path):
+    """ The GNU build-id of the object at `obj_path`, as bytes, or None if it
+    has none """
+    with open(obj_path, "rb") as handle:
+        for p_type, p_offset, _, p_filesz in _read_phdrs(handle, obj_path):
+            if p_type != 4:  # NOTE
+                continue
+            handle.seek(p_offset)
+            build_id = _find_note(handle.read(p_filesz), b"GNU", 3)
+            if build_id is not None:
+                return build_id
+    return None
+
+
+def read_source_build_id(eh_elf_path):
+    """ The GNU build-id of the object the eh_elf at `eh_elf_path` was
+    generated from, as recorded by `generate_eh_elf.py`, or None """
+    with open(eh_elf_path, "rb") as handle:
+        notes = _read_section(handle, eh_elf_path, SOURCE_NOTE_SECTION)
+    if notes is None:
+        return None
+    return _find_note(notes, SOURCE_NOTE_NAME, SOURCE_NOTE_TYPE)
+
+
+def read_fde_ranges(obj_path):
+    """ The `[beg, end)` ranges of the object at `obj_path` covered by an FDE,
+    merged and flattened in an `array('Q')`, as `eh_elf_mapping_t` expects
+    them """
+    try:
+        ranges = sorted(fde_ranges(obj_path))
+    except Exception as exn:
+        raise ValueError("{}: cannot read its FDEs: {}".format(obj_path, exn))
+
+    out = array("Q")
+    for beg, end in ranges:
+        if out and beg <= out[-1]:
+            out[-1] = max(out[-1], end)
+        else:
+            out.extend((beg, end))
+    return out
+
+
+def make_c_mappings(mappings):
+    """ The `eh_elf_mapping_t` array of `mappings`, `(beg, end, bias,
+    eh_elf_func, fde_lookup, fde_ranges, fde_range_count)` tuples, sorted """
+    mappings = sorted(mappings)
+    return (EhElfMapping * len(mappings))(
+        *[EhElfMapping(*mapping) for mapping in mappings]
+    )
+
+
+class SampleBatch:
+    """ Samples to unwind, stored as the flat arrays the C side works on """
+
+    def __init__(self):
+        self.regs = array("Q")
+        self.stack_offsets = array("Q")
+        self.stack_sizes = array("Q")
+        self.stack_data = bytearray()
+
+    def __len__(self):
+        return len(self.stack_sizes)
+
+    def add(self, rip, rsp, rbp, rbx, stack):
+        """ Add a sample. `stack` is a copy of the memory starting at `rsp`. """
+        self.regs.extend((rip, rsp, rbp, rbx))
+        self.stack_offsets.append(len(self.stack_data))
+        self.stack_sizes.append(len(stack))
+        self.stack_data += stack
+
+
+class UnwindResult:
+    """ The call stacks of a batch: `pcs` holds `max_depth` PCs per sample,
+    most recent first, of which the first `depths[sample]` are meaningful. """
+
+    def __init__(self, pcs, depths, max_depth, frame_count):
+        self.pcs = pcs
+        self.depths = depths
+        self.max_depth = max_depth
+        self.frame_count = frame_count
+
+    def __len__(self):
+        return len(self.depths)
+
+    def __getitem__(self, sample):
+        beg = sample * self.max_depth
+        return self.pcs[beg : beg + self.depths[sample]]
+
+    def __iter__(self):
+        for sample in range(len(self.depths)):
+            yield self[sample]
+
+
+class BatchUnwinder:
+    """ Unwinds `SampleBatch`es of a process, given its memory mappings """
+
+    def __init__(self, eh_elf_dirs, lib_path=LIB_PATH):
+        """ The eh_elfs are searched for in `eh_elf_dirs`. `lib_path` is the
+        compiled `batch_unwind.c`. """
+        self.eh_elf_dirs = eh_elf_dirs
+        self.lib = ctypes.CDLL(lib_path)
+        self.lib.eh_elf_unwind_batch.restype = ctypes.c_uint64
+        self.lib.eh_elf_unwind_batch.argtypes = [
+            ctypes.POINTER(EhElfMapping),
+            ctypes.c_size_t,
+            ctypes.c_size_t,
+            ctypes.POINTER(ctypes.c_uint64),
+            ctypes.POINTER(ctypes.c_uint8),
+            ctypes.POINTER(ctypes.c_uint64),
+            ctypes.POINTER(ctypes.c_uint64),
+            ctypes.c_size_t,
+            ctypes.POINTER(ctypes.c_uint64),
+            ctypes.POINTER(ctypes.c_uint32),
+            ctypes.c_uint,
+        ]
+        self.eh_elfs = {}  # obj path -> loaded eh_elf, or None if missing
+        self.mappings = []
+        self.c_mappings = None
+
+    def find_eh_elf(self, obj_path):
+        """ The path of the eh_elf of `obj_path`, or None """
+        for eh_elf_dir in self.eh_elf_dirs:
+            eh_elf_path = to_eh_elf_path(obj_path, eh_elf_dir)
+            if os.path.exists(eh_elf_path):
+                return eh_elf_path
+        return None
+
+    def open_eh_elf(self, eh_elf_path, obj_path):
+        """ The `(eh_elf_func, fde_lookup, fde_ranges, fde_range_count)` of the
+        eh_elf at `eh_elf_path`, generated from `obj_path`, as in
+        `eh_elf_mapping_t`, followed by what must be kept referenced.
+
+        `_fde_lookup` aborts on a PC outside of every FDE: with a
+        switch-per-func eh_elf, the FDE ranges of `obj_path` are read, and the
+        other PCs end the call stack instead. """
+        eh_elf = ctypes.CDLL(eh_elf_path)
+        eh_elf_func = _entry_point(eh_elf, "_eh_elf")
+        ranges = array("Q")
+        if eh_elf_func is None:
+            ranges = read_fde_ranges(obj_path)
+        # Keep `eh_elf` and `ranges` referenced, so that they are never freed
+        return (
+            eh_elf_func,
+            _entry_point(eh_elf, "_fde_lookup"),
+            ranges.buffer_info()[0] if ranges else None,
+            len(ranges) // 2,
+            eh_elf,
+            ranges,
+        )
+
+    def load_eh_elf(self, obj_path):
+        """ The `open_eh_elf` entry points of the eh_elf of `obj_path`, or None
+        if it has none """
+        if obj_path not in self.eh_elfs:
+            entry_points = None
+            eh_elf_path = self.find_eh_elf(obj_path)
+            if eh_elf_path is not None:
+                entry_points = self.open_eh_elf(eh_elf_path, obj_path)
+            self.eh_elfs[obj_path] = entry_points
+        return self.eh_elfs[obj_path]
+
+    def add_mapping(self, beg, end, pgoff, obj_path):
+        """ Declare that `obj_path` is mapped at `[beg, end)` from its offset
+        `pgoff`, as in `/proc/PID/maps` or perf's mmap events. Returns whether
+        an eh_elf was found for it. """
+        entry_points = self.load_eh_elf(obj_path)
+        if entry_points is None:
+            return False
+        self.mappings.append(
+            (beg, end, load_bias(obj_path, beg, pgoff)) + entry_points[:4]
+        )
+        self.c_mappings = None
+        return True
+
+    def clear_mappings(self):
+        """ Forget all the mappings, eg. to unwind another process. The loaded
+        eh_elfs are kept. """
+        self.mappings = []
+        self.c_mappings = None
+
+    def _sorted_mappings(self):
+        if self.c_mappings is None:
+            self.c_mappings = make_c_mappings(self.mappings)
+        return self.c_mappings
+
+    def unwind(self, batch, max_depth=DEFAULT_MAX_DEPTH, threads=1):
+        """ Unwind all the samples of `batch`, spread over `threads` threads.
+        Returns an `UnwindResult`. """
+        return self.unwind_with(self._sorted_mappings(), batch, max_depth, threads)
+
+    def unwind_with(self, mappings, batch, max_depth=DEFAULT_MAX_DEPTH, threads=1):
+        """ Same as `unwind`, with the `make_c_mappings` array `mappings`
+        instead of the declared mappings """
+        sample_count = len(batch)
+        pcs = array("Q", [0]) * (sample_count * max_depth)
+        depths = array("I", [0]) * sample_count
+        if sample_count == 0:
+            return UnwindResult(pcs, depths, max_depth, 0)
+
+        stack_data = None
+        if batch.stack_data:
+            stack_data = (ctypes.c_uint8 * len(batch.stack_data)).from_buffer(
+                batch.stack_data
+            )
+        frame_count = self.lib.eh_elf_unwind_batch(
+            mappings,
+            len(mappings),
+            sample_count,
+            _u64_array(batch.regs),
+            stack_data,
+            _u64_array(batch.stack_offsets),
+            _u64_array(batch.stack_sizes),
+            max_depth,
+            _u64_array(pcs),
+            (ctypes.c_uint32 * sample_count).from_buffer(depths),
+            threads,
+        )
+        return UnwindResult(pcs, depths, max_depth, frame_count)
+
+
+def time_lookups(
+    eh_elf_path, pcs, with_deref=False, rounds=DEFAULT_LOOKUP_ROUNDS, lib_path=LIB_PATH
+):
+    """ The average time, in nanoseconds, of an unwinding through the scalar
+    entry point of the eh_elf at `eh_elf_path`, from each of `pcs`, addresses
+    in its original object that are covered by an FDE. `with_deref` tells
+    whether the eh_elf was generated with `--enable-deref-arg`.
+
+    The eh_elf stays loaded in the calling process: time many eh_elfs from a
+    short-lived process. """
+    lib = ctypes.CDLL(lib_path)
+    lib.eh_elf_time_lookups.restype = ctypes.c_double
+    lib.eh_elf_time_lookups.argtypes = [
+        ctypes.c_void_p,
+        ctypes.c_void_p,
+        ctypes.c_int,
+        ctypes.c_size_t,
+        ctypes.POINTER(ctypes.c_uint64),
+        ctypes.c_uint,
+    ]
+
+    eh_elf = ctypes.CDLL(os.path.abspath(eh_elf_path))
+    pcs = array("Q", pcs)
+    return lib.eh_elf_time_lookups(
+        _entry_point(eh_elf, "_eh_elf"),
+        _entry_point(eh_elf, "_fde_lookup"),
+        int(with_deref),
+        len(pcs),
+        _u64_array(pcs),
+        rounds,
+    )
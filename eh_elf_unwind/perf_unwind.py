@@ -0,0 +1,669 @@
+#!/usr/bin/env python3
+
+""" Unwinds the samples of a `perf record --call-graph dwarf` session through
+eh_elfs, on a pool of processes, and outputs folded stacks.
+
+The perf.data file is indexed once, sequentially: mmap, fork and comm events
+are replayed to track the memory mappings of each process, and the samples are
+grouped into chunks that share the same mappings. The chunks are then unwound
+by worker processes, each of which maps the perf.data file and reads the
+registers and stack copies of its samples by itself.
+
+Only the user-space part of the call stacks is unwound. The eh_elfs must be
+generated with `--enable-deref-arg`.
+"""
+
+import argparse
+import bisect
+import concurrent.futures
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import Counter, namedtuple
+
+from eh_elf_unwind import DEFAULT_MAX_DEPTH, BatchUnwinder, SampleBatch, load_bias
+from unwind_broker import BrokerClient, BrokerError
+
+PERF_MAGIC = b"PERFILE2"
+
+PERF_RECORD_MMAP = 1
+PERF_RECORD_COMM = 3
+PERF_RECORD_FORK = 7
+PERF_RECORD_SAMPLE = 9
+PERF_RECORD_MMAP2 = 10
+
+PERF_RECORD_MISC_MMAP_DATA = 1 << 13
+PERF_RECORD_MISC_COMM_EXEC = 1 << 13
+
+PERF_SAMPLE_IP = 1 << 0
+PERF_SAMPLE_TID = 1 << 1
+PERF_SAMPLE_TIME = 1 << 2
+PERF_SAMPLE_ADDR = 1 << 3
+PERF_SAMPLE_READ = 1 << 4
+PERF_SAMPLE_CALLCHAIN = 1 << 5
+PERF_SAMPLE_ID = 1 << 6
+PERF_SAMPLE_CPU = 1 << 7
+PERF_SAMPLE_PERIOD = 1 << 8
+PERF_SAMPLE_STREAM_ID = 1 << 9
+PERF_SAMPLE_RAW = 1 << 10
+PERF_SAMPLE_BRANCH_STACK = 1 << 11
+PERF_SAMPLE_REGS_USER = 1 << 12
+PERF_SAMPLE_STACK_USER = 1 << 13
+PERF_SAMPLE_IDENTIFIER = 1 << 16
+
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+PERF_FORMAT_ID = 1 << 2
+PERF_FORMAT_GROUP = 1 << 3
+PERF_FORMAT_LOST = 1 << 4
+
+PERF_SAMPLE_BRANCH_HW_INDEX = 1 << 17
+PERF_SAMPLE_BRANCH_COUNTERS = 1 << 19
+
+PROT_EXEC = 4
+
+# `enum perf_event_x86_regs`
+PERF_REG_X86_BX = 1
+PERF_REG_X86_BP = 6
+PERF_REG_X86_SP = 7
+PERF_REG_X86_IP = 8
+
+# In the order of `SampleBatch.add`
+UNWIND_REGS = [PERF_REG_X86_IP, PERF_REG_X86_SP, PERF_REG_X86_BP, PERF_REG_X86_BX]
+
+DEFAULT_CHUNK_SIZE = 4096
+
+
+class PerfDataError(Exception):
+    """ The perf.data file is malformed, or unsupported """
+
+
+# A memory mapping of a sampled process
+Mapping = namedtuple("Mapping", ["beg", "end", "pgoff", "path"])
+
+# The state of a sampled process. `maps` is a tuple of `Mapping`s, sorted and
+# disjoint.
+ProcessState = namedtuple("ProcessState", ["comm", "maps"])
+
+
+class PerfAttr:
+    """ The sample layout of an event of a perf.data file """
+
+    def __init__(self, raw_attr):
+        if len(raw_attr) < 96:
+            raise PerfDataError("perf_event_attr too short")
+        self.sample_type, self.read_format = struct.unpack_from("<QQ", raw_attr, 24)
+        self.branch_sample_type, self.regs_user_mask = struct.unpack_from(
+            "<QQ", raw_attr, 72
+        )
+
+        needed = PERF_SAMPLE_TID | PERF_SAMPLE_REGS_USER | PERF_SAMPLE_STACK_USER
+        if self.sample_type & needed != needed:
+            raise PerfDataError(
+                "samples lack user registers or stack, "
+                "record with `perf record --call-graph dwarf`"
+            )
+
+        # Position of each unwinding register among the sampled ones
+        self.reg_positions = []
+        for reg in UNWIND_REGS:
+            if not self.regs_user_mask & (1 << reg):
+                raise PerfDataError("register {} is not sampled".format(reg))
+            self.reg_positions.append(
+                bin(self.regs_user_mask & ((1 << reg) - 1)).count("1")
+            )
+        self.reg_count = bin(self.regs_user_mask).count("1")
+
+        # Samples start with the fields below, in this order
+        self.tid_pos = 8
+        if self.sample_type & PERF_SAMPLE_IDENTIFIER:
+            self.tid_pos += 8
+        if self.sample_type & PERF_SAMPLE_IP:
+            self.tid_pos += 8
+
+    def read_size(self, data, pos):
+        """ The size of the `PERF_SAMPLE_READ` field at `pos` """
+        fields = 1  # value
+        if self.read_format & PERF_FORMAT_ID:
+            fields += 1
+        if self.read_format & PERF_FORMAT_LOST:
+            fields += 1
+        times = bin(
+            self.read_format
+            & (PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING)
+        ).count("1")
+        if self.read_format & PERF_FORMAT_GROUP:
+            nr, = struct.unpack_from("<Q", data, pos)
+            return 8 * (1 + times + nr * fields)
+        return 8 * (times + fields)
+
+    def parse_sample(self, data, offset):
+        """ The `(rip, rsp, rbp, rbx)` registers and the stack copy of the
+        sample record at `offset` in `data`, or None if it has no user-space
+        context """
+        pos = offset + self.tid_pos + 8
+        sample_type = self.sample_type
+        for field in (
+            PERF_SAMPLE_TIME,
+            PERF_SAMPLE_ADDR,
+            PERF_SAMPLE_ID,
+            PERF_SAMPLE_STREAM_ID,
+            PERF_SAMPLE_CPU,
+            PERF_SAMPLE_PERIOD,
+        ):
+            if sample_type & field:
+                pos += 8
+        if sample_type & PERF_SAMPLE_READ:
+            pos += self.read_size(data, pos)
+        if sample_type & PERF_SAMPLE_CALLCHAIN:
+            nr, = struct.unpack_from("<Q", data, pos)
+            pos += 8 * (1 + nr)
+        if sample_type & PERF_SAMPLE_RAW:
+            size, = struct.unpack_from("<I", data, pos)
+            pos += 4 + size
+        if sample_type & PERF_SAMPLE_BRANCH_STACK:
+            nr, = struct.unpack_from("<Q", data, pos)
+            pos += 8 + 24 * nr
+            if self.branch_sample_type & PERF_SAMPLE_BRANCH_HW_INDEX:
+                pos += 8
+            if self.branch_sample_type & PERF_SAMPLE_BRANCH_COUNTERS:
+                pos += 8 * nr
+
+        abi, = struct.unpack_from("<Q", data, pos)
+        pos += 8
+        if abi == 0:
+            return None
+        regs = struct.unpack_from("<{}Q".format(self.reg_count), data, pos)
+        pos += 8 * self.reg_count
+
+        size, = struct.unpack_from("<Q", data, pos)
+        pos += 8
+        if size == 0:
+            return None
+        dyn_size, = struct.unpack_from("<Q", data, pos + size)
+        stack = memoryview(data)[pos : pos + min(size, dyn_size)]
+        return tuple(regs[reg_pos] for reg_pos in self.reg_positions), stack
+
+
+class PerfData:
+    """ A perf.data file, mapped in memory """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as handle:
+            self.data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.data[:8] != PERF_MAGIC:
+            raise PerfDataError(
+                "{}: not a perf.data file, or recorded in pipe mode".format(path)
+            )
+        (
+            attr_size,
+            attrs_offset,
+            attrs_size,
+            self.data_offset,
+            self.data_size,
+        ) = struct.unpack_from("<5Q", self.data, 16)
+
+        # Events recorded together must share the same sample layout
+        self.attr = None
+        for attr_pos in range(attrs_offset, attrs_offset + attrs_size, attr_size):
+            raw_attr = self.data[attr_pos : attr_pos + attr_size - 16]
+            attr = PerfAttr(raw_attr)
+            if self.attr is None:
+                self.attr = attr
+            elif (attr.sample_type, attr.regs_user_mask) != (
+                self.attr.sample_type,
+                self.attr.regs_user_mask,
+            ):
+                raise PerfDataError("events with different sample layouts")
+        if self.attr is None:
+            raise PerfDataError("no event in {}".format(path))
+
+    def close(self):
+        self.data.close()
+
+    def records(self):
+        """ Iterates over the `(type, misc, offset, size)` of the records """
+        pos = self.data_offset
+        end = self.data_offset + self.data_size
+        data = self.data
+        while pos + 8 <= end:
+            rec_type, misc, size = struct.unpack_from("<IHH", data, pos)
+            if size < 8:
+                raise PerfDataError("malformed record at offset {}".format(pos))
+            yield rec_type, misc, pos, size
+            pos += size
+
+    def sample_pid(self, offset):
+        return struct.unpack_from("<I", self.data, offset + self.attr.tid_pos)[0]
+
+    def parse_sample(self, offset):
+        return self.attr.parse_sample(self.data, offset)
+
+    def read_mmap(self, rec_type, misc, offset, size):
+        """ The `(pid, Mapping)` of a mmap record, or None if the mapping is not
+        executable """
+        if rec_type == PERF_RECORD_MMAP:
+            if misc & PERF_RECORD_MISC_MMAP_DATA:
+                return None
+            pid, _, beg, length, pgoff = struct.unpack_from(
+                "<IIQQQ", self.data, offset + 8
+            )
+            name_pos = offset + 40
+        else:
+            pid, _, beg, length, pgoff = struct.unpack_from(
+                "<IIQQQ", self.data, offset + 8
+            )
+            prot, = struct.unpack_from("<I", self.data, offset + 64)
+            if not prot & PROT_EXEC:
+                return None
+            name_pos = offset + 72
+        name_end = self.data.find(b"\0", name_pos, offset + size)
+        if name_end < 0:
+            name_end = offset + size
+        path = self.data[name_pos:name_end].decode(errors="replace")
+        return pid, Mapping(beg, beg + length, pgoff, path)
+
+    def read_comm(self, offset, size):
+        """ The `(pid, comm)` of a comm record """
+        pid, = struct.unpack_from("<I", self.data, offset + 8)
+        name_end = self.data.find(b"\0", offset + 16, offset + size)
+        if name_end < 0:
+            name_end = offset + size
+        return pid, self.data[offset + 16 : name_end].decode(errors="replace")
+
+    def read_fork(self, offset):
+        """ The `(pid, ppid)` of a fork record """
+        return struct.unpack_from("<II", self.data, offset + 8)
+
+
+def add_mapping(maps, mapping):
+    """ `maps`, with `mapping` replacing the mappings it overlaps """
+    kept = [m for m in maps if m.end <= mapping.beg or m.beg >= mapping.end]
+    kept.append(mapping)
+    kept.sort()
+    return tuple(kept)
+
+
+def index_samples(perf, chunk_size):
+    """ Replay the process events of `perf`, and iterate over chunks of at most
+    `chunk_size` samples sharing the same process state, as `(ProcessState,
+    offsets)` pairs. The offsets are those of the sample records. """
+
+    processes = {}  # pid -> ProcessState
+    pending = {}  # pid -> offsets of the samples since its last state change
+
+    def process_of(pid):
+        if pid not in processes:
+            processes[pid] = ProcessState("[{}]".format(pid), ())
+        return processes[pid]
+
+    def flush(pid):
+        """ Emit the pending samples of `pid`, before its state changes """
+        if pid in pending:
+            yield processes[pid], pending.pop(pid)
+
+    for rec_type, misc, offset, size in perf.records():
+        if rec_type == PERF_RECORD_SAMPLE:
+            pid = perf.sample_pid(offset)
+            offsets = pending.get(pid)
+            if offsets is None:
+                process_of(pid)
+                offsets = pending[pid] = array("Q")
+            offsets.append(offset)
+            if len(offsets) >= chunk_size:
+                yield from flush(pid)
+
+        elif rec_type in (PERF_RECORD_MMAP, PERF_RECORD_MMAP2):
+            mmap_event = perf.read_mmap(rec_type, misc, offset, size)
+            if mmap_event is not None:
+                pid, mapping = mmap_event
+                yield from flush(pid)
+                state = process_of(pid)
+                processes[pid] = state._replace(maps=add_mapping(state.maps, mapping))
+
+        elif rec_type == PERF_RECORD_COMM:
+            pid, comm = perf.read_comm(offset, size)
+            yield from flush(pid)
+            state = process_of(pid)
+            if misc & PERF_RECORD_MISC_COMM_EXEC:
+                state = state._replace(maps=())
+            processes[pid] = state._replace(comm=comm)
+
+        elif rec_type == PERF_RECORD_FORK:
+            pid, ppid = perf.read_fork(offset)
+            if pid != ppid and ppid in processes:
+                yield from flush(pid)
+                processes[pid] = processes[ppid]
+
+    for pid in list(pending):
+        yield from flush(pid)
+
+
+class Symbolizer:
+    """ Turns PCs into function names, from the symbol tables of the mapped
+    objects """
+
+    def __init__(self):
+        self.symtabs = {}  # obj path -> (starts, ends, names), or None
+        self.biases = {}  # Mapping -> load bias
+
+    def symtab(self, path):
+        if path not in self.symtabs:
+            self.symtabs[path] = self.read_symtab(path)
+        return self.symtabs[path]
+
+    @staticmethod
+    def read_symtab(path):
+        from elftools.elf.elffile import ELFFile
+        from elftools.common.exceptions import ELFError
+
+        symbols = set()
+        try:
+            with open(path, "rb") as handle:
+                elf = ELFFile(handle)
+                for section_name in (".symtab", ".dynsym"):
+                    section = elf.get_section_by_name(section_name)
+                    if section is None:
+                        continue
+                    for symbol in section.iter_symbols():
+                        if (
+                            symbol["st_info"]["type"] == "STT_FUNC"
+                            and symbol["st_value"] != 0
+                        ):
+                            symbols.add(
+                                (symbol["st_value"], symbol["st_size"], symbol.name)
+                            )
+        except (OSError, ELFError):
+            return None
+
+        symbols = sorted(symbols)
+        return (
+            [start for start, _, _ in symbols],
+            [start + size for start, size, _ in symbols],
+            [name for _, _, name in symbols],
+        )
+
+    def name(self, mapping, pc):
+        """ The name of the function containing `pc`, in `mapping` """
+        obj_name = "[{}]".format(os.path.basename(mapping.path))
+        symtab = self.symtab(mapping.path)
+        if symtab is None:
+            return obj_name
+        if mapping not in self.biases:
+            try:
+                self.biases[mapping] = load_bias(
+                    mapping.path, mapping.beg, mapping.pgoff
+                )
+            except (OSError, ValueError):
+                self.biases[mapping] = None
+        if self.biases[mapping] is None:
+            return obj_name
+
+        vaddr = pc - self.biases[mapping]
+        starts, ends, names = symtab
+        pos = bisect.bisect_right(starts, vaddr) - 1
+        if pos < 0 or (vaddr >= ends[pos] and ends[pos] != starts[pos]):
+            return obj_name
+        return names[pos]
+
+
+def fold(state, call_stack, symbolizer):
+    """ The folded representation of `call_stack`, most recent PC first: the
+    process name, then the frames from the outermost one, `;`-separated """
+    map_starts = [mapping.beg for mapping in state.maps]
+    frames = [state.comm]
+    for depth in range(len(call_stack) - 1, -1, -1):
+        # Return addresses may lie past the end of the calling function
+        pc = call_stack[depth] - (1 if depth > 0 else 0)
+        if symbolizer is None:
+            frames.append("{:#x}".format(pc))
+            continue
+        pos = bisect.bisect_right(map_starts, pc) - 1
+        if pos < 0 or pc >= state.maps[pos].end:
+            frames.append("[unknown]")
+        else:
+            frames.append(symbolizer.name(state.maps[pos], pc))
+    return ";".join(frames)
+
+
+class Worker:
+    """ The state of a worker process, set by `init_worker` """
+
+    perf = None
+    unwinder = None
+    state = None
+    symbolizer = None
+    max_depth = DEFAULT_MAX_DEPTH
+    threads = 1
+
+
+def init_worker(perf_path, eh_elf_dirs, broker, max_depth, threads, symbolize):
+    Worker.perf = PerfData(perf_path)
+    if broker is not None:
+        Worker.unwinder = BrokerClient(broker)
+    else:
+        Worker.unwinder = BatchUnwinder(eh_elf_dirs)
+    Worker.symbolizer = Symbolizer() if symbolize else None
+    Worker.max_depth = max_depth
+    Worker.threads = threads
+
+
+def unwind_chunk(state, offsets):
+    """ Unwind the samples at `offsets` of a process in `state`. Returns the
+    folded stacks `Counter`, and the `(samples, skipped, frames,
+    unwind_time)` statistics. """
+
+    if state.maps != Worker.state:
+        Worker.unwinder.clear_mappings()
+        for mapping in state.maps:
+            if mapping.path.startswith("/"):
+                Worker.unwinder.add_mapping(*mapping)
+        Worker.state = state.maps
+
+    batch = SampleBatch()
+    for offset in offsets:
+        sample = Worker.perf.parse_sample(offset)
+        if sample is not None:
+            batch.add(*sample[0], sample[1])
+
+    unwind_start = time.perf_counter()
+    result = Worker.unwinder.unwind(batch, Worker.max_depth, Worker.threads)
+    unwind_time = time.perf_counter() - unwind_start
+
+    call_stacks = Counter(tuple(call_stack) for call_stack in result)
+    folded = Counter()
+    for call_stack, count in call_stacks.items():
+        folded[fold(state, call_stack, Worker.symbolizer)] += count
+
+    stats = (len(batch), len(offsets) - len(batch), result.frame_count, unwind_time)
+    return folded, stats
+
+
+def unwind_perf_data(
+    perf_path,
+    eh_elf_dirs,
+    jobs=1,
+    threads=1,
+    max_depth=DEFAULT_MAX_DEPTH,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    symbolize=True,
+    broker=None,
+):
+    """ Unwind all the samples of `perf_path` over `jobs` processes, or
+    through the `unwind_broker` listening at `broker` if set. Returns the
+    folded stacks `Counter`, and a dict of statistics. """
+
+    perf = PerfData(perf_path)
+    if broker is not None:
+        BrokerClient(broker).close()  # Fail early if it cannot be reached
+    folded = Counter()
+    stats = {"samples": 0, "skipped": 0, "frames": 0, "unwind_time": 0.0}
+
+    def collect(future):
+        chunk_folded, (samples, skipped, frames, unwind_time) = future.result()
+        folded.update(chunk_folded)
+        stats["samples"] += samples
+        stats["skipped"] += skipped
+        stats["frames"] += frames
+        stats["unwind_time"] += unwind_time
+
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=init_worker,
+        initargs=(perf_path, eh_elf_dirs, broker, max_depth, threads, symbolize),
+    ) as executor:
+        # Bound the number of chunks in flight, so that the index of a large
+        # perf.data is never held in memory at once
+        in_flight = set()
+        for state, offsets in index_samples(perf, chunk_size):
+            if len(in_flight) >= 2 * jobs:
+                done, in_flight = concurrent.futures.wait(
+                    in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    collect(future)
+            in_flight.add(executor.submit(unwind_chunk, state, offsets))
+        for future in concurrent.futures.as_completed(in_flight):
+            collect(future)
+    stats["wall_time"] = time.perf_counter() - start
+
+    perf.close()
+    return folded, stats
+
+
+def process_args():
+    """ Process `sys.argv` arguments """
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Unwind the samples of a `perf record --call-graph dwarf` session "
+            "through eh_elfs, and output folded stacks"
+        )
+    )
+
+    parser.add_argument(
+        "-i",
+        "--input",
+        metavar="path",
+        default="perf.data",
+        help="The perf.data file to read. Defaults to ./perf.data.",
+    )
+    parser.add_argument(
+        "-e",
+        "--eh-elfs",
+        metavar="dir",
+        action="append",
+        default=[],
+        help=(
+            "A directory containing eh_elfs generated with --enable-deref-arg. "
+            "Can be given multiple times."
+        ),
+    )
+    parser.add_argument(
+        "--broker",
+        metavar="socket",
+        help=(
+            "Unwind through the unwind_broker.py listening on this socket, "
+            "instead of loading the eh_elfs in each worker process"
+        ),
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        metavar="path",
+        help="Write the folded stacks there instead of the standard output",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        metavar="N",
+        default=os.cpu_count(),
+        help="Unwind over N processes. Defaults to the number of CPUs.",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        metavar="N",
+        default=1,
+        help="Unwind each chunk of samples over N threads. Defaults to 1.",
+    )
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        metavar="N",
+        default=DEFAULT_MAX_DEPTH,
+        help="Unwind at most N frames per sample. Defaults to {}.".format(
+            DEFAULT_MAX_DEPTH
+        ),
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        metavar="N",
+        default=DEFAULT_CHUNK_SIZE,
+        help=(
+            "Hand out samples to the worker processes by chunks of N. "
+            "Defaults to {}."
+        ).format(DEFAULT_CHUNK_SIZE),
+    )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="Output PCs instead of function names, without reading symbols",
+    )
+
+    args = parser.parse_args()
+    if not args.eh_elfs and not args.broker:
+        parser.error("either --eh-elfs or --broker is required")
+    if args.jobs < 1 or args.threads < 1 or args.max_depth < 1 or args.chunk_size < 1:
+        parser.error("--jobs, --threads, --max-depth and --chunk-size must be >= 1")
+    return args
+
+
+def main():
+    args = process_args()
+
+    try:
+        folded, stats = unwind_perf_data(
+            args.input,
+            args.eh_elfs,
+            jobs=args.jobs,
+            threads=args.threads,
+            max_depth=args.max_depth,
+            chunk_size=args.chunk_size,
+            symbolize=not args.raw,
+            broker=args.broker,
+        )
+    except (OSError, PerfDataError, BrokerError) as exn:
+        print("Error: {}".format(exn), file=sys.stderr)
+        sys.exit(1)
+
+    handle = open(args.output, "w") if args.output else sys.stdout
+    for call_stack, count in sorted(folded.items()):
+        handle.write("{} {}\n".format(call_stack, count))
+    if args.output:
+        handle.close()
+
+    print(
+        (
+            "{samples} samples unwound ({skipped} without user context), "
+            "{frames} frames\n"
+            "Unwinding: {unwind_time:.3f}s summed over processes, "
+            "{frames_per_sec:.0f} frames/s\n"
+            "Total: {wall_time:.3f}s"
+        ).format(
+            frames_per_sec=stats["frames"] / max(stats["unwind_time"], 1e-9), **stats
+        ),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+
+""" A broker that loads eh_elfs once, and unwinds batches of samples on behalf
+of the other processes of the machine, over a Unix socket.
+
+Every process unwinding through a `BatchUnwinder` loads the eh_elfs by itself;
+with many such processes, the relocation and symbol resolution work, and the
+memory of the loaded eh_elfs, is duplicated as many times. Instead, the broker
+keeps a single loaded set of eh_elfs, keyed by the GNU build-id of the objects
+they were generated from, and `BrokerClient`s send it their samples. An eh_elf
+is only used if `generate_eh_elf.py` recorded the build-id of its object in it:
+an eh_elf of an older version of the object is never mixed up with the current
+one.
+
+A message is a `HEADER` — magic and payload size — followed by its payload.
+An unwinding request payload is made of
+* a `REQUEST_HEADER`: mapping count, sample count, maximal depth, threads;
+* per mapping, a `MAPPING` — beg, end, load bias, build-id size, build-id, path
+  size — followed by the path of the mapped object. The broker only reads the
+  object at this path to find the eh_elf of a build-id it does not know yet;
+* `EH_ELF_REG_COUNT` registers per sample, then the stack copy size of each
+  sample, all as 64-bit integers;
+* the stack copies, concatenated.
+The response payload is a `RESPONSE_HEADER` — status, frame count — followed,
+on success, by the depth of each sample as 32-bit integers and the PCs of all
+the frames, sample after sample; on error, by a message.
+"""
+
+import argparse
+import itertools
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from array import array
+
+from eh_elf_unwind import (
+    DEFAULT_MAX_DEPTH,
+    LIB_PATH,
+    BatchUnwinder,
+    SampleBatch,
+    load_bias,
+    make_c_mappings,
+    read_build_id,
+    read_source_build_id,
+)
+
+DEFAULT_SOCKET = "/tmp/eh_elf_unwind_broker.sock"
+
+MAGIC = b"EHUB"
+HEADER = struct.Struct("<4sQ")
+REQUEST_HEADER = struct.Struct("<IIII")
+MAPPING = struct.Struct("<QQQB20sH")
+RESPONSE_HEADER = struct.Struct("<IQ")
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+MAX_REQUEST_DEPTH = 4096
+REG_COUNT = 4  # EH_ELF_REG_COUNT
+
+
+class BrokerError(Exception):
+    """ The broker could not be reached, or failed to serve a request """
+
+
+def recv_exact(sock, size):
+    """ Receive exactly `size` bytes from `sock`, or None on EOF before the
+    first byte """
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            if received == 0:
+                return None
+            raise BrokerError("connection closed in the middle of a message")
+        received += count
+    return data
+
+
+def recv_message(sock):
+    """ The payload of the next message on `sock`, or None on EOF """
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    magic, size = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise BrokerError("bad message magic")
+    return recv_exact(sock, size) if size > 0 else bytearray()
+
+
+def send_message(sock, parts):
+    """ Send a message made of the bytes-like `parts` """
+    size = sum(memoryview(part).nbytes for part in parts)
+    sock.sendall(HEADER.pack(MAGIC, size))
+    for part in parts:
+        sock.sendall(part)
+
+
+class PackedUnwindResult:
+    """ The call stacks of a batch, as returned by the broker: `pcs` holds the
+    frames of all the samples, sample after sample. Same interface as
+    `UnwindResult`. """
+
+    def __init__(self, pcs, depths, frame_count):
+        self.pcs = pcs
+        self.depths = depths
+        self.frame_count = frame_count
+        self.offsets = None
+
+    def __len__(self):
+        return len(self.depths)
+
+    def __getitem__(self, sample):
+        if self.offsets is None:
+            self.offsets = array("Q", itertools.accumulate(self.depths, initial=0))
+        beg = self.offsets[sample]
+        return self.pcs[beg : beg + self.depths[sample]]
+
+    def __iter__(self):
+        beg = 0
+        for depth in self.depths:
+            yield self.pcs[beg : beg + depth]
+            beg += depth
+
+
+class UnwindBroker:
+    """ Serves unwinding requests through a single set of loaded eh_elfs """
+
+    def __init__(self, eh_elf_dirs, lib_path=LIB_PATH):
+        self.unwinder = BatchUnwinder(eh_elf_dirs, lib_path)
+        self.lock = threading.Lock()
+        self.by_build_id = {}  # build-id -> eh_elf entry points
+        self.misses = set()  # (build-id, path) without a matching eh_elf
+
+    def preload(self, obj_path):
+        """ Load the eh_elf of `obj_path` ahead of any request. Returns whether
+        it has one, and a build-id. """
+        build_id = read_build_id(obj_path)
+        if build_id is None:
+            return False
+        with self.lock:
+            return self._load(build_id, obj_path)
+
+    def _load(self, build_id, obj_path):
+        # The eh_elf is found by the name of the object only: it must have
+        # been generated from this very build of it
+        eh_elf_path = self.unwinder.find_eh_elf(obj_path)
+        if eh_elf_path is None or read_source_build_id(eh_elf_path) != build_id:
+            return False
+        self.by_build_id[build_id] = self.unwinder.open_eh_elf(eh_elf_path, obj_path)
+        return True
+
+    def resolve(self, build_id, obj_path):
+        """ The entry points of the eh_elf of the object `build_id`, possibly
+        found at `obj_path`, or None """
+        entry_points = self.by_build_id.get(build_id)
+        if entry_points is not None or (build_id, obj_path) in self.misses:
+            return entry_points
+
+        with self.lock:
+            if build_id not in self.by_build_id:
+                try:
+                    found = read_build_id(obj_path) == build_id and self._load(
+                        build_id, obj_path
+                    )
+                except (OSError, ValueError):
+                    found = False
+                if not found:
+                    self.misses.add((build_id, obj_path))
+                    return None
+            return self.by_build_id[build_id]
+
+    def handle_request(self, payload):
+        """ The response parts to the request `payload` """
+        try:
+            mapping_count, sample_count, max_depth, threads = REQUEST_HEADER.unpack_from(
+                payload, 0
+            )
+            if not 0 < max_depth <= MAX_REQUEST_DEPTH:
+                raise ValueError("bad maximal depth {}".format(max_depth))
+            if threads == 0:
+                raise ValueError("bad thread count 0")
+            # `threads` sizes arrays on the C stack, and as many threads are
+            # started
+            threads = min(threads, os.cpu_count() or 1)
+            pos = REQUEST_HEADER.size
+
+            mappings = []
+            for _ in range(mapping_count):
+                beg, end, bias, build_id_size, build_id, path_size = MAPPING.unpack_from(
+                    payload, pos
+                )
+                pos += MAPPING.size
+                obj_path = payload[pos : pos + path_size].decode(errors="replace")
+                pos += path_size
+                entry_points = self.resolve(build_id[:build_id_size], obj_path)
+                if entry_points is not None:
+                    mappings.append((beg, end, bias) + entry_points[:4])
+
+            batch = SampleBatch()
+            regs_size = 8 * REG_COUNT * sample_count
+            batch.regs.frombytes(payload[pos : pos + regs_size])
+            pos += regs_size
+            batch.stack_sizes.frombytes(payload[pos : pos + 8 * sample_count])
+            pos += 8 * sample_count
+            if len(batch.stack_sizes) != sample_count:
+                raise ValueError("truncated request")
+
+            # The stack copies are used in place, in `payload`
+            batch.stack_offsets = array(
+                "Q", itertools.accumulate(batch.stack_sizes, initial=pos)
+            )
+            if batch.stack_offsets.pop() > len(payload):
+                raise ValueError("truncated request")
+            batch.stack_data = payload
+        except (struct.error, ValueError) as exn:
+            return [
+                RESPONSE_HEADER.pack(STATUS_ERROR, 0),
+                "Bad request: {}".format(exn).encode(),
+            ]
+
+        result = self.unwinder.unwind_with(
+            make_c_mappings(mappings), batch, max_depth, threads
+        )
+
+        pcs = array("Q")
+        for call_stack in result:
+            pcs += call_stack
+        return [RESPONSE_HEADER.pack(STATUS_OK, result.frame_count), result.depths, pcs]
+
+    def serve(self, socket_path=DEFAULT_SOCKET):
+        """ Serve requests on the Unix socket `socket_path`, forever. Each
+        connection is served by its own thread. """
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                try:
+                    while True:
+                        payload = recv_message(self.request)
+                        if payload is None:
+                            return
+                        send_message(self.request, broker.handle_request(payload))
+                except (BrokerError, OSError) as exn:
+                    print("Dropping client: {}".format(exn), file=sys.stderr)
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as server:
+            server.daemon_threads = True
+            try:
+                server.serve_forever()
+            finally:
+                os.unlink(socket_path)
+
+
+class BrokerClient:
+    """ Unwinds `SampleBatch`es of a process through an `UnwindBroker`. Same
+    interface as `BatchUnwinder`. """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(socket_path)
+        except OSError as exn:
+            self.sock.close()
+            raise BrokerError("cannot reach the broker: {}".format(exn))
+        self.build_ids = {}  # obj path -> build-id, or None
+        self.mappings = []  # Packed mappings
+
+    def close(self):
+        self.sock.close()
+
+    def add_mapping(self, beg, end, pgoff, obj_path):
+        """ Declare that `obj_path` is mapped at `[beg, end)` from its offset
+        `pgoff`. Returns whether the object can be sent to the broker, that is,
+        whether it has a build-id. """
+        if obj_path not in self.build_ids:
+            try:
+                self.build_ids[obj_path] = read_build_id(obj_path)
+            except (OSError, ValueError):
+                self.build_ids[obj_path] = None
+        build_id = self.build_ids[obj_path]
+        if build_id is None or len(build_id) > 20:
+            return False
+
+        path = obj_path.encode()
+        self.mappings.append(
+            MAPPING.pack(
+                beg,
+                end,
+                load_bias(obj_path, beg, pgoff),
+                len(build_id),
+                build_id,
+                len(path),
+            )
+            + path
+        )
+        return True
+
+    def clear_mappings(self):
+        """ Forget all the mappings, eg. to unwind another process """
+        self.mappings = []
+
+    def unwind(self, batch, max_depth=DEFAULT_MAX_DEPTH, threads=1):
+        """ Unwind all the samples of `batch` in the broker, spread over
+        `threads` threads there, at most as many as it has cores. Returns a
+        `PackedUnwindResult`. """
+        sample_count = len(batch)
+        request = [
+            REQUEST_HEADER.pack(len(self.mappings), sample_count, max_depth, threads)
+        ]
+        request += self.mappings
+        request += [batch.regs, batch.stack_sizes, batch.stack_data]
+
+        try:
+            send_message(self.sock, request)
+            response = recv_message(self.sock)
+        except OSError as exn:
+            raise BrokerError("lost the broker: {}".format(exn))
+        if response is None:
+            raise BrokerError("the broker closed the connection")
+
+        status, frame_count = RESPONSE_HEADER.unpack_from(response, 0)
+        pos = RESPONSE_HEADER.size
+        if status != STATUS_OK:
+            raise BrokerError(response[pos:].decode(errors="replace"))
+        depths = array("I")
+        depths.frombytes(response[pos : pos + 4 * sample_count])
+        pos += 4 * sample_count
+        pcs = array("Q")
+        pcs.frombytes(response[pos:])
+        return PackedUnwindResult(pcs, depths, frame_count)
+
+
+def process_args():
+    """ Process `sys.argv` arguments """
+
+    parser = argparse.ArgumentParser(
+        description=(
+            "Load eh_elfs once, and unwind batches of samples for the other "
+            "processes of the machine"
+        )
+    )
+
+    parser.add_argument(
+        "-e",
+        "--eh-elfs",
+        metavar="dir",
+        action="append",
+        required=True,
+        help=(
+            "A directory containing eh_elfs generated with --enable-deref-arg. "
+            "Can be given multiple times."
+        ),
+    )
+    parser.add_argument(
+        "-s",
+        "--socket",
+        metavar="path",
+        default=DEFAULT_SOCKET,
+        help="Listen on this Unix socket. Defaults to {}.".format(DEFAULT_SOCKET),
+    )
+    parser.add_argument(
+        "--preload",
+        metavar="object",
+        nargs="+",
+        default=[],
+        help=(
+            "Load the eh_elfs of these objects at startup. Otherwise, eh_elfs "
+            "are loaded on the first request mapping their object."
+        ),
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = process_args()
+
+    broker = UnwindBroker(args.eh_elfs)
+    for obj_path in args.preload:
+        try:
+            loaded = broker.preload(obj_path)
+        except (OSError, ValueError) as exn:
+            print("Error: {}".format(exn), file=sys.stderr)
+            sys.exit(1)
+        if not loaded:
+            print(
+                "Warning: {}: no build-id, or no eh_elf of this build".format(obj_path),
+                file=sys.stderr,
+            )
+
+    try:
+        broker.serve(args.socket)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -8,17 +8,35 @@ all the shared objects it depends upon.
 
 import os
 import sys
-import subprocess
+import copy
+import time
+import random
+import shutil
+import itertools
 import tempfile
 import argparse
+import json
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import namedtuple
 from enum import Enum
 
 from shared_python import (
     elf_so_deps,
     do_remote,
+    run_command,
+    CommandLimits,
+    eh_frame_size,
+    fde_ranges,
+    get_elf_sections,
+    BuildFarm,
+    LocalSession,
     is_newer,
     to_eh_elf_path,
     find_eh_elf_dir,
+    StageTimings,
     DEFAULT_AUX_DIRS,
 )
 from extract_pc import generate_pc_list
@@ -28,6 +46,13 @@ DWARF_ASSEMBLY_BIN = os.path.join(
     os.path.dirname(os.path.abspath(sys.argv[0])), "dwarf-assembly"
 )
 C_BIN = "gcc" if "C" not in os.environ else os.environ["C"]
+PROGRESS_FILE = ".eh_elf_progress.jsonl"
+TUNING_SUFFIX = ".tune.json"
+# Starts each shard of the C generated by `dwarf-assembly --shards`
+SHARD_MARKER = "/* eh_elf shard "
+EH_ELF_UNWIND_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "eh_elf_unwind"
+)
 
 
 class SwitchGenPolicy(Enum):
@@ -37,10 +62,67 @@ class SwitchGenPolicy(Enum):
     GLOBAL_SWITCH = "--global-switch"
 
 
+class TuneObjective(Enum):
+    """ What `--autotune` minimizes: each is a list of measures, the best
+    variant being the one whose sum of measures, each relative to the best
+    variant's, is the lowest """
+
+    SIZE = ["size"]
+    LOOKUP = ["lookup_ns"]
+    BALANCED = ["size", "lookup_ns"]
+
+
+# How the cost of compiling the generated C grows, at -O2 on a single core:
+# `rows` rows in a single translation unit take about
+# `max(time_lin_1e4 * r, time_1e4 * r ** time_exp)` seconds, `r` being
+# `rows / 10^4`, and at most `mem_base + mem_per_mb * (size of the C in MB)`
+# MiB. Fitted on the objects of `benching/synthetic`; the global switch is a
+# single function, whose compile time becomes about quadratic.
+CompileCostModel = namedtuple(
+    "CompileCostModel", "time_lin_1e4 time_1e4 time_exp mem_base mem_per_mb"
+)
+COMPILE_COST_MODELS = {
+    SwitchGenPolicy.GLOBAL_SWITCH: CompileCostModel(2.1, 5.2, 2.07, 40, 55),
+    SwitchGenPolicy.SWITCH_PER_FUNC: CompileCostModel(8.5, 10.9, 1.13, 40, 86),
+}
+# Time and memory of each optimization level, relative to -O2, in the order in
+# which they are degraded to fit in the compile budget
+OPT_LEVEL_COSTS = [
+    ("3", 1.1, 1.0),
+    ("2", 1.0, 1.0),
+    ("s", 0.95, 0.95),
+    ("1", 0.55, 0.85),
+    ("0", 0.3, 0.8),
+]
+# Time taken by each translation unit whatever its size, in seconds
+COMPILE_UNIT_TIME = 0.05
+# Size of the C generated per row, when dwarf-assembly does not report the
+# number of rows
+C_BYTES_PER_ROW = 150
+MAX_SHARDS = 64
+# A compilation killed for going beyond the budget is assumed to have needed
+# this much more than the budget
+RETRY_COST_FACTOR = 1.5
+# The time estimates are up to about twice too low for real objects split in
+# many small shards (libc, libstdc++): a plan must be estimated to fit in the
+# time budget divided by this
+COMPILE_TIME_MARGIN = 2.0
+
+# How an eh_elf is compiled in budget mode, and its estimated time, in
+# seconds, and peak memory, in MiB
+CompilePlan = namedtuple("CompilePlan", "c_opt_level shards est_time est_rss_mib")
+
+
+class CompileBudgetError(Exception):
+    """ An eh_elf cannot be compiled within the compile memory budget, even with
+    the cheapest settings """
+
+
 class Config:
     """ Holds the run's settings """
 
     default_aux = DEFAULT_AUX_DIRS
+    default_tune_opt_levels = ["s", "2"]
 
     def __init__(
         self,
@@ -53,9 +135,23 @@ class Config:
         use_pc_list=False,
         c_opt_level="3",
         enable_deref_arg=False,
+        enable_batch=False,
+        enable_rule_table=False,
         keep_holes=False,
         cc_debug=False,
         remote=None,
+        timings=None,
+        jobs=None,
+        reader_threads=1,
+        eh_frame_reader=False,
+        pc_ranges=None,
+        autotune=False,
+        use_tuning=True,
+        tune_opt_levels=None,
+        tune_objective=TuneObjective.BALANCED,
+        tune_lookups=20000,
+        compile_time_budget=None,
+        compile_mem_budget=None,
     ):
         self.output = "." if output is None else output
         self.aux = aux + ([] if no_dft_aux else self.default_aux)
@@ -65,9 +161,87 @@ class Config:
         self.use_pc_list = use_pc_list
         self.c_opt_level = c_opt_level
         self.enable_deref_arg = enable_deref_arg
+        self.enable_batch = enable_batch
+        self.enable_rule_table = enable_rule_table
         self.keep_holes = keep_holes
         self.cc_debug = cc_debug
-        self.remote = remote
+        if isinstance(remote, str):
+            remote = [remote]
+        self.remote = BuildFarm(remote) if isinstance(remote, list) else remote
+        self.timings = StageTimings() if timings is None else timings
+        if jobs is None:
+            jobs = 1 if self.remote is None else self.remote.slot_count()
+        self.jobs = jobs
+        self.reader_threads = reader_threads
+        self.eh_frame_reader = eh_frame_reader
+        self.pc_ranges = {} if pc_ranges is None else pc_ranges
+        self.autotune = autotune
+        self.use_tuning = use_tuning
+        self.tune_opt_levels = (
+            self.default_tune_opt_levels
+            if tune_opt_levels is None
+            else tune_opt_levels
+        )
+        self.tune_objective = tune_objective
+        self.tune_lookups = tune_lookups
+        self.compile_time_budget = compile_time_budget
+        self.compile_mem_budget = compile_mem_budget
+        self.shards = 1
+
+    def close(self):
+        """ Release the resources held for the run """
+        if self.remote is not None:
+            self.remote.close()
+
+    def pc_ranges_of(self, obj_path):
+        """ The PC ranges to generate for `obj_path`, or None to generate the
+        whole object """
+        return self.pc_ranges.get(os.path.realpath(obj_path))
+
+    def with_settings(self, sw_gen_policy, c_opt_level):
+        """ A copy of this configuration, with another switch generation
+        policy and optimization level """
+        out = copy.copy(self)
+        out.sw_gen_policy = sw_gen_policy
+        out.c_opt_level = c_opt_level
+        return out
+
+    def with_tuning(self, manifest):
+        """ A copy of this configuration, with the settings chosen by the
+        tuning `manifest` """
+        chosen = manifest["chosen"]
+        return self.with_settings(
+            SwitchGenPolicy[chosen["sw_gen_policy"]], chosen["c_opt_level"]
+        )
+
+    def with_compile_plan(self, plan):
+        """ A copy of this configuration, compiled as the `CompilePlan` `plan`
+        """
+        out = self.with_settings(self.sw_gen_policy, plan.c_opt_level)
+        out.shards = plan.shards
+        return out
+
+    def has_compile_budget(self):
+        """ Whether the compilations must fit in a time or memory budget """
+        return (
+            self.compile_time_budget is not None
+            or self.compile_mem_budget is not None
+        )
+
+    def fits_compile_budget(self, plan):
+        """ Whether the `CompilePlan` `plan` is estimated to fit in the budget
+        """
+        return (
+            self.compile_time_budget is None
+            or plan.est_time * COMPILE_TIME_MARGIN <= self.compile_time_budget
+        ) and (
+            self.compile_mem_budget is None
+            or plan.est_rss_mib <= self.compile_mem_budget
+        )
+
+    def tune_variants(self):
+        """ The `(sw_gen_policy, c_opt_level)` pairs tried by `--autotune` """
+        return list(itertools.product(SwitchGenPolicy, self.tune_opt_levels))
 
     @staticmethod
     def default_aux_str():
@@ -79,8 +253,18 @@ class Config:
         out.append(self.sw_gen_policy.value)
         if self.enable_deref_arg:
             out.append("--enable-deref-arg")
+        if self.enable_batch:
+            out.append("--enable-batch")
+        if self.enable_rule_table:
+            out.append("--enable-rule-table")
         if self.keep_holes:
             out.append("--keep-holes")
+        if self.reader_threads != 1:
+            out += ["--threads", str(self.reader_threads)]
+        if self.eh_frame_reader:
+            out.append("--eh-frame-reader")
+        if self.shards != 1:
+            out += ["--shards", str(self.shards)]
         return out
 
     def cc_opts(self):
@@ -100,26 +284,38 @@ class Config:
         return self.aux
 
 
-def gen_dw_asm_c(obj_path, out_path, config, pc_list_path=None):
+def gen_dw_asm_c(
+    obj_path,
+    out_path,
+    config,
+    pc_list_path=None,
+    stage=None,
+    stats_path=None,
+    pc_ranges_path=None,
+):
     """ Generate the C code produced by dwarf-assembly from `obj_path`, saving
-    it as `out_path` """
+    it as `out_path`. If `stats_path` is set, dwarf-assembly's per-pass
+    statistics are saved there as JSON. If `pc_ranges_path` is set, only the
+    PC ranges it lists are generated. """
 
     dw_assembly_args = config.dwarf_assembly_args()
     if pc_list_path is not None:
         dw_assembly_args += ["--pc-list", pc_list_path]
+    if pc_ranges_path is not None:
+        dw_assembly_args += ["--pc-ranges", pc_ranges_path]
+    if stats_path is not None:
+        dw_assembly_args += ["--stats-json", stats_path]
 
-    try:
-        with open(out_path, "w") as out_handle:
-            # TODO enhance error handling
-            command_args = [DWARF_ASSEMBLY_BIN, obj_path] + dw_assembly_args
-            dw_asm_output = subprocess.check_output(command_args).decode("utf-8")
-            out_handle.write(dw_asm_output)
-    except subprocess.CalledProcessError as exn:
+    with open(out_path, "w") as out_handle:
+        # TODO enhance error handling
+        command_args = [DWARF_ASSEMBLY_BIN, obj_path] + dw_assembly_args
+        call_rc = run_command(command_args, stage=stage, stdout=out_handle)[0]
+    if call_rc != 0:
         raise Exception(
             (
                 "Cannot generate C code from object file {} using {}: process "
                 "terminated with exit code {}."
-            ).format(obj_path, DWARF_ASSEMBLY_BIN, exn.returncode)
+            ).format(obj_path, DWARF_ASSEMBLY_BIN, call_rc)
         )
 
 
@@ -150,13 +346,375 @@ def find_out_dir(obj_path, config):
     return find_eh_elf_dir(obj_path, config.aux_dirs(), config.output)
 
 
+def compile_input_size(passes, c_size):
+    """ The number of rows and FDEs of the generated C, as reported in
+    dwarf-assembly's per-pass statistics `passes`, or estimated from its size
+    `c_size`, followed by `c_size` """
+    for record in passes:
+        if record["name"] == "CodeGenerator":
+            return record["rows_in"], record["fdes_in"], c_size
+    rows = c_size // C_BYTES_PER_ROW
+    return rows, rows, c_size
+
+
+def compile_plans(config, rows, fdes, c_size, scale=(1.0, 1.0)):
+    """ The `CompilePlan`s of the C generated for `rows` rows in `fdes` FDEs,
+    `c_size` bytes long, from the costliest to the cheapest: from
+    `config.c_opt_level` down, each with 1, 2, 4, … shards. The estimated time
+    and memory are multiplied by `scale`. """
+    model = COMPILE_COST_MODELS[config.sw_gen_policy]
+    levels = [level for level, _, _ in OPT_LEVEL_COSTS]
+    max_shards = max(1, min(fdes, MAX_SHARDS))
+
+    out = []
+    for level, time_factor, mem_factor in OPT_LEVEL_COSTS[
+        levels.index(config.c_opt_level) :
+    ]:
+        shards = 1
+        while True:
+            shard_rows = rows / shards / 1e4
+            shard_time = (
+                max(
+                    model.time_lin_1e4 * shard_rows,
+                    model.time_1e4 * shard_rows ** model.time_exp,
+                )
+                + COMPILE_UNIT_TIME
+            )
+            shard_rss = model.mem_base + model.mem_per_mb * c_size / 1e6 / shards
+            out.append(
+                CompilePlan(
+                    level,
+                    shards,
+                    shards * shard_time * time_factor * scale[0],
+                    shard_rss * mem_factor * scale[1],
+                )
+            )
+            if shards >= max_shards:
+                break
+            shards = min(2 * shards, max_shards)
+    return out
+
+
+def pick_compile_plan(plans, config):
+    """ The first of `plans` estimated to fit in the compile budget, or the
+    cheapest if none does """
+    return next((plan for plan in plans if config.fits_compile_budget(plan)), plans[-1])
+
+
+def split_c_shards(c_path):
+    """ Split the C file `c_path`, generated with several shards, into a file
+    per shard next to it, each starting with what precedes the first shard.
+    Returns their paths. """
+    out = []
+    prelude = []
+    shard_handle = None
+    base_path = os.path.splitext(c_path)[0]
+    try:
+        with open(c_path, "r") as handle:
+            for line in handle:
+                if line.startswith(SHARD_MARKER):
+                    if shard_handle is not None:
+                        shard_handle.close()
+                    shard = line[len(SHARD_MARKER) :].split()[0]
+                    out.append("{}.shard_{}.c".format(base_path, shard))
+                    shard_handle = open(out[-1], "w")
+                    shard_handle.writelines(prelude)
+                elif shard_handle is None:
+                    prelude.append(line)
+                else:
+                    shard_handle.write(line)
+    finally:
+        if shard_handle is not None:
+            shard_handle.close()
+    return out or [c_path]
+
+
+def compile_objects(obj_path, c_paths, config, plan=None, time_limit=True):
+    """ Compile each of `c_paths` into a .o file next to it, as the
+    `compile_o` stage of `obj_path`. With a `CompilePlan` `plan`, the local
+    compilers are killed once they go beyond the compile budget, or only its
+    memory part without `time_limit`. Returns the paths of the .o files, and
+    None, or None and the reason why the compilers were killed. """
+
+    time_budget = config.compile_time_budget if time_limit else None
+    limits = None
+    if plan is not None and config.remote is None:
+        limits = CommandLimits(
+            None
+            if config.compile_mem_budget is None
+            else config.compile_mem_budget * 1024,
+            time_budget,
+        )
+
+    o_paths = []
+    with config.timings.stage(obj_path, "compile_o") as stage:
+        stage["remote"] = bool(config.remote)
+        if plan is not None:
+            stage["plan"] = plan._asdict()
+        compile_beg = time.perf_counter()
+        for c_path in c_paths:
+            o_path = os.path.splitext(c_path)[0] + ".o"
+            if config.remote:
+                c_name = os.path.basename(c_path)
+                o_name = os.path.basename(o_path)
+                remote_out = do_remote(
+                    config.remote,
+                    [C_BIN, "-o", o_name, "-c", c_name] + config.cc_opts(),
+                    send_files=[c_path],
+                    retr_files=[(o_name, o_path)],
+                    stage=stage,
+                )
+                call_rc = 1 if remote_out is None else 0
+            else:
+                # The time budget is shared by all the shards
+                if limits is not None and time_budget is not None:
+                    limits = limits._replace(
+                        timeout=time_budget - (time.perf_counter() - compile_beg)
+                    )
+                    if limits.timeout <= 0:
+                        stage["killed"] = "time"
+                        return None, "time"
+                result = run_command(
+                    [C_BIN, "-o", o_path, "-c", c_path, config.opt_level(), "-fPIC"],
+                    stage=stage,
+                    limits=limits,
+                )
+                if result.killed is not None:
+                    return None, result.killed
+                # Most likely killed by the system for using too much memory
+                if limits is not None and result.returncode < 0:
+                    stage["killed"] = "signal"
+                    return None, "signal"
+                call_rc = result.returncode
+            if call_rc != 0:
+                raise Exception("Failed to compile to a .o file")
+            o_paths.append(o_path)
+    return o_paths, None
+
+
+def retry_compile_plan(config, plan, killed, input_size, scale):
+    """ The plan to retry with, once the compilation following `plan` was
+    killed for `killed`: the first cheaper plan estimated to fit in the budget,
+    once the estimates are corrected by what `plan` turned out to need, or the
+    cheapest plan. `scale`, the correction of the estimates, is updated.
+    Returns None if `plan` already was the cheapest. """
+    if killed == "time":
+        scale[0] *= RETRY_COST_FACTOR * max(
+            1.0, config.compile_time_budget / plan.est_time
+        )
+    elif killed == "memory":
+        scale[1] *= RETRY_COST_FACTOR * max(
+            1.0, config.compile_mem_budget / plan.est_rss_mib
+        )
+    else:
+        scale[1] *= RETRY_COST_FACTOR
+
+    plans = compile_plans(config, *input_size, scale=scale)
+    keys = [(cur.c_opt_level, cur.shards) for cur in plans]
+    cheaper = plans[keys.index((plan.c_opt_level, plan.shards)) + 1 :]
+    if not cheaper:
+        return None
+    return pick_compile_plan(cheaper, config)
+
+
+def write_source_note(obj_path, c_path):
+    """ Write at `c_path` the C of the note recording the GNU build-id of
+    `obj_path` in its eh_elf, as read by `eh_elf_unwind.read_source_build_id`.
+    Returns False, writing nothing, if `obj_path` has no readable build-id. """
+    if EH_ELF_UNWIND_DIR not in sys.path:
+        sys.path.append(EH_ELF_UNWIND_DIR)
+    from eh_elf_unwind import (
+        read_build_id,
+        SOURCE_NOTE_SECTION,
+        SOURCE_NOTE_NAME,
+        SOURCE_NOTE_TYPE,
+    )
+
+    try:
+        build_id = read_build_id(obj_path)
+    except (OSError, ValueError):
+        return False
+    if not build_id:
+        return False
+
+    # The name and descriptor of a note are padded to 4 bytes
+    name = SOURCE_NOTE_NAME + b"\0"
+    name_size = (len(name) + 3) & ~3
+    desc_size = (len(build_id) + 3) & ~3
+    with open(c_path, "w") as handle:
+        handle.write(
+            (
+                '__attribute__((section("{section}"), aligned(4), used))\n'
+                "static const struct {{\n"
+                "\tunsigned int namesz, descsz, type;\n"
+                "\tunsigned char name[{name_size}], desc[{desc_size}];\n"
+                "}} _eh_elf_source_note = {{\n"
+                "\t{namesz}, {descsz}, {type},\n"
+                "\t{{{name}}},\n"
+                "\t{{{desc}}},\n"
+                "}};\n"
+            ).format(
+                section=SOURCE_NOTE_SECTION,
+                name_size=name_size,
+                desc_size=desc_size,
+                namesz=len(name),
+                descsz=len(build_id),
+                type=SOURCE_NOTE_TYPE,
+                name=", ".join(map(str, name)),
+                desc=", ".join(map(str, build_id)),
+            )
+        )
+    return True
+
+
+def build_eh_elf(obj_path, out_so_path, config, pc_ranges=None, verbose=True):
+    """ Build the eh_elf of `obj_path` as `out_so_path`, generating only the
+    PC ranges `pc_ranges` if set """
+
+    def log(msg):
+        if verbose:
+            print(msg)
+
+    out_base_name = to_eh_elf_path(obj_path, None, base=True)
+    pc_list_dir = os.path.join(os.path.dirname(out_so_path), "pc_list")
+    timings = config.timings
+
+    with tempfile.TemporaryDirectory() as compile_dir:
+        # Generate PC list
+        pc_list_path = None
+        if config.use_pc_list:
+            pc_list_path = os.path.join(pc_list_dir, out_base_name + ".pc_list")
+            os.makedirs(pc_list_dir, exist_ok=True)
+            log("\tGenerating PC list…")
+            with timings.stage(obj_path, "pc_list"):
+                generate_pc_list(obj_path, pc_list_path)
+
+        # Write the PC ranges for dwarf-assembly
+        pc_ranges_path = None
+        if pc_ranges is not None:
+            pc_ranges_path = os.path.join(compile_dir, out_base_name + ".pc_ranges")
+            write_pc_ranges(pc_ranges, pc_ranges_path)
+
+        # Generate the C source file
+        log("\tGenerating C…")
+        c_path = os.path.join(compile_dir, (out_base_name + ".c"))
+        stats_path = None
+        if timings.out_handle is not None or config.has_compile_budget():
+            stats_path = os.path.join(compile_dir, (out_base_name + ".stats.json"))
+        with timings.stage(obj_path, "gen_c") as stage:
+            gen_dw_asm_c(
+                obj_path,
+                c_path,
+                config,
+                pc_list_path,
+                stage,
+                stats_path,
+                pc_ranges_path,
+            )
+            c_size = stage["c_size"] = os.path.getsize(c_path)
+            if stats_path is not None and os.path.isfile(stats_path):
+                with open(stats_path, "r") as stats_handle:
+                    stage["passes"] = json.load(stats_handle)["passes"]
+            passes = stage.get("passes", [])
+
+        # In budget mode, pick the optimization level and number of shards
+        plan = None
+        if config.has_compile_budget():
+            input_size = compile_input_size(passes, c_size)
+            scale = [1.0, 1.0]
+            plan = pick_compile_plan(compile_plans(config, *input_size), config)
+
+        # Compile it into .o files, one per shard, retrying with a cheaper
+        # plan as long as the compilers are killed for going beyond the budget
+        c_paths = [c_path]
+        c_shards = 1
+        time_limit = True
+        while True:
+            compile_config = config
+            if plan is not None:
+                compile_config = config.with_compile_plan(plan)
+                log(
+                    (
+                        "\tCompiling with -O{} in {} shard(s), estimated {:.0f}s, "
+                        "{:.0f} MiB{}…"
+                    ).format(
+                        plan.c_opt_level,
+                        plan.shards,
+                        plan.est_time,
+                        plan.est_rss_mib,
+                        ""
+                        if config.fits_compile_budget(plan)
+                        else ", beyond the budget",
+                    )
+                )
+                if plan.shards != c_shards:
+                    with timings.stage(obj_path, "gen_c_shards") as stage:
+                        gen_dw_asm_c(
+                            obj_path,
+                            c_path,
+                            compile_config,
+                            pc_list_path,
+                            stage,
+                            pc_ranges_path=pc_ranges_path,
+                        )
+                        c_paths = split_c_shards(c_path)
+                        c_shards = plan.shards
+            else:
+                log("\tCompiling into .o…")
+
+            o_paths, killed = compile_objects(
+                obj_path, c_paths, compile_config, plan, time_limit
+            )
+            if killed is None:
+                break
+            failed_plan = plan
+            plan = retry_compile_plan(config, plan, killed, input_size, scale)
+            if plan is not None:
+                log("\tKilled the compiler ({}), retrying…".format(killed))
+                continue
+
+            # Nothing is cheaper. Beyond the time budget, the compilation is
+            # only slow, but beyond the memory budget, it may take the machine
+            # down.
+            if killed != "time":
+                raise CompileBudgetError(
+                    "Failed to compile to a .o file within the budget "
+                    "(killed for {}, with -O{} in {} shard(s))".format(
+                        killed, failed_plan.c_opt_level, failed_plan.shards
+                    )
+                )
+            plan = failed_plan
+            time_limit = False
+            log("\tKilled the compiler (time), retrying without a time limit…")
+
+        # Compile it into a .so, recording the build-id of `obj_path`, so
+        # that it can be matched to this very build of the object
+        log("\tCompiling into .so…")
+        note_paths = []
+        note_path = os.path.join(compile_dir, out_base_name + ".source_note.c")
+        if write_source_note(obj_path, note_path):
+            note_paths.append(note_path)
+        with timings.stage(obj_path, "compile_so") as stage:
+            call_rc = run_command(
+                [C_BIN, "-o", out_so_path, "-shared"] + o_paths + note_paths,
+                stage=stage,
+            )[0]
+        if call_rc != 0:
+            raise Exception("Failed to compile to a .so file")
+
+
 def gen_eh_elf(obj_path, config):
     """ Generate the eh_elf corresponding to `obj_path`, saving it as
     `out_dir/$(basename obj_path).eh_elf.so` (or in the current working
-    directory if out_dir is None) """
+    directory if out_dir is None).
+
+    If a tuning manifest of the object is found next to its eh_elf, its
+    settings are used instead of those of `config`; with `config.autotune`,
+    the manifest is created first. """
 
     out_dir = find_out_dir(obj_path, config)
     obj_path, link_chain = resolve_symlink_chain(obj_path)
+    pc_ranges = config.pc_ranges_of(obj_path)
 
     print("> {}...".format(os.path.basename(obj_path)))
 
@@ -170,9 +728,21 @@ def gen_eh_elf(obj_path, config):
 
     out_base_name = to_eh_elf_path(obj_path, out_dir, base=True)
     out_so_path = to_eh_elf_path(obj_path, out_dir, base=False)
-    pc_list_dir = os.path.join(out_dir, "pc_list")
+    manifest_path = os.path.join(out_dir, out_base_name + TUNING_SUFFIX)
+
+    tuning = None
+    if config.use_tuning:
+        tuning = read_tuning_manifest(manifest_path, obj_path)
+    retune = config.autotune and (tuning is None or config.force)
 
-    if is_newer(out_so_path, obj_path) and not config.force:
+    # The ranges may differ from the previous run's: always regenerate
+    if (
+        is_newer(out_so_path, obj_path)
+        and not config.force
+        and pc_ranges is None
+        and not retune
+        and (tuning is None or is_newer(out_so_path, manifest_path))
+    ):
         return  # The object is recent enough, no need to recreate it
 
     if os.path.exists(out_dir) and not os.path.isdir(out_dir):
@@ -180,44 +750,23 @@ def gen_eh_elf(obj_path, config):
     if not os.path.exists(out_dir):
         os.makedirs(out_dir, exist_ok=True)
 
-    with tempfile.TemporaryDirectory() as compile_dir:
-        # Generate PC list
-        pc_list_path = None
-        if config.use_pc_list:
-            pc_list_path = os.path.join(pc_list_dir, out_base_name + ".pc_list")
-            os.makedirs(pc_list_dir, exist_ok=True)
-            print("\tGenerating PC list…")
-            generate_pc_list(obj_path, pc_list_path)
-
-        # Generate the C source file
-        print("\tGenerating C…")
-        c_path = os.path.join(compile_dir, (out_base_name + ".c"))
-        gen_dw_asm_c(obj_path, c_path, config, pc_list_path)
-
-        # Compile it into a .o
-        print("\tCompiling into .o…")
-        o_path = os.path.join(compile_dir, (out_base_name + ".o"))
-        if config.remote:
-            remote_out = do_remote(
-                config.remote,
-                [C_BIN, "-o", out_base_name + ".o", "-c", out_base_name + ".c"]
-                + config.cc_opts(),
-                send_files=[c_path],
-                retr_files=[(out_base_name + ".o", o_path)],
+    if retune:
+        print("\tTuning…")
+        with tempfile.TemporaryDirectory() as tune_dir:
+            with config.timings.stage(obj_path, "autotune") as stage:
+                tuning, tuned_so_path = autotune_eh_elf(obj_path, config, tune_dir)
+                stage["chosen"] = tuning["chosen"]
+            write_tuning_manifest(manifest_path, tuning)
+            shutil.copyfile(tuned_so_path, out_so_path)
+        print(
+            "\tChose {} -O{}".format(
+                tuning["chosen"]["sw_gen_policy"], tuning["chosen"]["c_opt_level"]
             )
-            call_rc = 1 if remote_out is None else 0
-        else:
-            call_rc = subprocess.call(
-                [C_BIN, "-o", o_path, "-c", c_path, config.opt_level(), "-fPIC"]
-            )
-        if call_rc != 0:
-            raise Exception("Failed to compile to a .o file")
-
-        # Compile it into a .so
-        print("\tCompiling into .so…")
-        call_rc = subprocess.call([C_BIN, "-o", out_so_path, "-shared", o_path])
-        if call_rc != 0:
-            raise Exception("Failed to compile to a .so file")
+        )
+    else:
+        if tuning is not None:
+            config = config.with_tuning(tuning)
+        build_eh_elf(obj_path, out_so_path, config, pc_ranges)
 
     # Re-create symlinks
     for elt in link_chain:
@@ -230,12 +779,439 @@ def gen_eh_elf(obj_path, config):
         os.symlink(elt[1], elt[0])
 
 
+def read_tuning_manifest(path, obj_path):
+    """ The tuning manifest saved at `path`, or None if there is none, or if
+    it was not tuned for the current contents of `obj_path` """
+    try:
+        with open(path, "r") as handle:
+            manifest = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("digest") != file_digest(obj_path).hex():
+        return None
+    return manifest
+
+
+def write_tuning_manifest(path, manifest):
+    """ Save the tuning `manifest` at `path` """
+    with open(path, "w") as handle:
+        json.dump(manifest, handle, indent=2)
+        handle.write("\n")
+
+
+def sample_pcs(obj_path, count, seed=0):
+    """ `count` PCs of `obj_path`, drawn uniformly among the bytes covered by
+    its FDEs """
+    ranges = fde_ranges(obj_path)
+    if not ranges:
+        return []
+    rng = random.Random(seed)
+    cum_sizes = list(itertools.accumulate(end - beg for beg, end in ranges))
+    return [
+        rng.randrange(beg, end)
+        for beg, end in rng.choices(ranges, cum_weights=cum_sizes, k=count)
+    ]
+
+
+def time_eh_elf_lookups(eh_elf_paths, pcs, with_deref):
+    """ The average lookup time, in nanoseconds, of each of `eh_elf_paths` over
+    `pcs`, or a list of None if it cannot be measured. The eh_elfs are loaded in
+    a child process, so that they do not stay loaded. """
+    if not pcs:
+        return [None] * len(eh_elf_paths)
+    if not os.path.isfile(os.path.join(EH_ELF_UNWIND_DIR, "libeh_elf_unwind.so")):
+        print(
+            "\tWarning: eh_elf_unwind is not built, cannot time the lookups",
+            file=sys.stderr,
+        )
+        return [None] * len(eh_elf_paths)
+
+    if EH_ELF_UNWIND_DIR not in sys.path:
+        sys.path.append(EH_ELF_UNWIND_DIR)
+    from eh_elf_unwind import time_lookups
+
+    # Spawned: this process may be running other threads
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(time_lookups, eh_elf_path, pcs, with_deref)
+            for eh_elf_path in eh_elf_paths
+        ]
+        return [future.result() for future in futures]
+
+
+def pick_variant(variants, objective):
+    """ The best of the measured `variants` for the `TuneObjective`
+    `objective`. Measures missing for some variant are ignored; compile time
+    breaks ties. """
+    measures = [
+        measure
+        for measure in objective.value
+        if all(variant[measure] for variant in variants)
+    ] or ["size"]
+    best = {
+        measure: min(variant[measure] for variant in variants)
+        for measure in measures
+    }
+    return min(
+        variants,
+        key=lambda variant: (
+            sum(variant[measure] / best[measure] for measure in measures),
+            variant["compile_time"],
+        ),
+    )
+
+
+def autotune_eh_elf(obj_path, config, work_dir):
+    """ Build, in parallel, the eh_elf of `obj_path` with each of
+    `config.tune_variants()` into `work_dir`, and measure their code size,
+    compile time and lookup time. Returns the tuning manifest, whose `chosen`
+    variant is the best for `config.tune_objective`, and the path of the
+    chosen eh_elf. """
+
+    pc_ranges = config.pc_ranges_of(obj_path)
+
+    def build_variant(pos, sw_gen_policy, c_opt_level):
+        variant_config = config.with_settings(sw_gen_policy, c_opt_level)
+        variant_config.timings = StageTimings()
+        out_so_path = to_eh_elf_path(obj_path, os.path.join(work_dir, str(pos)))
+        os.makedirs(os.path.dirname(out_so_path))
+        try:
+            build_eh_elf(
+                obj_path, out_so_path, variant_config, pc_ranges, verbose=False
+            )
+        except Exception as exn:
+            print(
+                "\tWarning: {} -O{}: {}".format(sw_gen_policy.name, c_opt_level, exn),
+                file=sys.stderr,
+            )
+            return None
+
+        sections = get_elf_sections(out_so_path)
+        variant = {
+            "sw_gen_policy": sw_gen_policy.name,
+            "c_opt_level": c_opt_level,
+            "size": sum(
+                sections.get(name, {}).get("size", 0)
+                for name in (".text", ".rodata")
+            ),
+            "compile_time": sum(
+                record["wall"]
+                for record in variant_config.timings.records
+                if record["stage"].startswith("compile")
+            ),
+            "lookup_ns": None,
+        }
+        return variant, out_so_path
+
+    tune_variants = config.tune_variants()
+    workers = len(tune_variants)
+    if config.remote is None:
+        workers = min(workers, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        built = list(
+            filter(
+                None,
+                executor.map(
+                    lambda args: build_variant(*args),
+                    [(pos,) + variant for pos, variant in enumerate(tune_variants)],
+                ),
+            )
+        )
+    if not built:
+        raise Exception("No variant of the eh_elf could be built")
+
+    # Timed one at a time, once the builds are over, not to disturb each other
+    pcs = sample_pcs(obj_path, config.tune_lookups)
+    lookup_times = time_eh_elf_lookups(
+        [out_so_path for _, out_so_path in built], pcs, config.enable_deref_arg
+    )
+    for (variant, _), lookup_ns in zip(built, lookup_times):
+        variant["lookup_ns"] = lookup_ns
+
+    variants = [variant for variant, _ in built]
+    chosen = pick_variant(variants, config.tune_objective)
+    manifest = {
+        "object": obj_path,
+        "digest": file_digest(obj_path).hex(),
+        "objective": config.tune_objective.name,
+        "chosen": {
+            "sw_gen_policy": chosen["sw_gen_policy"],
+            "c_opt_level": chosen["c_opt_level"],
+        },
+        "variants": variants,
+    }
+    return manifest, built[variants.index(chosen)][1]
+
+
+def with_deps(objects):
+    """ The list of `objects` and all the shared objects they depend upon,
+    each listed once """
+    out = []
+    seen = set()
+    for obj_path in objects:
+        for dep in elf_so_deps(obj_path) + [obj_path]:
+            canonical = os.path.realpath(dep)
+            if canonical not in seen:
+                seen.add(canonical)
+                out.append(dep)
+    return out
+
+
+def gen_eh_elf_list(objects, config, costs=None, journal=None):
+    """ Call `gen_eh_elf` on each of `objects`, running up to `config.jobs` of
+    them concurrently, the most expensive ones first. `costs`, if known, maps
+    each object to its `.eh_frame` size.
+
+    If `journal` is a `ProgressJournal`, the outcome of each object is recorded
+    there, and a failing object does not stop the others. Otherwise, only the
+    objects beyond the compile budget do not, and they are returned. """
+
+    over_budget = []
+
+    def gen_one(obj_path):
+        if journal is None:
+            try:
+                gen_eh_elf(obj_path, config)
+            except CompileBudgetError as exn:
+                print("Error: {}: {}".format(obj_path, exn), file=sys.stderr)
+                over_budget.append(obj_path)
+            return
+        try:
+            gen_eh_elf(obj_path, config)
+        except Exception as exn:
+            print("Error: {}: {}".format(obj_path, exn), file=sys.stderr)
+            journal.record(obj_path, ProgressJournal.FAILED, str(exn))
+        else:
+            journal.record(obj_path, ProgressJournal.DONE)
+
+    if config.jobs <= 1:
+        for obj_path in objects:
+            gen_one(obj_path)
+        return over_budget
+
+    # Starting with the largest objects avoids ending the run waiting for a
+    # single long compile
+    if costs is None:
+        costs = {obj_path: eh_frame_size(obj_path) for obj_path in objects}
+    objects = sorted(objects, key=lambda obj_path: costs[obj_path], reverse=True)
+
+    with ThreadPoolExecutor(max_workers=config.jobs) as executor:
+        futures = [executor.submit(gen_one, obj_path) for obj_path in objects]
+        for future in futures:
+            future.result()
+    return over_budget
+
+
+class ProgressJournal:
+    """ Records, as JSON lines in the file `path`, which objects of a large run
+    were processed, so that an interrupted run can be resumed """
+
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, path):
+        self.done = set()
+        if os.path.isfile(path):
+            with open(path, "r") as handle:
+                for line in handle:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Truncated by the interruption
+                    if entry["status"] == self.DONE:
+                        self.done.add(entry["object"])
+                    else:
+                        self.done.discard(entry["object"])
+        self._handle = open(path, "a")
+        self._lock = threading.Lock()
+
+    def is_done(self, obj_path):
+        return obj_path in self.done
+
+    def record(self, obj_path, status, error=None):
+        entry = {"object": obj_path, "status": status}
+        if error is not None:
+            entry["error"] = error
+        with self._lock:
+            if status == self.DONE:
+                self.done.add(obj_path)
+            self._handle.write(json.dumps(entry) + "\n")
+            self._handle.flush()
+
+    def close(self):
+        self._handle.close()
+
+
+def system_objects():
+    """ Every 64-bit ELF object found in the system directories """
+    stats_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stats")
+    if stats_dir not in sys.path:
+        sys.path.append(stats_dir)
+    from pyelftools_overlay import system_elfs
+
+    return [path for path, _ in system_elfs()]
+
+
+def read_object_list(path):
+    """ Read a list of objects, one per line, from `path` (`-` for the standard
+    input). Blank lines and lines starting with `#` are ignored. """
+    handle = sys.stdin if path == "-" else open(path, "r")
+    try:
+        return [
+            line.strip()
+            for line in handle
+            if line.strip() and not line.startswith("#")
+        ]
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def read_pc_ranges(path):
+    """ Read the PC ranges to generate from `path`: each line is `OBJECT BEG
+    [END]`, the addresses being in hexadecimal, `END` excluded, and defaulting
+    to `BEG + 1`. Blank lines and lines starting with `#` are ignored.
+    Returns a dict mapping the canonical path of each object to its list of
+    `(beg, end)` ranges. """
+    out = {}
+    with open(path, "r") as handle:
+        for line in handle:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split()
+            if len(fields) not in (2, 3):
+                raise Exception("{}: bad PC range line: {}".format(path, line))
+            beg = int(fields[1], 16)
+            end = int(fields[2], 16) if len(fields) == 3 else beg + 1
+            out.setdefault(os.path.realpath(fields[0]), []).append((beg, end))
+    return out
+
+
+def read_pc_histogram(path, hot_fraction):
+    """ Read a histogram of sampled PCs from `path`, eg. derived from a perf
+    profile: each line is `OBJECT PC COUNT`, `PC` being a hexadecimal address
+    within the object. Only the hottest PCs, together accounting for
+    `hot_fraction` of the samples, are kept. Returns the same as
+    `read_pc_ranges`. """
+    samples = []
+    with open(path, "r") as handle:
+        for line in handle:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.split()
+            if len(fields) != 3:
+                raise Exception("{}: bad histogram line: {}".format(path, line))
+            samples.append((int(fields[2]), fields[0], int(fields[1], 16)))
+
+    samples.sort(reverse=True)
+    total = sum(count for count, _, _ in samples)
+    out = {}
+    kept = 0
+    for count, obj_path, pc in samples:
+        if kept >= hot_fraction * total:
+            break
+        kept += count
+        out.setdefault(os.path.realpath(obj_path), []).append((pc, pc + 1))
+    return out
+
+
+def write_pc_ranges(ranges, path):
+    """ Write `ranges` as a .pc_ranges file for dwarf-assembly """
+    with open(path, "w") as handle:
+        for beg, end in ranges:
+            handle.write("{:x} {:x}\n".format(beg, end))
+
+
+def file_digest(path):
+    """ Hash of the contents of the file at `path` """
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def dedup_objects(objects):
+    """ Deduplicate `objects`, first by canonical path, then by content.
+    Returns a pair `(unique, duplicates)`: `unique` is a list of canonical
+    paths, and `duplicates` maps the canonical path of every other object to
+    the element of `unique` with the same content. """
+
+    canonical = []
+    seen = set()
+    for obj_path in objects:
+        obj_path = os.path.realpath(obj_path)
+        if obj_path not in seen and os.path.isfile(obj_path):
+            seen.add(obj_path)
+            canonical.append(obj_path)
+
+    # Only hash the files whose size is not unique
+    by_size = {}
+    for obj_path in canonical:
+        by_size.setdefault(os.path.getsize(obj_path), []).append(obj_path)
+
+    unique = []
+    duplicates = {}
+    by_digest = {}
+    for obj_path in canonical:
+        if len(by_size[os.path.getsize(obj_path)]) > 1:
+            digest = file_digest(obj_path)
+            if digest in by_digest:
+                duplicates[obj_path] = by_digest[digest]
+                continue
+            by_digest[digest] = obj_path
+        unique.append(obj_path)
+
+    return unique, duplicates
+
+
+def gen_system_eh_elfs(objects, config, journal):
+    """ Generate the eh_elfs of a large set of `objects`, such as a whole
+    system: each content is processed once, objects without `.eh_frame` are
+    skipped, and progress is recorded in `journal` so that the run can be
+    resumed. Duplicates get a symlink to their original's eh_elf. """
+
+    unique, duplicates = dedup_objects(objects)
+    with ThreadPoolExecutor(max_workers=max(config.jobs, 1)) as executor:
+        costs = dict(zip(unique, executor.map(eh_frame_size, unique)))
+
+    to_process = [obj_path for obj_path in unique if costs[obj_path] > 0]
+    to_resume = [
+        obj_path for obj_path in to_process if not journal.is_done(obj_path)
+    ]
+    print(
+        (
+            "{} objects: {} duplicates, {} without .eh_frame, "
+            "{} already done, {} to process."
+        ).format(
+            len(unique) + len(duplicates),
+            len(duplicates),
+            len(unique) - len(to_process),
+            len(to_process) - len(to_resume),
+            len(to_resume),
+        )
+    )
+
+    gen_eh_elf_list(to_resume, config, costs=costs, journal=journal)
+
+    for dup_path, orig_path in duplicates.items():
+        if not journal.is_done(orig_path):
+            continue
+        orig_eh_elf = to_eh_elf_path(orig_path, find_out_dir(orig_path, config))
+        dup_eh_elf = to_eh_elf_path(dup_path, find_out_dir(dup_path, config))
+        if os.path.lexists(dup_eh_elf) or dup_eh_elf == orig_eh_elf:
+            continue
+        if os.path.dirname(orig_eh_elf) == os.path.dirname(dup_eh_elf):
+            os.symlink(os.path.basename(orig_eh_elf), dup_eh_elf)
+        else:
+            os.symlink(os.path.abspath(orig_eh_elf), dup_eh_elf)
+
+
 def gen_all_eh_elf(obj_path, config):
     """ Call `gen_eh_elf` on obj_path and all its dependencies """
-    deps = elf_so_deps(obj_path)
-    deps.append(obj_path)
-    for dep in deps:
-        gen_eh_elf(dep, config)
+    gen_eh_elf_list(with_deps([obj_path]), config)
 
 
 def gen_eh_elfs(obj_path, out_dir, global_switch=True, deps=True, remote=None):
@@ -266,10 +1242,7 @@ def process_args():
 
     parser.add_argument(
         "--deps",
-        action="store_const",
-        const=gen_all_eh_elf,
-        default=gen_eh_elf,
-        dest="gen_func",
+        action="store_true",
         help=("Also generate eh_elfs for the shared objects " "this object depends on"),
     )
     parser.add_argument(
@@ -307,9 +1280,43 @@ def process_args():
     parser.add_argument(
         "--remote",
         metavar="ssh_args",
+        action="append",
         help=(
             "Execute the heavyweight commands on the remote "
-            "machine, using `ssh ssh_args`."
+            "machine, using `ssh ssh_args`. A single connection is opened "
+            "and reused for the whole run. Use `{}` to run them locally "
+            "through the same code path instead. May be repeated to spread "
+            "the work over a pool of machines; a machine given N times runs "
+            "N commands concurrently. Unreachable machines are dropped from "
+            "the pool and their work retried on the others."
+        ).format(LocalSession.SPEC),
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        metavar="N",
+        help=(
+            "Process up to N objects concurrently. Defaults to the number of "
+            "--remote slots, or 1."
+        ),
+    )
+    parser.add_argument(
+        "--reader-threads",
+        type=int,
+        default=1,
+        metavar="N",
+        help=(
+            "Decode the DWARF of each object with N threads in dwarf-assembly "
+            "(0 for one per core). Defaults to 1."
+        ),
+    )
+    parser.add_argument(
+        "--eh-frame-reader",
+        action="store_true",
+        help=(
+            "Make dwarf-assembly read the .eh_frame directly instead of going "
+            "through libdwarfpp."
         ),
     )
     parser.add_argument(
@@ -341,6 +1348,23 @@ def process_args():
             "to work on remote address spaces."
         ),
     )
+    parser.add_argument(
+        "--enable-batch",
+        action="store_true",
+        help=(
+            "Pass the `--enable-batch` to dwarf-assembly, generating an extra "
+            "`_eh_elf_batch` function unwinding arrays of contexts at once."
+        ),
+    )
+    parser.add_argument(
+        "--enable-rule-table",
+        action="store_true",
+        help=(
+            "Pass the `--enable-rule-table` to dwarf-assembly, generating an "
+            "extra `_eh_elf_rule` function giving the decoded row of a PC, "
+            "used by the stack walker's rule cache."
+        ),
+    )
     parser.add_argument(
         "--keep-holes",
         action="store_true",
@@ -394,6 +1418,92 @@ def process_args():
     )
     opt_level_grp.set_defaults(c_opt_level="3")
 
+    tuning_grp = parser.add_mutually_exclusive_group()
+    tuning_grp.add_argument(
+        "--autotune",
+        action="store_true",
+        help=(
+            "For each object without an up-to-date tuning manifest (or each "
+            "object, with --force), build its eh_elf with both switch "
+            "generation policies and each of --tune-opt-levels, in parallel, "
+            "measure their .text and .rodata size, compile time and lookup "
+            "time, and keep the best for --tune-objective. The choice is saved "
+            "next to the eh_elf, as `{}`, and reused by later runs, even "
+            "without --autotune. Timing the lookups requires building "
+            "eh_elf_unwind."
+        ).format("OBJECT.eh_elf" + TUNING_SUFFIX),
+    )
+    tuning_grp.add_argument(
+        "--ignore-tuning",
+        action="store_true",
+        help=(
+            "Ignore the tuning manifests, and use the settings of the command "
+            "line for every object."
+        ),
+    )
+    parser.add_argument(
+        "--tune-opt-levels",
+        metavar="LEVELS",
+        default=",".join(Config.default_tune_opt_levels),
+        help=(
+            "Comma-separated optimization levels tried by --autotune. "
+            "Defaults to {}."
+        ).format(",".join(Config.default_tune_opt_levels)),
+    )
+    parser.add_argument(
+        "--tune-objective",
+        choices=[objective.name.lower() for objective in TuneObjective],
+        default=TuneObjective.BALANCED.name.lower(),
+        help=(
+            "What --autotune minimizes: the code size, the lookup time, or "
+            "both, each relative to the best variant's. Defaults to balanced."
+        ),
+    )
+    parser.add_argument(
+        "--tune-lookups",
+        type=int,
+        default=20000,
+        metavar="N",
+        help=(
+            "Number of random PCs of the object whose lookup --autotune "
+            "times. Defaults to 20000."
+        ),
+    )
+
+    parser.add_argument(
+        "--compile-time-budget",
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "Before compiling each eh_elf, estimate the time its compilation "
+            "takes from the size of its C and its number of rows, and lower "
+            "the optimization level and split the C into shards, compiled "
+            "separately, until it fits in this many seconds. A compiler "
+            "still going beyond is killed, and the compilation retried with a "
+            "cheaper setting, or without a time limit once there is none."
+        ),
+    )
+    parser.add_argument(
+        "--compile-mem-budget",
+        type=float,
+        metavar="MiB",
+        help=(
+            "Same as --compile-time-budget, for the peak memory of each "
+            "compiler, in MiB. The objects that do not fit even with the "
+            "cheapest setting are skipped, and the exit status is 1."
+        ),
+    )
+
+    parser.add_argument(
+        "--timings",
+        metavar="path",
+        help=(
+            "Record the wall time, CPU time and peak memory of each stage of "
+            "each object's generation, as JSON lines, into this file, and "
+            "print a summary of the slowest ones at the end of the run."
+        ),
+    )
+
     switch_gen_policy = parser.add_mutually_exclusive_group(required=True)
     switch_gen_policy.add_argument(
         "--switch-per-func",
@@ -409,12 +1519,91 @@ def process_args():
         const=SwitchGenPolicy.GLOBAL_SWITCH,
         help=("Passed to dwarf-assembly."),
     )
-    parser.add_argument("object", nargs="+", help="The ELF object(s) to process")
-    return parser.parse_args()
+    parser.add_argument(
+        "--system",
+        action="store_true",
+        help=(
+            "Also process every 64-bit ELF object of the system directories. "
+            "Each content is processed once, objects without .eh_frame are "
+            "skipped, failures do not stop the run, and progress is recorded "
+            "in the output directory so that an interrupted run resumes "
+            "where it stopped."
+        ),
+    )
+    parser.add_argument(
+        "--from-list",
+        metavar="path",
+        help=(
+            "Also process the objects listed in this file, one per line (`-` "
+            "for the standard input), the same way as --system."
+        ),
+    )
+    partial_grp = parser.add_mutually_exclusive_group()
+    partial_grp.add_argument(
+        "--pc-ranges",
+        metavar="path",
+        help=(
+            "Only generate the FDEs covering the PC ranges listed in this "
+            "file, one `OBJECT BEG [END]` per line, in hexadecimal. Other PCs "
+            "get the error flag. The listed objects are processed, in "
+            "addition to those given on the command line, which are "
+            "processed whole if not listed."
+        ),
+    )
+    partial_grp.add_argument(
+        "--pc-histogram",
+        metavar="path",
+        help=(
+            "Same as --pc-ranges, with the PCs of a profile: one "
+            "`OBJECT PC COUNT` per line, PC being in hexadecimal. Only the "
+            "hottest PCs are kept, see --hot-fraction."
+        ),
+    )
+    parser.add_argument(
+        "--hot-fraction",
+        type=float,
+        default=0.99,
+        metavar="F",
+        help=(
+            "With --pc-histogram, keep the hottest PCs accounting for this "
+            "fraction of the samples. Defaults to 0.99."
+        ),
+    )
+    parser.add_argument("object", nargs="*", help="The ELF object(s) to process")
+    args = parser.parse_args()
+    if (
+        not args.object
+        and not args.system
+        and not args.from_list
+        and not args.pc_ranges
+        and not args.pc_histogram
+    ):
+        parser.error("no object to process")
+    args.tune_opt_levels = [
+        level for level in args.tune_opt_levels.split(",") if level
+    ]
+    if not args.tune_opt_levels or any(
+        level not in ("0", "1", "2", "3", "s") for level in args.tune_opt_levels
+    ):
+        parser.error("--tune-opt-levels must be a list among 0, 1, 2, 3, s")
+    for budget in (args.compile_time_budget, args.compile_mem_budget):
+        if budget is not None and budget <= 0:
+            parser.error("the compile budgets must be positive")
+    return args
 
 
 def main():
     args = process_args()
+    timings_handle = None
+    if args.timings:
+        timings_handle = open(args.timings, "w")
+
+    pc_ranges = None
+    if args.pc_ranges:
+        pc_ranges = read_pc_ranges(args.pc_ranges)
+    elif args.pc_histogram:
+        pc_ranges = read_pc_histogram(args.pc_histogram, args.hot_fraction)
+
     config = Config(
         output=args.output,
         aux=args.aux,
@@ -425,13 +1614,52 @@ def main():
         use_pc_list=args.use_pc_list,
         c_opt_level=args.c_opt_level,
         enable_deref_arg=args.enable_deref_arg,
+        enable_batch=args.enable_batch,
+        enable_rule_table=args.enable_rule_table,
         keep_holes=args.keep_holes,
         cc_debug=args.cc_debug,
         remote=args.remote,
+        timings=StageTimings(timings_handle),
+        jobs=args.jobs,
+        reader_threads=args.reader_threads,
+        eh_frame_reader=args.eh_frame_reader,
+        pc_ranges=pc_ranges,
+        autotune=args.autotune,
+        use_tuning=not args.ignore_tuning,
+        tune_opt_levels=args.tune_opt_levels,
+        tune_objective=TuneObjective[args.tune_objective.upper()],
+        tune_lookups=args.tune_lookups,
+        compile_time_budget=args.compile_time_budget,
+        compile_mem_budget=args.compile_mem_budget,
     )
 
-    for obj in args.object:
-        args.gen_func(obj, config)
+    objects = with_deps(args.object) if args.deps else list(args.object)
+    if pc_ranges is not None:
+        listed = set(map(os.path.realpath, objects))
+        objects += [obj for obj in sorted(pc_ranges) if obj not in listed]
+    over_budget = []
+    try:
+        if args.system or args.from_list:
+            if args.system:
+                objects += system_objects()
+            if args.from_list:
+                objects += read_object_list(args.from_list)
+            os.makedirs(config.output, exist_ok=True)
+            journal = ProgressJournal(os.path.join(config.output, PROGRESS_FILE))
+            try:
+                gen_system_eh_elfs(objects, config, journal)
+            finally:
+                journal.close()
+        else:
+            over_budget = gen_eh_elf_list(objects, config)
+    finally:
+        config.close()
+
+    if timings_handle is not None:
+        timings_handle.close()
+        print(config.timings.summary())
+    if over_budget:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,3 +1,4 @@
+#include <stddef.h>
 #include <stdint.h>
 
 typedef enum {
@@ -15,9 +16,45 @@ typedef struct {
 } unwind_context_t;
 
 typedef uintptr_t (*deref_func_t)(uintptr_t);
+/// Dereferencing function of a batch: index of the input, address
+typedef uintptr_t (*deref_batch_func_t)(size_t, uintptr_t);
 
 typedef unwind_context_t (*_fde_func_t)(unwind_context_t, uintptr_t);
 typedef unwind_context_t (*_fde_func_with_deref_t)(
         unwind_context_t,
         uintptr_t,
         deref_func_t);
+
+typedef void (*_eh_elf_batch_func_t)(
+        size_t,
+        const uintptr_t*,
+        const unwind_context_t*,
+        unwind_context_t*);
+typedef void (*_eh_elf_batch_func_with_deref_t)(
+        size_t,
+        const uintptr_t*,
+        const unwind_context_t*,
+        unwind_context_t*,
+        deref_batch_func_t);
+
+/// How a register of the unwound context is recovered, in an `unwind_rule_t`
+typedef enum {
+    UNWR_UNDEFINED=0, ///< Not recovered
+    UNWR_REGISTER=1, ///< Value of `reg` in the context, plus `offset`
+    UNWR_CFA_OFFSET=2, ///< Value stored at CFA + `offset`
+    UNWR_PLT_EXPR=3 ///< CFA of a PLT stub, depending on the PC
+} unwind_rule_kind_t;
+
+typedef struct {
+    uint8_t kind; ///< An `unwind_rule_kind_t`
+    uint8_t reg; ///< For `UNWR_REGISTER`, as an `unwind_flags_t` bit
+    int32_t offset;
+} unwind_reg_rule_t;
+
+/// The decoded row of a PC, as returned by `_eh_elf_rule`
+typedef struct {
+    uint8_t error; ///< Unwinding from this PC yields the error flag
+    unwind_reg_rule_t cfa, rbp, ra, rbx;
+} unwind_rule_t;
+
+typedef int (*_eh_elf_rule_func_t)(uintptr_t, unwind_rule_t*);
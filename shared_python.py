@@ -3,6 +3,16 @@
 import subprocess
 import re
 import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import signal
+import tarfile
+import tempfile
+import threading
+from contextlib import contextmanager
 from collections import namedtuple
 
 
@@ -83,78 +93,545 @@ def elf_so_deps(path):
              "{}.").format(path, exn.returncode))
 
 
-def do_remote(remote, command, send_files=None, retr_files=None):
-    ''' Execute remotely (via ssh) a given command
+def invoke_objdump_headers(elf_loc):
+    ''' Call objdump -h, returning the list of lines outputted '''
 
-    The command is executed on the machine described by `remote` (see ssh(1)).
+    if not os.path.isfile(elf_loc):
+        raise FileNotFoundError
 
-    If `preload` is set, then the remote file at this path will be sourced
-    before running any command, allowing to set PATH and other variables.
+    try:
+        objdump_out = subprocess.check_output(['objdump', '-h', elf_loc]) \
+            .decode('utf-8')
+    except subprocess.CalledProcessError as exn:
+        raise Exception(("Cannot run objdump on {}: objdump "
+                         "terminated with exit code {}.").format(
+                             elf_loc, exn.returncode))
 
-    send_files is a list of file paths that must be first copied at the root of
-    a temporary directory on `remote` before running the command. Consider
-    yourself jailed in that directory.
+    return objdump_out.split('\n')
 
-    retr_files is a list of files that will be copied to the local machine
-    after the command is executed. Each list item can either be a string, which
-    is both the path on the remote and the local machine; or a pair
-    `(file_name, local_path)`. In the latter case, `file_name` is copied as
-    `local_path/file_name` if `local_path` is a directory, or as `local_path`
-    otherwise, on the local machine.
-    '''
 
-    if send_files is None:
-        send_files = []
-    if retr_files is None:
-        retr_files = []
+def get_elf_sections(elf_loc):
+    ''' List the ELF sections of the given ELF '''
+
+    sections = {}
+    for line in invoke_objdump_headers(elf_loc):
+        line = line.strip()
+        if not line or not '0' <= line[0] <= '9':  # not a section line
+            continue
+
+        spl = line.split()
+        sections[spl[1]] = {
+            'name': spl[1],
+            'size': int(spl[2], 0x10),
+        }
+
+    return sections
+
+
+def eh_frame_size(elf_loc):
+    ''' The size of the `.eh_frame` section of the given ELF, which is a
+    fair estimate of the cost of generating its eh_elf; 0 if unknown '''
+
+    try:
+        sections = get_elf_sections(elf_loc)
+    except Exception:
+        return 0
+    return sections.get('.eh_frame', {}).get('size', 0)
+
+
+def fde_ranges(elf_loc):
+    ''' The `(beg, end)` PC ranges covered by the FDEs of the given ELF, `end`
+    excluded, as listed by readelf '''
+
+    try:
+        readelf_out = subprocess.check_output(
+            ['readelf', '--debug-dump=frames', elf_loc],
+            stderr=subprocess.DEVNULL).decode('utf-8')
+    except subprocess.CalledProcessError as exn:
+        raise Exception(("Cannot run readelf on {}: readelf "
+                         "terminated with exit code {}.").format(
+                             elf_loc, exn.returncode))
+
+    fde_re = re.compile(r' FDE .*pc=([0-9a-fA-F]+)\.\.([0-9a-fA-F]+)')
+    out = []
+    for match in fde_re.finditer(readelf_out):
+        beg, end = int(match.group(1), 0x10), int(match.group(2), 0x10)
+        if beg < end:
+            out.append((beg, end))
+    return out
 
-    def ssh_do(cmd_args, working_directory=None):
-        try:
-            cmd = ['ssh', remote]
-            if working_directory:
-                cmd += ['cd', working_directory, '&&']
-            cmd += cmd_args
 
-            return subprocess.check_output(cmd).decode('utf-8').strip()
-        except subprocess.CalledProcessError as e:
+def do_remote(remote, command, send_files=None, retr_files=None,
+              stage=None):
+    ''' Execute remotely (via ssh) a given command
+
+    The command is executed on the machine described by `remote`, which is
+    either a `RemoteSession` (or `LocalSession`), a `BuildFarm`, or a host as
+    understood by ssh(1), in which case a session is opened for this command
+    only.
+
+    See `RemoteSession.execute` for the other arguments. '''
+
+    if isinstance(remote, (RemoteSession, BuildFarm)):
+        return remote.execute(command, send_files, retr_files, stage=stage)
+
+    with make_session(remote) as session:
+        return session.execute(command, send_files, retr_files, stage=stage)
+
+
+def make_session(spec):
+    ''' Open the session described by `spec`: a `LocalSession` for
+    `LocalSession.SPEC`, else a `RemoteSession` to the ssh host `spec` '''
+    if spec == LocalSession.SPEC:
+        return LocalSession()
+    return RemoteSession(spec)
+
+
+class RemoteHostError(Exception):
+    ''' Raised when a remote machine cannot be reached, as opposed to a
+    command failing on it '''
+    pass
+
+
+class RemoteSession:
+    ''' A connection to a remote machine, through which commands are executed.
+
+    A single ssh connection is opened and multiplexed (see `ControlMaster` in
+    ssh_config(5)) for every command of the session, so that concurrent or
+    successive commands do not each pay for a handshake. Each command costs a
+    single round-trip: the files to send are streamed in as a gzipped tar
+    archive on the command's standard input, and the files to retrieve are
+    streamed back the same way. '''
+
+    OUTPUT_FILE = '.remote_output'
+
+    def __init__(self, remote):
+        self.remote = remote
+        self._control_dir = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _ssh_options(self):
+        return ['-o', 'ControlPath={}'.format(
+            os.path.join(self._control_dir, 'ctl'))]
+
+    def start(self):
+        ''' Open the master connection, if not already done. This is called
+        by the first command anyway. '''
+        with self._lock:
+            if self._control_dir is not None:
+                return
+            control_dir = tempfile.mkdtemp(prefix='eh_elf_ssh')
+            self._control_dir = control_dir
+            rc = subprocess.call(
+                ['ssh'] + self._ssh_options()
+                + ['-o', 'ControlMaster=yes', '-o', 'ControlPersist=yes',
+                   '-f', '-N', self.remote])
+            if rc != 0:
+                self._control_dir = None
+                shutil.rmtree(control_dir, ignore_errors=True)
+                raise RemoteHostError(
+                    'Cannot connect to {}: ssh terminated with exit code '
+                    '{}.'.format(self.remote, rc))
+
+    def close(self):
+        ''' Close the master connection '''
+        with self._lock:
+            if self._control_dir is None:
+                return
+            subprocess.call(
+                ['ssh'] + self._ssh_options() + ['-O', 'exit', self.remote],
+                stderr=subprocess.DEVNULL)
+            shutil.rmtree(self._control_dir, ignore_errors=True)
+            self._control_dir = None
+
+    def shell_command(self, script):
+        ''' The local command running the shell script `script` on the
+        remote machine '''
+        self.start()
+        return ['ssh'] + self._ssh_options() \
+            + ['-o', 'ControlMaster=no', self.remote, script]
+
+    def execute(self, command, send_files=None, retr_files=None,
+                stage=None):
+        ''' Execute `command`, a list of arguments, on the remote machine.
+        Returns its standard output as a string, or None if it failed.
+        Raises `RemoteHostError` if the remote machine cannot be reached.
+
+        send_files is a list of file paths that must be first copied at the
+        root of a temporary directory on the remote before running the
+        command. Consider yourself jailed in that directory.
+
+        retr_files is a list of files that will be copied to the local machine
+        after the command is executed. Each list item can either be a string,
+        which is both the path on the remote and the local machine; or a pair
+        `(file_name, local_path)`. In the latter case, `file_name` is copied as
+        `local_path/file_name` if `local_path` is a directory, or as
+        `local_path` otherwise, on the local machine.
+
+        If `stage` is a record yielded by `StageTimings.stage`, the local ssh
+        process is accounted in it, as in `run_command`. '''
+
+        if send_files is None:
+            send_files = []
+        if retr_files is None:
+            retr_files = []
+
+        retr_dests = {}
+        for descr in retr_files:
+            if isinstance(descr, str):
+                retr_dests[descr] = descr
+            elif os.path.isdir(descr[1]):
+                retr_dests[descr[0]] = os.path.join(descr[1], descr[0])
+            else:
+                retr_dests[descr[0]] = descr[1]
+
+        quoted_retr = ' '.join(map(shlex.quote, retr_dests))
+        script = (
+            'dir=$(mktemp -d) || exit 1; '
+            'cd "$dir" && tar xzf - || {{ rm -rf "$dir"; exit 1; }}; '
+            '{command} > {output}; '
+            'rc=$?; '
+            'if [ $rc -eq 0 ]; then tar czf - {output} {retr}; '
+            'else tar czf - {output}; fi; '
+            'cd / && rm -rf "$dir"; '
+            'exit $rc').format(
+                command=' '.join(map(shlex.quote, command)),
+                output=self.OUTPUT_FILE,
+                retr=quoted_retr)
+
+        proc = subprocess.Popen(
+            self.shell_command(script),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE)
+
+        # The remote side reads its whole input before writing anything, so
+        # this cannot deadlock
+        try:
+            with tarfile.open(fileobj=proc.stdin, mode='w|gz') as archive:
+                for path in send_files:
+                    archive.add(path, arcname=os.path.basename(path))
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        output = None
+        try:
+            with tarfile.open(fileobj=proc.stdout, mode='r|gz') as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    if member.name == self.OUTPUT_FILE:
+                        output = archive.extractfile(member).read()
+                    elif member.name in retr_dests:
+                        with open(retr_dests[member.name], 'wb') as handle:
+                            shutil.copyfileobj(archive.extractfile(member),
+                                               handle)
+        except tarfile.ReadError:
+            pass  # Nothing sent back: the remote command could not be run
+        finally:
+            proc.stdout.close()
+
+        returncode = wait_command(proc, stage)
+        if returncode == 255 and output is None:
+            # ssh's own exit code: the command did not even run
+            raise RemoteHostError(
+                'Lost connection to {}.'.format(self.remote))
+        if returncode != 0 or output is None:
             return None
+        return output.decode('utf-8').strip()
+
+
+class BuildFarm:
+    ''' A pool of sessions among which commands are dispatched.
+
+    `specs` is a list of session specifications, as accepted by
+    `make_session`; a host listed N times gets N concurrent commands. Each
+    command is sent to the host with the most free slots, waiting for one if
+    none is free. A host that cannot be reached is dropped from the pool and
+    its command retried on another one. '''
+
+    class Host:
+        def __init__(self, session, slots):
+            self.session = session
+            self.slots = slots
+            self.free = slots
+            self.alive = True
+
+    def __init__(self, specs):
+        slots = {}
+        for spec in specs:
+            slots[spec] = slots.get(spec, 0) + 1
+        self.hosts = [
+            self.Host(make_session(spec), count)
+            for spec, count in slots.items()]
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def slot_count(self):
+        ''' The number of commands the pool can run concurrently '''
+        with self._cond:
+            return sum(host.slots for host in self.hosts if host.alive)
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                alive = [host for host in self.hosts if host.alive]
+                if not alive:
+                    return None
+                best = max(alive, key=lambda host: host.free)
+                if best.free > 0:
+                    best.free -= 1
+                    return best
+                self._cond.wait()
+
+    def _release(self, host, failed=False):
+        with self._cond:
+            host.free += 1
+            if failed:
+                host.alive = False
+            self._cond.notify_all()
+
+    def execute(self, command, send_files=None, retr_files=None,
+                stage=None):
+        ''' Execute `command` on some host of the pool; see
+        `RemoteSession.execute`. The chosen host is recorded in `stage`. '''
+
+        while True:
+            host = self._acquire()
+            if host is None:
+                raise RemoteHostError('No build host left in the pool.')
+
+            try:
+                output = host.session.execute(
+                    command, send_files, retr_files, stage=stage)
+            except RemoteHostError as exn:
+                print('Warning: dropping build host {}: {}'.format(
+                    host.session.remote, exn), file=sys.stderr)
+                self._release(host, failed=True)
+                continue
+
+            self._release(host)
+            if stage is not None:
+                stage['host'] = host.session.remote
+            return output
+
+    def close(self):
+        ''' Close every session of the pool '''
+        for host in self.hosts:
+            host.session.close()
+
+
+class LocalSession(RemoteSession):
+    ''' A stand-in for `RemoteSession` running the commands on the local
+    machine, in a temporary directory, through the very same protocol. '''
+
+    SPEC = ':local'
+
+    def __init__(self):
+        super().__init__(self.SPEC)
+
+    def start(self):
+        pass
+
+    def close(self):
+        pass
+
+    def shell_command(self, script):
+        return ['sh', '-c', script]
+
 
-    def ssh_copy(what, where, is_upload):
-        if is_upload:
-            where = '{}:{}'.format(remote, where)
-        else:
-            what = '{}:{}'.format(remote, what)
+CommandResult = namedtuple('CommandResult', 'returncode output killed')
 
-        subprocess.check_output(['scp', what, where])
+# Limits of a command run by `run_command`: the peak resident set size, in
+# KiB, of all its processes together, and its duration, in seconds. Either may
+# be None.
+CommandLimits = namedtuple('CommandLimits', 'max_rss_kb timeout')
 
-    TransferredFile = namedtuple('TransferredFile', 'local remote')
+# Bounds of the interval at which the limits of a command are checked
+LIMITS_POLL_MIN = 0.01
+LIMITS_POLL_MAX = 0.2
 
-    def interpret_transferred_file(descr):
-        if isinstance(descr, type('')):
-            return TransferredFile(descr, descr)
-        if os.path.isdir(descr[1]):
-            to = os.path.join(descr[1], descr[0])
-        else:
-            to = descr[1]
-        return TransferredFile(descr[0], to)
 
-    # Create temp dir
-    tmp_dir = ssh_do(['mktemp', '-d'])
+def run_command(command, stage=None, stdout=None, capture=False, limits=None):
+    ''' Run `command` and wait for it, returning a `CommandResult`.
 
-    # Upload `send_files`
-    for f in send_files:
-        dest = tmp_dir+'/'
-        ssh_copy(f, dest, is_upload=True)
+    If `capture` is set, the command's standard output is returned as the
+    `output` field (as bytes); else, it is written to `stdout`, or inherited if
+    `stdout` is None.
 
-    # Do whatever must be done
-    output = ssh_do(command, working_directory=tmp_dir)
+    If `stage` is a record yielded by `StageTimings.stage`, the child's CPU
+    time and peak resident set size, as reported by `wait4`, are accounted
+    in it.
 
-    # Download `retr_files`
-    for f in map(interpret_transferred_file, retr_files):
-        src = os.path.join(tmp_dir, f.local)
-        ssh_copy(src, f.remote, is_upload=False)
+    If `limits` is a `CommandLimits`, the command runs in its own process
+    group, which is killed as soon as it goes beyond them; the `killed` field
+    is then `'memory'` or `'time'`, and is also saved in `stage`. '''
 
-    # Remove temp dir
-    ssh_do(['rm', '-rf', tmp_dir])
+    proc = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE if capture else stdout,
+        start_new_session=limits is not None)
+    output = proc.stdout.read() if capture else None
+    if capture:
+        proc.stdout.close()
 
-    return output
+    returncode, killed = _wait_command(proc, stage, limits)
+    return CommandResult(returncode, output, killed)
+
+
+def wait_command(proc, stage=None):
+    ''' Wait for the `subprocess.Popen` `proc` and return its exit code,
+    accounting its resource usage in `stage` as `run_command` does '''
+
+    return _wait_command(proc, stage)[0]
+
+
+def process_group_rss_kb(pgid):
+    ''' The total resident set size, in KiB, of the processes of the process
+    group `pgid` '''
+
+    total = 0
+    page_kb = os.sysconf('SC_PAGE_SIZE') // 1024
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(pid), 'r') as handle:
+                stat = handle.read()
+        except OSError:
+            continue  # Already gone
+        # The fields following the command name, which may contain spaces
+        fields = stat[stat.rfind(')') + 2:].split()
+        if int(fields[2]) == pgid:
+            total += int(fields[21]) * page_kb
+    return total
+
+
+def _exceeded_limit(proc, limits, elapsed):
+    ''' The limit among `limits` that `proc`'s process group is beyond, if
+    any '''
+    if limits.timeout is not None and elapsed > limits.timeout:
+        return 'time'
+    if limits.max_rss_kb is not None \
+            and process_group_rss_kb(proc.pid) > limits.max_rss_kb:
+        return 'memory'
+    return None
+
+
+def _wait_command(proc, stage=None, limits=None):
+    ''' Wait for `proc`, killing it if it goes beyond `limits`. Returns its
+    exit code and the limit it was killed for, if any. '''
+
+    killed = None
+    if limits is None:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    else:
+        beg = time.monotonic()
+        interval = LIMITS_POLL_MIN
+        try:
+            while True:
+                pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+                if pid != 0:
+                    break
+                if killed is None:
+                    killed = _exceeded_limit(
+                        proc, limits, time.monotonic() - beg)
+                    if killed is not None:
+                        os.killpg(proc.pid, signal.SIGKILL)
+                time.sleep(interval)
+                interval = min(2 * interval, LIMITS_POLL_MAX)
+        except BaseException:
+            # Not in our process group: it would survive us
+            os.killpg(proc.pid, signal.SIGKILL)
+            os.wait4(proc.pid, 0)
+            raise
+
+    if os.WIFEXITED(status):
+        proc.returncode = os.WEXITSTATUS(status)
+    else:
+        proc.returncode = -os.WTERMSIG(status)
+
+    if stage is not None:
+        stage['child_cpu'] = stage.get('child_cpu', 0.) \
+            + rusage.ru_utime + rusage.ru_stime
+        stage['peak_rss_kb'] = max(stage.get('peak_rss_kb', 0),
+                                   rusage.ru_maxrss)
+        if killed is not None:
+            stage['killed'] = killed
+
+    return proc.returncode, killed
+
+
+class StageTimings:
+    ''' Records the duration of every stage of the generation of each
+    object, and emits each record as a JSON line to `out_handle`, if any. '''
+
+    def __init__(self, out_handle=None):
+        self.out_handle = out_handle
+        self.records = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, obj, name):
+        ''' Time the stage `name` of the generation of `obj`. The yielded
+        record is a dictionary, to which extra fields can be added and which
+        can be passed to `run_command`. '''
+
+        record = {'object': obj, 'stage': name}
+        wall_beg = time.perf_counter()
+        cpu_beg = time.thread_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - wall_beg
+            record['cpu'] = time.thread_time() - cpu_beg \
+                + record.get('child_cpu', 0.)
+            self.add(record)
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self.out_handle is not None:
+                self.out_handle.write(json.dumps(record) + '\n')
+                self.out_handle.flush()
+
+    def summary(self, top=5):
+        ''' A human-readable summary of the slowest objects and stages '''
+
+        per_object = {}
+        for record in self.records:
+            per_object[record['object']] = \
+                per_object.get(record['object'], 0.) + record['wall']
+
+        slowest_objects = sorted(per_object.items(),
+                                 key=lambda x: x[1], reverse=True)[:top]
+        slowest_stages = sorted(self.records,
+                                key=lambda x: x['wall'], reverse=True)[:top]
+
+        out = ['Slowest objects:']
+        for obj, wall in slowest_objects:
+            out.append('\t{:8.2f}s  {}'.format(wall, os.path.basename(obj)))
+        out.append('Slowest stages:')
+        for record in slowest_stages:
+            out.append('\t{:8.2f}s  {} [{}] cpu {:.2f}s, peak RSS {} KiB'.format(
+                record['wall'],
+                os.path.basename(record['object']),
+                record['stage'],
+                record['cpu'],
+                record.get('peak_rss_kb', '?')))
+        return '\n'.join(out)
@@ -1,5 +1,6 @@
 /** Ensures that there is no overlapping between FDEs. In case of slight
- * conflict, the higher-IP FDE has priority. */
+ * conflict, the higher-IP FDE has priority. Unless `close_gaps` is false, each
+ * FDE is also extended up to the next one. */
 
 #pragma once
 
@@ -8,8 +9,10 @@
 
 class AntiOverlapFilter: public SimpleDwarfFilter {
     public:
-        AntiOverlapFilter(bool enable=true);
+        AntiOverlapFilter(bool enable=true, bool close_gaps=true);
 
     private:
-        SimpleDwarf do_apply(const SimpleDwarf& dw) const;
+        void do_apply(SimpleDwarf& dw) const;
+
+        bool close_gaps;
 };
@@ -17,6 +17,112 @@ static const char* PRELUDE =
 "\n"
 ;
 
+/// In partial generation, handles the PCs that no FDE covers
+static const char* UNCOVERED_FUNC_NAME = "_fde_uncovered";
+
+/// Starts each shard of the generated code, followed by the shard's number, or
+/// `main` for the last one. Every shard is compilable on its own once prefixed
+/// with what precedes the first marker.
+static const char* SHARD_MARKER = "/* eh_elf shard ";
+
+/// Sorting of the batch inputs by PC, shared by both generation policies. The
+/// inputs are sorted and unwound by chunks that fit in the cache; the radix
+/// sort only goes through the digits in which the PCs of a chunk differ.
+static const char* BATCH_PRELUDE =
+"#include <stdlib.h>\n"
+"#include <string.h>\n"
+"\n"
+"#define _BATCH_CHUNK 4096\n"
+"#define _BATCH_RADIX_BITS 8\n"
+"\n"
+"typedef struct {\n"
+"\tuintptr_t pc;\n"
+"\tsize_t index;\n"
+"} _batch_entry_t;\n"
+"\n"
+"/* Sorts `entries` by PC, using `tmp`, of the same size. Returns the sorted\n"
+" * array, either `entries` or `tmp`. */\n"
+"static _batch_entry_t* _batch_sort(\n"
+"\t\t_batch_entry_t* entries, _batch_entry_t* tmp, size_t count)\n"
+"{\n"
+"\tuintptr_t min_pc = UINTPTR_MAX, max_pc = 0;\n"
+"\tfor(size_t i = 0; i < count; ++i) {\n"
+"\t\tif(entries[i].pc < min_pc) min_pc = entries[i].pc;\n"
+"\t\tif(entries[i].pc > max_pc) max_pc = entries[i].pc;\n"
+"\t}\n"
+"\n"
+"\tsize_t counts[1 << _BATCH_RADIX_BITS];\n"
+"\tfor(unsigned shift = 0;\n"
+"\t\t\tshift < 8 * sizeof(uintptr_t) && ((max_pc - min_pc) >> shift) != 0;\n"
+"\t\t\tshift += _BATCH_RADIX_BITS)\n"
+"\t{\n"
+"\t\tmemset(counts, 0, sizeof(counts));\n"
+"\t\tfor(size_t i = 0; i < count; ++i)\n"
+"\t\t\t++counts[((entries[i].pc - min_pc) >> shift)\n"
+"\t\t\t\t& ((1 << _BATCH_RADIX_BITS) - 1)];\n"
+"\t\tsize_t pos = 0;\n"
+"\t\tfor(size_t digit = 0; digit < (1 << _BATCH_RADIX_BITS); ++digit) {\n"
+"\t\t\tsize_t digit_count = counts[digit];\n"
+"\t\t\tcounts[digit] = pos;\n"
+"\t\t\tpos += digit_count;\n"
+"\t\t}\n"
+"\t\tfor(size_t i = 0; i < count; ++i)\n"
+"\t\t\ttmp[counts[((entries[i].pc - min_pc) >> shift)\n"
+"\t\t\t\t& ((1 << _BATCH_RADIX_BITS) - 1)]++] = entries[i];\n"
+"\n"
+"\t\t_batch_entry_t* swap = entries;\n"
+"\t\tentries = tmp;\n"
+"\t\ttmp = swap;\n"
+"\t}\n"
+"\treturn entries;\n"
+"}\n"
+;
+
+/// With a dereferencing function, passes the index of the input being
+/// unwound to the batch's `deref`
+static const char* BATCH_DEREF_PRELUDE =
+"static __thread deref_batch_func_t _batch_deref;\n"
+"static __thread size_t _batch_index;\n"
+"\n"
+"static uintptr_t _batch_deref_one(uintptr_t addr) {\n"
+"\treturn _batch_deref(_batch_index, addr);\n"
+"}\n"
+;
+
+/// Switch-per-func: finds the FDE of a PC from the FDE of the previous input,
+/// galloping forwards or backwards, then binary searching. Every FDE before
+/// `low` ends before `pc`, and the FDE `high` ends after it.
+static const char* BATCH_FDE_SEARCH =
+"\tsize_t low = *cursor, high, step = 1;\n"
+"\tif(low > 0 && _batch_fdes[low - 1].end > pc) {\n"
+"\t\thigh = low - 1;\n"
+"\t\tlow = high;\n"
+"\t\twhile(low > 0 && _batch_fdes[low - 1].end > pc) {\n"
+"\t\t\thigh = low - 1;\n"
+"\t\t\tlow = (high > step) ? high - step : 0;\n"
+"\t\t\tstep *= 2;\n"
+"\t\t}\n"
+"\t}\n"
+"\telse {\n"
+"\t\thigh = low;\n"
+"\t\twhile(high < _batch_fde_count && _batch_fdes[high].end <= pc) {\n"
+"\t\t\tlow = high + 1;\n"
+"\t\t\thigh += step;\n"
+"\t\t\tstep *= 2;\n"
+"\t\t}\n"
+"\t\tif(high > _batch_fde_count)\n"
+"\t\t\thigh = _batch_fde_count;\n"
+"\t}\n"
+"\twhile(low < high) {\n"
+"\t\tsize_t mid = low + (high - low) / 2;\n"
+"\t\tif(_batch_fdes[mid].end <= pc)\n"
+"\t\t\tlow = mid + 1;\n"
+"\t\telse\n"
+"\t\t\thigh = mid;\n"
+"\t}\n"
+"\t*cursor = low;\n"
+;
+
 struct UnwFlags {
     UnwFlags():
         error(false), rip(false), rsp(false), rbp(false), rbx(false) {}
@@ -60,22 +166,32 @@ void CodeGenerator::generate() {
     gen_of_dwarf();
 }
 
-SwitchStatement CodeGenerator::gen_fresh_switch() const {
+SwitchStatement CodeGenerator::gen_fresh_switch() {
     SwitchStatement out;
     out.switch_var = "pc";
-    ostringstream default_oss;
+    out.gen_content = [this](
+            std::ostream& stream,
+            const SwitchStatement::SwitchCaseContent& content)
+    {
+        gen_of_row_content(row_of_rules_id[content.id], stream);
+    };
+    out.default_case = error_return_code();
+    return out;
+}
+
+std::string CodeGenerator::error_return_code() {
+    ostringstream oss;
     UnwFlags flags;
     flags.error = true;
-    default_oss
+    oss
         << "out_ctx.flags = " << (int) flags.to_uint8() << "u;\n"
         << "return out_ctx;\n";
-    out.default_case = default_oss.str();
-    return out;
+    return oss.str();
 }
 
 void CodeGenerator::switch_append_fde(
         SwitchStatement& sw,
-        const SimpleDwarf::Fde& fde) const
+        const SimpleDwarf::Fde& fde)
 {
     for(size_t fde_row_id=0; fde_row_id < fde.rows.size(); ++fde_row_id)
     {
@@ -86,63 +202,242 @@ void CodeGenerator::switch_append_fde(
             up_bound = fde.rows[fde_row_id + 1].ip - 1;
         sw_case.low_bound = fde.rows[fde_row_id].ip;
         sw_case.high_bound = up_bound;
-
-        ostringstream case_oss;
-        gen_of_row_content(fde.rows[fde_row_id], case_oss);
-        sw_case.content.code = case_oss.str();
+        sw_case.content = intern_row(fde.rows[fde_row_id]);
 
         sw.cases.push_back(sw_case);
     }
 }
 
+CodeGenerator::RowRules CodeGenerator::rules_of_row(
+        const SimpleDwarf::DwRow& row) const
+{
+    // This must follow closely `gen_of_row_content`: two rows generate the
+    // same code iff they have the same rules.
+    RowRules rules;
+    rules.fill(-1);
+
+    auto set_reg = [&rules](size_t pos, const SimpleDwarf::DwRegister& reg) {
+        rules[3 * pos] = reg.type;
+        switch(reg.type) {
+            case SimpleDwarf::DwRegister::REG_REGISTER:
+                rules[3 * pos + 1] = reg.reg;
+                rules[3 * pos + 2] = reg.offset;
+                break;
+            case SimpleDwarf::DwRegister::REG_CFA_OFFSET:
+                rules[3 * pos + 2] = reg.offset;
+                break;
+            default:
+                break;
+        }
+    };
+
+    // Invalid RA or CFA: the row is only an error
+    if(!check_reg_valid(row.ra) || !check_reg_valid(row.cfa))
+        return rules;
+
+    set_reg(0, row.cfa);
+    if(row.cfa.type == SimpleDwarf::DwRegister::REG_UNDEFINED)
+        return rules; // The generation stops there
+
+    const SimpleDwarf::DwRegister* others[] = {&row.rbp, &row.ra, &row.rbx};
+    for(size_t pos = 0; pos < 3; ++pos) {
+        if(check_reg_defined(*others[pos]))
+            set_reg(pos + 1, *others[pos]);
+    }
+    return rules;
+}
+
+SwitchStatement::SwitchCaseContent CodeGenerator::intern_row(
+        const SimpleDwarf::DwRow& row)
+{
+    auto inserted = row_rules_ids.insert(
+            make_pair(rules_of_row(row), row_of_rules_id.size()));
+    if(inserted.second) // New rules
+        row_of_rules_id.push_back(row);
+
+    SwitchStatement::SwitchCaseContent content;
+    content.id = inserted.first->second;
+    return content;
+}
+
 void CodeGenerator::gen_of_dwarf() {
     os << CONTEXT_STRUCT_STR << '\n'
        << PRELUDE << '\n' << endl;
 
+    vector<pair<size_t, size_t>> shards = shard_bounds();
+    bool sharded = shards.size() > 1;
+
     switch(settings::switch_generation_policy) {
         case settings::SGP_SwitchPerFunc:
         {
             vector<LookupEntry> lookup_entries;
 
             // A function per FDE
-            for(const auto& fde: dwarf.fde_list) {
-                LookupEntry cur_entry;
-                cur_entry.name = naming_scheme(fde);
-                cur_entry.beg = fde.beg_ip;
-                cur_entry.end = fde.end_ip;
-                lookup_entries.push_back(cur_entry);
-
-                gen_function_of_fde(fde);
+            for(size_t shard = 0; shard < shards.size(); ++shard) {
+                if(sharded)
+                    gen_shard_marker(to_string(shard));
+                for(size_t pos = shards[shard].first;
+                        pos < shards[shard].second; ++pos)
+                {
+                    const auto& fde = dwarf.fde_list[pos];
+                    LookupEntry cur_entry;
+                    cur_entry.name = naming_scheme(fde);
+                    cur_entry.beg = fde.beg_ip;
+                    cur_entry.end = fde.end_ip;
+                    lookup_entries.push_back(cur_entry);
+
+                    gen_function_of_fde(fde);
+                    os << endl;
+                }
+            }
+
+            if(sharded) {
+                // The FDE functions are defined in the other shards
+                gen_shard_marker("main");
+                for(const auto& entry: lookup_entries)
+                    gen_unwind_func_proto(entry.name);
+                os << endl;
+            }
+
+            // In partial generation, the PCs outside of the FDEs get the
+            // error flag
+            if(!settings::pc_ranges.empty()) {
+                gen_unwind_func_header(UNCOVERED_FUNC_NAME);
+                istringstream body(error_return_code());
+                string line;
+                while(getline(body, line))
+                    os << '\t' << line << '\n';
+                gen_unwind_func_footer();
                 os << endl;
             }
 
             gen_lookup(lookup_entries);
+            if(settings::enable_batch)
+                gen_batch(lookup_entries);
+            if(settings::enable_rule_table)
+                gen_rule_table();
             break;
         }
         case settings::SGP_GlobalSwitch:
         {
-            gen_unwind_func_header("_eh_elf");
-            SwitchStatement sw_stmt = gen_fresh_switch();
-            for(const auto& fde: dwarf.fde_list)
-                switch_append_fde(sw_stmt, fde);
-            (*switch_compiler)(os, sw_stmt);
-            gen_unwind_func_footer();
+            if(!sharded) {
+                gen_unwind_func_header("_eh_elf");
+                SwitchStatement sw_stmt = gen_fresh_switch();
+                for(const auto& fde: dwarf.fde_list)
+                    switch_append_fde(sw_stmt, fde);
+                (*switch_compiler)(os, sw_stmt);
+                gen_unwind_func_footer();
+            }
+            else
+                gen_sharded_global_switch(shards);
+            if(settings::enable_batch)
+                gen_batch({});
+            if(settings::enable_rule_table)
+                gen_rule_table();
             break;
         }
     }
 }
 
-void CodeGenerator::gen_unwind_func_header(const std::string& name) {
+vector<pair<size_t, size_t>> CodeGenerator::shard_bounds() const {
+    size_t fde_count = dwarf.fde_list.size();
+    size_t shard_count = min<size_t>(settings::shards, fde_count);
+    vector<pair<size_t, size_t>> out;
+    if(shard_count <= 1) {
+        out.emplace_back(0, fde_count);
+        return out;
+    }
+
+    size_t total_rows = 0;
+    for(const auto& fde: dwarf.fde_list)
+        total_rows += fde.rows.size();
+
+    // Close a shard once the shards so far hold their share of the rows, or
+    // when the FDEs left are just enough to give one to each shard left. The
+    // last shard takes whatever remains.
+    size_t beg = 0, rows = 0;
+    for(size_t pos = 0; pos + 1 < fde_count; ++pos) {
+        if(out.size() + 1 == shard_count)
+            break;
+        rows += dwarf.fde_list[pos].rows.size();
+        size_t fdes_after = fde_count - pos - 1;
+        size_t shards_after = shard_count - out.size() - 1;
+        if(rows * shard_count >= total_rows * (out.size() + 1)
+                || fdes_after == shards_after)
+        {
+            out.emplace_back(beg, pos + 1);
+            beg = pos + 1;
+        }
+    }
+    out.emplace_back(beg, fde_count);
+    return out;
+}
+
+void CodeGenerator::gen_shard_marker(const std::string& shard) {
+    os << SHARD_MARKER << shard << " */\n" << endl;
+}
+
+void CodeGenerator::gen_sharded_global_switch(
+        const std::vector<std::pair<size_t, size_t>>& shards)
+{
+    vector<string> shard_names;
+    for(size_t shard = 0; shard < shards.size(); ++shard) {
+        gen_shard_marker(to_string(shard));
+
+        string name = "_eh_elf_shard_" + to_string(shard);
+        shard_names.push_back(name);
+        gen_unwind_func_header(name);
+        SwitchStatement sw_stmt = gen_fresh_switch();
+        for(size_t pos = shards[shard].first; pos < shards[shard].second; ++pos)
+            switch_append_fde(sw_stmt, dwarf.fde_list[pos]);
+        (*switch_compiler)(os, sw_stmt);
+        gen_unwind_func_footer();
+        os << endl;
+    }
+
+    gen_shard_marker("main");
+    for(const auto& name: shard_names)
+        gen_unwind_func_proto(name);
+    os << endl;
+
+    // The FDEs are sorted: each shard covers the PCs from its first FDE to
+    // the first FDE of the next shard. The PCs below the first FDE fall in
+    // the first shard's switch, whose default case is an error.
+    string deref_arg = settings::enable_deref_arg ? ", deref" : "";
+    gen_unwind_func_signature("_eh_elf");
+    os << " {\n";
+    for(size_t shard = 0; shard + 1 < shards.size(); ++shard) {
+        os << "\tif(pc < 0x" << hex
+           << dwarf.fde_list[shards[shard + 1].first].beg_ip << dec << ")\n"
+           << "\t\treturn " << shard_names[shard]
+           << "(ctx, pc" << deref_arg << ");\n";
+    }
+    os << "\treturn " << shard_names.back()
+       << "(ctx, pc" << deref_arg << ");\n";
+    gen_unwind_func_footer();
+}
+
+void CodeGenerator::gen_unwind_func_signature(const std::string& name) {
     string deref_arg;
     if(settings::enable_deref_arg)
         deref_arg = ", deref_func_t deref";
 
     os << "unwind_context_t "
        << name
-       << "(unwind_context_t ctx, uintptr_t pc" << deref_arg << ") {\n"
+       << "(unwind_context_t ctx, uintptr_t pc" << deref_arg << ")";
+}
+
+void CodeGenerator::gen_unwind_func_header(const std::string& name) {
+    gen_unwind_func_signature(name);
+    os << " {\n"
        << "\tunwind_context_t out_ctx;" << endl;
 }
 
+void CodeGenerator::gen_unwind_func_proto(const std::string& name) {
+    gen_unwind_func_signature(name);
+    os << ";\n";
+}
+
 void CodeGenerator::gen_unwind_func_footer() {
     os << "}" << endl;
 }
@@ -296,7 +591,222 @@ void CodeGenerator::gen_lookup(const std::vector<LookupEntry>& entries) {
            << " ... 0x" << entry.end - 1 << ":\n" << std::dec
            << "\t\t\treturn &" << entry.name << ";" << endl;
     }
-    os << "\t\tdefault: assert(0);\n"
+    if(!settings::pc_ranges.empty())
+        os << "\t\tdefault: return &" << UNCOVERED_FUNC_NAME << ";\n";
+    else
+        os << "\t\tdefault: assert(0);\n";
+    os
+       << "\t}\n"
+       << "}" << endl;
+}
+
+void CodeGenerator::gen_batch(std::vector<LookupEntry> entries) {
+    bool per_func =
+        settings::switch_generation_policy == settings::SGP_SwitchPerFunc;
+    string deref_arg, deref_batch_arg, set_index;
+    if(settings::enable_deref_arg) {
+        deref_arg = ", &_batch_deref_one";
+        deref_batch_arg = ",\n\t\tderef_batch_func_t deref";
+        set_index = "\t\t\t_batch_index = index;\n";
+    }
+
+    os << '\n' << BATCH_PRELUDE << '\n';
+    if(settings::enable_deref_arg)
+        os << BATCH_DEREF_PRELUDE << '\n';
+
+    if(per_func) {
+        // The FDE functions, sorted, for a merged walk with the sorted PCs.
+        // The last entry is a sentinel, so that the array is never empty.
+        sort(entries.begin(), entries.end(),
+                [](const LookupEntry& lhs, const LookupEntry& rhs) {
+                    return lhs.beg < rhs.beg;
+                });
+        os << "typedef struct {\n"
+           << "\tuintptr_t beg, end;\n"
+           << "\t" << (settings::enable_deref_arg ?
+                   "_fde_func_with_deref_t" : "_fde_func_t")
+           << " func;\n"
+           << "} _batch_fde_t;\n\n"
+           << "static const size_t _batch_fde_count = " << entries.size()
+           << ";\n"
+           << "static const _batch_fde_t _batch_fdes[] = {\n";
+        for(const auto& entry: entries) {
+            os << "\t{" << std::hex
+               << "0x" << entry.beg << ", 0x" << entry.end << ", "
+               << std::dec
+               << "&" << entry.name << "},\n";
+        }
+        os << "\t{0, 0, NULL}\n"
+           << "};\n\n";
+    }
+
+    // Unwinds a single input. `cursor` is the FDE of the previous input.
+    os << "static inline unwind_context_t _batch_unwind_one(\n"
+       << "\t\tunwind_context_t ctx, uintptr_t pc, size_t* cursor)\n"
+       << "{\n";
+    if(per_func) {
+        os << "\tunwind_context_t out_ctx;\n"
+           << BATCH_FDE_SEARCH
+           << "\n"
+           << "\tif(low == _batch_fde_count || pc < _batch_fdes[low].beg) {\n";
+        istringstream body(error_return_code());
+        string line;
+        while(getline(body, line))
+            os << "\t\t" << line << '\n';
+        os << "\t}\n"
+           << "\treturn _batch_fdes[low].func(ctx, pc" << deref_arg << ");\n";
+    }
+    else {
+        os << "\t(void) cursor;\n"
+           << "\treturn _eh_elf(ctx, pc" << deref_arg << ");\n";
+    }
+    os << "}\n\n";
+
+    os << "void _eh_elf_batch(\n"
+       << "\t\tsize_t count, const uintptr_t* pcs,\n"
+       << "\t\tconst unwind_context_t* ctxs, unwind_context_t* out_ctxs"
+       << deref_batch_arg << ")\n"
+       << "{\n"
+       << "\tsize_t cursor = 0;\n";
+    if(settings::enable_deref_arg)
+        os << "\t_batch_deref = deref;\n";
+    os << "\tsize_t chunk_size = (count < _BATCH_CHUNK) ? count : _BATCH_CHUNK;\n"
+       << "\t_batch_entry_t* entries =\n"
+       << "\t\tmalloc(2 * chunk_size * sizeof(_batch_entry_t));\n"
+       << "\tif(entries == NULL) {\n"
+       << "\t\t// Not enough memory to sort: unwind in the input order\n"
+       << "\t\tfor(size_t index = 0; index < count; ++index) {\n"
+       << set_index
+       << "\t\t\tout_ctxs[index] = _batch_unwind_one(\n"
+       << "\t\t\t\t\tctxs[index], pcs[index], &cursor);\n"
+       << "\t\t}\n"
+       << "\t\treturn;\n"
+       << "\t}\n"
+       << "\n"
+       << "\tfor(size_t chunk = 0; chunk < count; chunk += chunk_size) {\n"
+       << "\t\tsize_t chunk_count = count - chunk;\n"
+       << "\t\tif(chunk_count > chunk_size)\n"
+       << "\t\t\tchunk_count = chunk_size;\n"
+       << "\t\tfor(size_t i = 0; i < chunk_count; ++i) {\n"
+       << "\t\t\tentries[i].pc = pcs[chunk + i];\n"
+       << "\t\t\tentries[i].index = chunk + i;\n"
+       << "\t\t}\n"
+       << "\t\t_batch_entry_t* sorted =\n"
+       << "\t\t\t_batch_sort(entries, entries + chunk_size, chunk_count);\n"
+       << "\t\tfor(size_t i = 0; i < chunk_count; ++i) {\n"
+       << "\t\t\tsize_t index = sorted[i].index;\n"
+       << set_index
+       << "\t\t\tout_ctxs[index] = _batch_unwind_one(\n"
+       << "\t\t\t\t\tctxs[index], sorted[i].pc, &cursor);\n"
+       << "\t\t}\n"
+       << "\t}\n"
+       << "\tfree(entries);\n"
+       << "}" << endl;
+}
+
+void CodeGenerator::gen_rule_table() {
+    SwitchStatement sw_stmt;
+    for(const auto& fde: dwarf.fde_list)
+        switch_append_fde(sw_stmt, fde);
+    sort(sw_stmt.cases.begin(), sw_stmt.cases.end(),
+            [](const SwitchStatement::SwitchCase& lhs,
+                const SwitchStatement::SwitchCase& rhs)
+            {
+                return lhs.low_bound < rhs.low_bound;
+            });
+
+    // One rule per distinct row, shared by all the ranges of this row
+    os << "\nstatic const unwind_rule_t _rules[] = {\n";
+    for(const auto& row: row_of_rules_id) {
+        os << "\t";
+        gen_rule_of_row(row, os);
+        os << ",\n";
+    }
+    os << "};\n\n";
+
+    // The last entry is a sentinel, so that the array is never empty.
+    os << "typedef struct {\n"
+       << "\tuintptr_t beg, end;\n"
+       << "\tuint32_t rule;\n"
+       << "} _rule_range_t;\n\n"
+       << "static const size_t _rule_range_count = " << sw_stmt.cases.size()
+       << ";\n"
+       << "static const _rule_range_t _rule_ranges[] = {\n";
+    for(const auto& sw_case: sw_stmt.cases) {
+        os << "\t{" << std::hex
+           << "0x" << sw_case.low_bound << ", 0x" << sw_case.high_bound + 1
+           << ", " << std::dec
+           << sw_case.content.id << "},\n";
+    }
+    os << "\t{0, 0, 0}\n"
+       << "};\n\n";
+
+    os << "int _eh_elf_rule(uintptr_t pc, unwind_rule_t* rule) {\n"
+       << "\tsize_t low = 0, high = _rule_range_count;\n"
+       << "\twhile(low < high) {\n"
+       << "\t\tsize_t mid = low + (high - low) / 2;\n"
+       << "\t\tif(_rule_ranges[mid].end <= pc)\n"
+       << "\t\t\tlow = mid + 1;\n"
+       << "\t\telse\n"
+       << "\t\t\thigh = mid;\n"
        << "\t}\n"
+       << "\tif(low == _rule_range_count || pc < _rule_ranges[low].beg)\n"
+       << "\t\treturn 0;\n"
+       << "\t*rule = _rules[_rule_ranges[low].rule];\n"
+       << "\treturn 1;\n"
        << "}" << endl;
 }
+
+static int flag_of_dw_name(SimpleDwarf::MachineRegister reg) {
+    switch(reg) {
+        case SimpleDwarf::REG_RSP:
+            return UNWF_RSP;
+        case SimpleDwarf::REG_RBP:
+            return UNWF_RBP;
+        case SimpleDwarf::REG_RBX:
+            return UNWF_RBX;
+        default:
+            throw CodeGenerator::NotImplementedCase();
+    }
+}
+
+void CodeGenerator::gen_rule_of_row(
+        const SimpleDwarf::DwRow& row,
+        std::ostream& stream) const
+{
+    // This must follow closely `gen_of_row_content`: the rule describes what
+    // the generated code of the row computes.
+    auto reg_rule = [this](const SimpleDwarf::DwRegister& reg) {
+        ostringstream out;
+        if(!check_reg_defined(reg)) {
+            out << "{" << UNWR_UNDEFINED << ", 0, 0}";
+            return out.str();
+        }
+        switch(reg.type) {
+            case SimpleDwarf::DwRegister::REG_REGISTER:
+                out << "{" << UNWR_REGISTER << ", "
+                    << flag_of_dw_name(reg.reg) << ", " << reg.offset << "}";
+                break;
+            case SimpleDwarf::DwRegister::REG_CFA_OFFSET:
+                out << "{" << UNWR_CFA_OFFSET << ", 0, " << reg.offset << "}";
+                break;
+            case SimpleDwarf::DwRegister::REG_PLT_EXPR:
+                out << "{" << UNWR_PLT_EXPR << ", 0, 0}";
+                break;
+            default:
+                throw UnhandledRegister();
+        }
+        return out.str();
+    };
+
+    bool error = !check_reg_valid(row.ra) || !check_reg_defined(row.cfa);
+    if(error) {
+        stream << "{1, {0, 0, 0}, {0, 0, 0}, {0, 0, 0}, {0, 0, 0}}";
+        return;
+    }
+    stream << "{0, "
+           << reg_rule(row.cfa) << ", "
+           << reg_rule(row.rbp) << ", "
+           << reg_rule(row.ra) << ", "
+           << reg_rule(row.rbx) << "}";
+}
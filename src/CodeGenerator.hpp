@@ -5,6 +5,9 @@
 #include <ostream>
 #include <functional>
 #include <memory>
+#include <array>
+#include <map>
+#include <vector>
 
 #include "SimpleDwarf.hpp"
 #include "PcListReader.hpp"
@@ -22,7 +25,8 @@ class CodeGenerator {
         class InvalidPcList: public std::exception {};
 
         /** Create a CodeGenerator to generate code for the given dwarf, on the
-         * given std::ostream object (eg. cout). */
+         * given std::ostream object (eg. cout). The dwarf is not copied, and
+         * must outlive the CodeGenerator. */
         CodeGenerator(const SimpleDwarf& dwarf, std::ostream& os,
                 NamingScheme naming_scheme,
                 AbstractSwitchCompiler* sw_compiler);
@@ -36,13 +40,34 @@ class CodeGenerator {
             uintptr_t beg, end;
         };
 
+        /** The parts of a row's registers that its generated code depends
+         * upon: for each of CFA, RBP, RA and RBX, its type, register and
+         * offset, or -1 when irrelevant. */
+        typedef std::array<int, 12> RowRules;
 
-        SwitchStatement gen_fresh_switch() const;
+
+        SwitchStatement gen_fresh_switch();
+        /// Code setting the error flag, and returning
+        static std::string error_return_code();
         void switch_append_fde(
                 SwitchStatement& sw,
-                const SimpleDwarf::Fde& fde) const;
+                const SimpleDwarf::Fde& fde);
+        RowRules rules_of_row(const SimpleDwarf::DwRow& row) const;
+        SwitchStatement::SwitchCaseContent intern_row(
+                const SimpleDwarf::DwRow& row);
         void gen_of_dwarf();
+        /** The `[first, last)` ranges of FDEs of each shard of the generated
+         * code, contiguous and balanced by number of rows. */
+        std::vector<std::pair<size_t, size_t>> shard_bounds() const;
+        /// Generate the line starting the shard `shard`
+        void gen_shard_marker(const std::string& shard);
+        /** Generate the global switch as one function per shard, and an
+         * `_eh_elf` dispatching between them */
+        void gen_sharded_global_switch(
+                const std::vector<std::pair<size_t, size_t>>& shards);
+        void gen_unwind_func_signature(const std::string& name);
         void gen_unwind_func_header(const std::string& name);
+        void gen_unwind_func_proto(const std::string& name);
         void gen_unwind_func_footer();
         void gen_function_of_fde(const SimpleDwarf::Fde& fde);
         void gen_of_row_content(
@@ -53,16 +78,30 @@ class CodeGenerator {
                 std::ostream& stream) const;
 
         void gen_lookup(const std::vector<LookupEntry>& entries);
+        /** Generate `_eh_elf_batch`. `entries` are the FDE functions in
+         * switch-per-func mode, and are unused otherwise. */
+        void gen_batch(std::vector<LookupEntry> entries);
+        /// Generate `_eh_elf_rule` and the table of decoded rows it searches
+        void gen_rule_table();
+        /// The `unwind_rule_t` initializer of a row
+        void gen_rule_of_row(
+                const SimpleDwarf::DwRow& row,
+                std::ostream& stream) const;
 
         bool check_reg_defined(const SimpleDwarf::DwRegister& reg) const;
         bool check_reg_valid(const SimpleDwarf::DwRegister& reg) const;
 
     private:
-        SimpleDwarf dwarf;
+        const SimpleDwarf& dwarf;
         std::ostream& os;
         std::unique_ptr<PcListReader> pc_list;
 
         NamingScheme naming_scheme;
 
+        /// Identifier of each distinct `RowRules` met so far
+        std::map<RowRules, size_t> row_rules_ids;
+        /// A row with these rules, for each identifier
+        std::vector<SimpleDwarf::DwRow> row_of_rules_id;
+
         std::unique_ptr<AbstractSwitchCompiler> switch_compiler;
 };
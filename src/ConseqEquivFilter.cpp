@@ -24,27 +24,21 @@ static bool equiv_row(
         && equiv_reg(r1.ra, r2.ra);
 }
 
-SimpleDwarf ConseqEquivFilter::do_apply(const SimpleDwarf& dw) const {
-    SimpleDwarf out;
-
-    for(const auto& fde: dw.fde_list) {
-        out.fde_list.push_back(SimpleDwarf::Fde());
-        SimpleDwarf::Fde& cur_fde = out.fde_list.back();
-        cur_fde.fde_offset = fde.fde_offset;
-        cur_fde.beg_ip = fde.beg_ip;
-        cur_fde.end_ip = fde.end_ip;
-
-        if(fde.rows.empty())
+void ConseqEquivFilter::do_apply(SimpleDwarf& dw) const {
+    for(auto& fde: dw.fde_list) {
+        auto& rows = fde.rows;
+        if(rows.empty())
             continue;
 
-        cur_fde.rows.push_back(fde.rows.front());
-        for(size_t pos=1; pos < fde.rows.size(); ++pos) {
-            const auto& row = fde.rows[pos];
-            if(!equiv_row(row, cur_fde.rows.back())) {
-                cur_fde.rows.push_back(row);
+        // `rows[out_pos]` is the last row kept so far
+        size_t out_pos = 0;
+        for(size_t pos=1; pos < rows.size(); ++pos) {
+            if(!equiv_row(rows[pos], rows[out_pos])) {
+                ++out_pos;
+                if(out_pos != pos)
+                    rows[out_pos] = rows[pos];
             }
         }
+        rows.resize(out_pos + 1);
     }
-
-    return out;
 }
@@ -12,5 +12,5 @@ class ConseqEquivFilter: public SimpleDwarfFilter {
         ConseqEquivFilter(bool enable=true);
 
     private:
-        SimpleDwarf do_apply(const SimpleDwarf& dw) const;
+        void do_apply(SimpleDwarf& dw) const;
 };
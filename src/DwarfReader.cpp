@@ -2,15 +2,20 @@
 
 #include "plt_std_expr.hpp"
 
+#include "settings.hpp"
+
 #include <fstream>
 #include <fileno.hpp>
 #include <set>
+#include <thread>
+#include <memory>
+#include <exception>
 
 using namespace std;
 using namespace dwarf;
 
 DwarfReader::DwarfReader(const string& path):
-    root(fileno(ifstream(path)))
+    path(path), root(fileno(ifstream(path)))
 {}
 
 // Debug function -- dumps an expression
@@ -28,17 +33,85 @@ static void dump_expr(const core::FrameSection::register_def& reg) {
 }
 
 SimpleDwarf DwarfReader::read() {
-    const core::FrameSection& fs = root.get_frame_section();
     SimpleDwarf output;
+    const core::FrameSection& fs = root.get_frame_section();
 
-    for(auto fde_it = fs.fde_begin(); fde_it != fs.fde_end(); ++fde_it) {
-        SimpleDwarf::Fde parsed_fde = read_fde(*fde_it);
-        output.fde_list.push_back(parsed_fde);
+    // The FDE list is only read once built: the workers are handed iterators
+    // into it, all found in this single pass
+    size_t thread_count = settings::reader_threads;
+    vector<fde_iterator> fdes;
+    if(thread_count > 1) {
+        for(auto fde_it = fs.fde_begin(); fde_it != fs.fde_end(); ++fde_it)
+            fdes.push_back(fde_it);
+    }
+    size_t fde_total = fdes.size();
+    if(thread_count > fde_total)
+        thread_count = fde_total;
+    if(thread_count <= 1) {
+        read_fdes(fs.fde_begin(), fs.fde_end(), output);
+        return output;
+    }
+
+    auto partition_bound = [&fdes, &fs, fde_total, thread_count](size_t part) {
+        size_t pos = fde_total * part / thread_count;
+        return (pos < fde_total) ? fdes[pos] : fs.fde_end();
+    };
+
+    // libdwarf handles cannot be shared between threads, and `read_fde` uses
+    // one for the CIE instructions: each partition but the first one is
+    // decoded by a fresh reader of its own. The readers are opened here, one
+    // at a time, as opening is not known to be thread-safe.
+    vector<SimpleDwarf> partitions(thread_count);
+    vector<exception_ptr> errors(thread_count);
+    vector<unique_ptr<DwarfReader>> readers;
+    for(size_t part = 1; part < thread_count; ++part)
+        readers.push_back(unique_ptr<DwarfReader>(new DwarfReader(path)));
+
+    vector<thread> workers;
+    for(size_t part = 1; part < thread_count; ++part) {
+        workers.emplace_back(
+            [part, &readers, &partitions, &errors, &partition_bound]() {
+                try {
+                    readers[part - 1]->read_fdes(
+                            partition_bound(part),
+                            partition_bound(part + 1),
+                            partitions[part]);
+                } catch(...) {
+                    errors[part] = current_exception();
+                }
+            });
+    }
+
+    try {
+        read_fdes(partition_bound(0), partition_bound(1), partitions[0]);
+    } catch(...) {
+        errors[0] = current_exception();
+    }
+
+    for(auto& worker: workers)
+        worker.join();
+
+    for(const auto& error: errors) {
+        if(error)
+            rethrow_exception(error);
+    }
+
+    output.fde_list.reserve(fde_total);
+    for(auto& partition: partitions) {
+        for(auto& fde: partition.fde_list)
+            output.fde_list.push_back(std::move(fde));
     }
 
     return output;
 }
 
+void DwarfReader::read_fdes(
+        fde_iterator first, fde_iterator last, SimpleDwarf& output)
+{
+    for(auto fde_it = first; fde_it != last; ++fde_it)
+        output.fde_list.push_back(read_fde(*fde_it));
+}
+
 void DwarfReader::add_cell_to_row(
         const dwarf::core::FrameSection::register_def& reg,
         int reg_id,
@@ -4,6 +4,7 @@
 #pragma once
 
 #include <string>
+#include <utility>
 
 #include <dwarfpp/lib.hpp>
 #include <dwarfpp/regs.hpp>
@@ -16,6 +17,9 @@
 typedef std::set<std::pair<int, dwarf::core::FrameSection::register_def> >
     dwarfpp_row_t;
 
+typedef decltype(std::declval<const dwarf::core::FrameSection&>().fde_begin())
+    fde_iterator;
+
 class DwarfReader {
     public:
         class InvalidDwarf: public std::exception {};
@@ -23,10 +27,21 @@ class DwarfReader {
         /** Read the elf file located at `path`. */
         DwarfReader(const std::string& path);
 
-        /** Actually read the ELF file, generating a `SimpleDwarf` output. */
+        /** Actually read the ELF file, generating a `SimpleDwarf` output.
+         *
+         * If `settings::reader_threads` is more than 1, the FDEs are split
+         * in as many contiguous partitions, decoded in parallel, each with
+         * its own libdwarf handle. The output is the same as when reading
+         * serially (see `tests/reader_threads_check.sh`). */
         SimpleDwarf read();
 
     private: //meth
+        /** Decode the FDEs of `[first, last[`, iterators into the frame
+         * section of this reader or of another reader of the same file,
+         * appending them to `output` */
+        void read_fdes(
+                fde_iterator first, fde_iterator last, SimpleDwarf& output);
+
         SimpleDwarf::Fde read_fde(const dwarf::core::Fde& fde);
 
         void append_results_to_fde(
@@ -65,5 +80,6 @@ class DwarfReader {
         class UnsupportedRegister: public std::exception {};
 
     private:
+        std::string path;
         dwarf::core::root_die root;
 };
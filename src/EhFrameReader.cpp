@@ -0,0 +1,963 @@
+#include "EhFrameReader.hpp"
+#include "PcRangeFilter.hpp"
+
+#include <cstring>
+#include <set>
+#include <elf.h>
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+using namespace std;
+
+/* DWARF constants used here. They are defined locally rather than taken from
+ * libdwarf's `dwarf.h`, so that this reader does not depend on libdwarf. */
+enum DwEhPe {
+    DW_EH_PE_absptr = 0x00,
+    DW_EH_PE_uleb128 = 0x01,
+    DW_EH_PE_udata2 = 0x02,
+    DW_EH_PE_udata4 = 0x03,
+    DW_EH_PE_udata8 = 0x04,
+    DW_EH_PE_sleb128 = 0x09,
+    DW_EH_PE_sdata2 = 0x0a,
+    DW_EH_PE_sdata4 = 0x0b,
+    DW_EH_PE_sdata8 = 0x0c,
+    DW_EH_PE_pcrel = 0x10,
+    DW_EH_PE_datarel = 0x30,
+    DW_EH_PE_indirect = 0x80,
+    DW_EH_PE_omit = 0xff,
+};
+
+enum DwCfa {
+    DW_CFA_advance_loc = 0x40,
+    DW_CFA_offset = 0x80,
+    DW_CFA_restore = 0xc0,
+    DW_CFA_nop = 0x00,
+    DW_CFA_set_loc = 0x01,
+    DW_CFA_advance_loc1 = 0x02,
+    DW_CFA_advance_loc2 = 0x03,
+    DW_CFA_advance_loc4 = 0x04,
+    DW_CFA_offset_extended = 0x05,
+    DW_CFA_restore_extended = 0x06,
+    DW_CFA_undefined = 0x07,
+    DW_CFA_same_value = 0x08,
+    DW_CFA_register = 0x09,
+    DW_CFA_remember_state = 0x0a,
+    DW_CFA_restore_state = 0x0b,
+    DW_CFA_def_cfa = 0x0c,
+    DW_CFA_def_cfa_register = 0x0d,
+    DW_CFA_def_cfa_offset = 0x0e,
+    DW_CFA_def_cfa_expression = 0x0f,
+    DW_CFA_expression = 0x10,
+    DW_CFA_offset_extended_sf = 0x11,
+    DW_CFA_def_cfa_sf = 0x12,
+    DW_CFA_def_cfa_offset_sf = 0x13,
+    DW_CFA_val_offset = 0x14,
+    DW_CFA_val_offset_sf = 0x15,
+    DW_CFA_val_expression = 0x16,
+    DW_CFA_GNU_args_size = 0x2e,
+    DW_CFA_GNU_negative_offset_extended = 0x2f,
+};
+
+enum DwOp {
+    DW_OP_addr = 0x03,
+    DW_OP_deref = 0x06,
+    DW_OP_const1u = 0x08,
+    DW_OP_const1s = 0x09,
+    DW_OP_const2u = 0x0a,
+    DW_OP_const2s = 0x0b,
+    DW_OP_const4u = 0x0c,
+    DW_OP_const4s = 0x0d,
+    DW_OP_const8u = 0x0e,
+    DW_OP_const8s = 0x0f,
+    DW_OP_constu = 0x10,
+    DW_OP_consts = 0x11,
+    DW_OP_pick = 0x15,
+    DW_OP_plus_uconst = 0x23,
+    DW_OP_bra = 0x28,
+    DW_OP_ne = 0x2e,
+    DW_OP_skip = 0x2f,
+    DW_OP_lit0 = 0x30,
+    DW_OP_reg31 = 0x6f,
+    DW_OP_breg0 = 0x70,
+    DW_OP_breg31 = 0x8f,
+    DW_OP_deref_size = 0x94,
+    DW_OP_xderef_size = 0x95,
+};
+
+/** The standard PLT expression, as recognized by DwarfReader through
+ * `REFERENCE_PLT_EXPR`. Comparing encoded expressions is equivalent, since
+ * libdwarf also compares the offsets of each operation. */
+static const uint8_t PLT_EXPR[] = {
+    0x77, 0x08, // DW_OP_breg7 (rsp) 8
+    0x80, 0x00, // DW_OP_breg16 (rip) 0
+    0x3f,       // DW_OP_lit15
+    0x1a,       // DW_OP_and
+    0x3b,       // DW_OP_lit11
+    0x2a,       // DW_OP_ge
+    0x33,       // DW_OP_lit3
+    0x24,       // DW_OP_shl
+    0x22,       // DW_OP_plus
+};
+
+/// DWARF register numbers on x86_64
+enum X86_64DwarfRegister {
+    DW_X86_64_RBX = 3,
+    DW_X86_64_RBP = 6,
+    DW_X86_64_RSP = 7,
+    DW_X86_64_RIP = 16,
+};
+
+class UnsupportedRegister: public std::exception {};
+
+/** Same as `DwarfReader::from_dwarfpp_reg` */
+static SimpleDwarf::MachineRegister from_dwarf_reg(int reg_id, int ra_reg=-1) {
+    if(reg_id == ra_reg)
+        return SimpleDwarf::REG_RA;
+    switch(reg_id) {
+        case DW_X86_64_RIP:
+            return SimpleDwarf::REG_RIP;
+        case DW_X86_64_RSP:
+            return SimpleDwarf::REG_RSP;
+        case DW_X86_64_RBP:
+            return SimpleDwarf::REG_RBP;
+        case DW_X86_64_RBX:
+            return SimpleDwarf::REG_RBX;
+        default:
+            throw UnsupportedRegister();
+    }
+}
+
+// ========== Cursor ==========================================================
+
+template<typename T> T EhFrameReader::Cursor::read() {
+    if(end - pos < (ssize_t) sizeof(T))
+        throw InvalidDwarf();
+    T out;
+    memcpy(&out, pos, sizeof(T));
+    pos += sizeof(T);
+    return out;
+}
+
+uint64_t EhFrameReader::Cursor::read_uleb() {
+    uint64_t out = 0;
+    unsigned shift = 0;
+    uint8_t byte;
+    do {
+        byte = read<uint8_t>();
+        if(shift < 64)
+            out |= ((uint64_t)(byte & 0x7f)) << shift;
+        shift += 7;
+    } while(byte & 0x80);
+    return out;
+}
+
+int64_t EhFrameReader::Cursor::read_sleb() {
+    int64_t out = 0;
+    unsigned shift = 0;
+    uint8_t byte;
+    do {
+        byte = read<uint8_t>();
+        if(shift < 64)
+            out |= ((int64_t)(byte & 0x7f)) << shift;
+        shift += 7;
+    } while(byte & 0x80);
+    if(shift < 64 && (byte & 0x40))
+        out |= -(((int64_t) 1) << shift);
+    return out;
+}
+
+const char* EhFrameReader::Cursor::read_cstr() {
+    const char* out = (const char*) pos;
+    const void* nul = memchr(pos, '\0', end - pos);
+    if(nul == nullptr)
+        throw InvalidDwarf();
+    pos = (const uint8_t*) nul + 1;
+    return out;
+}
+
+void EhFrameReader::Cursor::skip(size_t len) {
+    if((size_t)(end - pos) < len)
+        throw InvalidDwarf();
+    pos += len;
+}
+
+// ========== ELF mapping =====================================================
+
+EhFrameReader::EhFrameReader(const std::string& path):
+    path(path), map_beg(nullptr), map_size(0),
+    eh_frame(nullptr), eh_frame_size(0), eh_frame_addr(0),
+    eh_frame_hdr(nullptr), eh_frame_hdr_size(0), eh_frame_hdr_addr(0)
+{
+    int fd = open(path.c_str(), O_RDONLY);
+    if(fd < 0)
+        throw InvalidElf();
+
+    struct stat file_stat;
+    if(fstat(fd, &file_stat) < 0 || file_stat.st_size == 0) {
+        close(fd);
+        throw InvalidElf();
+    }
+    map_size = file_stat.st_size;
+
+    void* mapped = mmap(nullptr, map_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if(mapped == MAP_FAILED)
+        throw InvalidElf();
+    map_beg = (const uint8_t*) mapped;
+
+    try {
+        find_eh_frame();
+    } catch(...) {
+        munmap((void*) map_beg, map_size);
+        throw;
+    }
+}
+
+EhFrameReader::~EhFrameReader() {
+    munmap((void*) map_beg, map_size);
+}
+
+void EhFrameReader::find_eh_frame() {
+    if(map_size < sizeof(Elf64_Ehdr))
+        throw InvalidElf();
+    const Elf64_Ehdr* ehdr = (const Elf64_Ehdr*) map_beg;
+    if(memcmp(ehdr->e_ident, ELFMAG, SELFMAG) != 0
+            || ehdr->e_ident[EI_CLASS] != ELFCLASS64
+            || ehdr->e_ident[EI_DATA] != ELFDATA2LSB
+            || ehdr->e_machine != EM_X86_64)
+    {
+        throw InvalidElf();
+    }
+
+    // The .eh_frame_hdr, if any, is only described by a segment
+    if(ehdr->e_phoff + ehdr->e_phnum * sizeof(Elf64_Phdr) > map_size)
+        throw InvalidElf();
+    const Elf64_Phdr* phdrs = (const Elf64_Phdr*) (map_beg + ehdr->e_phoff);
+    for(size_t seg = 0; seg < ehdr->e_phnum; ++seg) {
+        if(phdrs[seg].p_type != PT_GNU_EH_FRAME)
+            continue;
+        eh_frame_hdr = vaddr_to_ptr(phdrs[seg].p_vaddr, &eh_frame_hdr_size);
+        eh_frame_hdr_addr = phdrs[seg].p_vaddr;
+        break;
+    }
+
+    // Through the section headers, if present
+    if(ehdr->e_shoff != 0
+            && ehdr->e_shstrndx < ehdr->e_shnum
+            && ehdr->e_shoff + ehdr->e_shnum * sizeof(Elf64_Shdr) <= map_size)
+    {
+        const Elf64_Shdr* shdrs = (const Elf64_Shdr*) (map_beg + ehdr->e_shoff);
+        const Elf64_Shdr& strtab = shdrs[ehdr->e_shstrndx];
+        for(size_t sec = 0; sec < ehdr->e_shnum; ++sec) {
+            const Elf64_Shdr& shdr = shdrs[sec];
+            if(strtab.sh_offset + shdr.sh_name >= map_size)
+                continue;
+            const char* name =
+                (const char*) (map_beg + strtab.sh_offset + shdr.sh_name);
+            if(strncmp(name, ".eh_frame",
+                        map_size - (strtab.sh_offset + shdr.sh_name)) != 0
+                    || shdr.sh_type == SHT_NOBITS
+                    || shdr.sh_offset + shdr.sh_size > map_size)
+            {
+                continue;
+            }
+
+            eh_frame = map_beg + shdr.sh_offset;
+            eh_frame_size = shdr.sh_size;
+            eh_frame_addr = shdr.sh_addr;
+            return;
+        }
+    }
+
+    // Else, through the .eh_frame_hdr, which points to the .eh_frame
+    if(eh_frame_hdr == nullptr)
+        throw InvalidElf(); // No .eh_frame
+    Cursor cur(eh_frame_hdr, eh_frame_hdr + eh_frame_hdr_size);
+    if(cur.read<uint8_t>() != 1) // version
+        throw InvalidDwarf();
+    uint8_t eh_frame_ptr_enc = cur.read<uint8_t>();
+    cur.skip(2); // fde_count_enc, table_enc
+    uintptr_t eh_frame_vaddr = read_encoded(cur, eh_frame_ptr_enc);
+
+    // The size is unknown: read up to the zero terminator
+    eh_frame = vaddr_to_ptr(eh_frame_vaddr, &eh_frame_size);
+    eh_frame_addr = eh_frame_vaddr;
+    if(eh_frame == nullptr)
+        throw InvalidElf();
+}
+
+bool EhFrameReader::find_hdr_table(
+        const uint8_t*& table, size_t& fde_count) const
+{
+    if(eh_frame_hdr == nullptr)
+        return false;
+
+    Cursor cur(eh_frame_hdr, eh_frame_hdr + eh_frame_hdr_size);
+    if(cur.read<uint8_t>() != 1) // version
+        return false;
+    uint8_t eh_frame_ptr_enc = cur.read<uint8_t>();
+    uint8_t fde_count_enc = cur.read<uint8_t>();
+    uint8_t table_enc = cur.read<uint8_t>();
+    read_encoded(cur, eh_frame_ptr_enc);
+
+    // Only the table layout output by the linkers is handled
+    if(fde_count_enc == DW_EH_PE_omit
+            || table_enc != (DW_EH_PE_datarel | DW_EH_PE_sdata4))
+        return false;
+    fde_count = read_encoded(cur, fde_count_enc);
+    if((size_t)(cur.end - cur.pos) / HDR_TABLE_ENTRY_SIZE < fde_count)
+        return false;
+    table = cur.pos;
+    return true;
+}
+
+const uint8_t* EhFrameReader::vaddr_to_ptr(
+        uintptr_t vaddr, size_t* avail) const
+{
+    const Elf64_Ehdr* ehdr = (const Elf64_Ehdr*) map_beg;
+    const Elf64_Phdr* phdrs = (const Elf64_Phdr*) (map_beg + ehdr->e_phoff);
+    for(size_t seg = 0; seg < ehdr->e_phnum; ++seg) {
+        const Elf64_Phdr& phdr = phdrs[seg];
+        if(phdr.p_type != PT_LOAD
+                || vaddr < phdr.p_vaddr
+                || vaddr >= phdr.p_vaddr + phdr.p_filesz
+                || phdr.p_offset + phdr.p_filesz > map_size)
+        {
+            continue;
+        }
+        *avail = phdr.p_filesz - (vaddr - phdr.p_vaddr);
+        return map_beg + phdr.p_offset + (vaddr - phdr.p_vaddr);
+    }
+    return nullptr;
+}
+
+uintptr_t EhFrameReader::ptr_to_vaddr(const uint8_t* ptr) const {
+    if(eh_frame <= ptr && ptr < eh_frame + eh_frame_size)
+        return eh_frame_addr + (ptr - eh_frame);
+
+    size_t offset = ptr - map_beg;
+    const Elf64_Ehdr* ehdr = (const Elf64_Ehdr*) map_beg;
+    const Elf64_Phdr* phdrs = (const Elf64_Phdr*) (map_beg + ehdr->e_phoff);
+    for(size_t seg = 0; seg < ehdr->e_phnum; ++seg) {
+        const Elf64_Phdr& phdr = phdrs[seg];
+        if(phdr.p_type == PT_LOAD
+                && phdr.p_offset <= offset
+                && offset < phdr.p_offset + phdr.p_filesz)
+        {
+            return phdr.p_vaddr + (offset - phdr.p_offset);
+        }
+    }
+    throw InvalidElf();
+}
+
+uint64_t EhFrameReader::read_encoded(Cursor& cur, uint8_t encoding) const {
+    if(encoding == DW_EH_PE_omit)
+        return 0;
+
+    uintptr_t field_addr = ptr_to_vaddr(cur.pos);
+    uint64_t value;
+    switch(encoding & 0x0f) {
+        case DW_EH_PE_absptr:
+            value = cur.read<uint64_t>();
+            break;
+        case DW_EH_PE_uleb128:
+            value = cur.read_uleb();
+            break;
+        case DW_EH_PE_udata2:
+            value = cur.read<uint16_t>();
+            break;
+        case DW_EH_PE_udata4:
+            value = cur.read<uint32_t>();
+            break;
+        case DW_EH_PE_udata8:
+            value = cur.read<uint64_t>();
+            break;
+        case DW_EH_PE_sleb128:
+            value = cur.read_sleb();
+            break;
+        case DW_EH_PE_sdata2:
+            value = cur.read<int16_t>();
+            break;
+        case DW_EH_PE_sdata4:
+            value = cur.read<int32_t>();
+            break;
+        case DW_EH_PE_sdata8:
+            value = cur.read<int64_t>();
+            break;
+        default:
+            throw InvalidDwarf();
+    }
+
+    switch(encoding & 0x70) {
+        case DW_EH_PE_absptr:
+            break;
+        case DW_EH_PE_pcrel:
+            value += field_addr;
+            break;
+        default: // Not used on x86_64 for what we read
+            throw InvalidDwarf();
+    }
+    return value;
+}
+
+// ========== CIE, FDE ========================================================
+
+const EhFrameReader::Cie& EhFrameReader::get_cie(const uint8_t* cie_ptr) {
+    auto found = cies.find(cie_ptr);
+    if(found != cies.end())
+        return found->second;
+    return cies.insert(make_pair(cie_ptr, parse_cie(cie_ptr))).first->second;
+}
+
+EhFrameReader::Cie EhFrameReader::parse_cie(const uint8_t* cie_ptr) const {
+    if(cie_ptr < eh_frame || cie_ptr >= eh_frame + eh_frame_size)
+        throw InvalidDwarf();
+
+    Cursor cur(cie_ptr, eh_frame + eh_frame_size);
+    uint64_t length = cur.read<uint32_t>();
+    bool is_64 = false;
+    if(length == 0xffffffff) {
+        length = cur.read<uint64_t>();
+        is_64 = true;
+    }
+    const uint8_t* cie_beg = cur.pos;
+    cur.skip(length);
+    cur = Cursor(cie_beg, cur.pos);
+
+    uint64_t cie_id = is_64 ? cur.read<uint64_t>() : cur.read<uint32_t>();
+    if(cie_id != 0)
+        throw InvalidDwarf();
+
+    Cie cie;
+    cie.fde_encoding = DW_EH_PE_absptr;
+    cie.has_augmentation_data = false;
+
+    uint8_t version = cur.read<uint8_t>();
+    string augmentation = cur.read_cstr();
+    if(augmentation.find("eh") == 0)
+        cur.skip(sizeof(uint64_t));
+    cie.code_align = cur.read_uleb();
+    cie.data_align = cur.read_sleb();
+    cie.ra_reg = (version == 1) ? cur.read<uint8_t>() : cur.read_uleb();
+
+    if(!augmentation.empty() && augmentation[0] == 'z') {
+        cie.has_augmentation_data = true;
+        uint64_t aug_len = cur.read_uleb();
+        Cursor aug_cur(cur.pos, cur.pos + aug_len);
+        cur.skip(aug_len);
+
+        for(size_t pos = 1; pos < augmentation.size(); ++pos) {
+            switch(augmentation[pos]) {
+                case 'L': // LSDA encoding
+                    aug_cur.read<uint8_t>();
+                    break;
+                case 'P': { // Personality routine
+                    uint8_t encoding = aug_cur.read<uint8_t>();
+                    read_encoded(aug_cur, encoding & ~DW_EH_PE_indirect);
+                    break;
+                }
+                case 'R':
+                    cie.fde_encoding = aug_cur.read<uint8_t>();
+                    break;
+                default: // The rest of the augmentation data is skipped
+                    pos = augmentation.size();
+                    break;
+            }
+        }
+    }
+    else if(!augmentation.empty() && augmentation != "eh")
+        throw InvalidDwarf(); // Cannot know where the instructions start
+
+    cie.instrs = cur.pos;
+    cie.instrs_len = cur.end - cur.pos;
+    return cie;
+}
+
+SimpleDwarf EhFrameReader::read() {
+    SimpleDwarf output;
+
+    Cursor cur(eh_frame, eh_frame + eh_frame_size);
+    while(!cur.at_end() && read_entry(cur, output));
+
+    return output;
+}
+
+SimpleDwarf EhFrameReader::read(const std::vector<PcRange>& ranges) {
+    const uint8_t* table;
+    size_t fde_count;
+    if(!find_hdr_table(table, fde_count)) {
+        // No usable binary search table: read everything
+        SimpleDwarf output = read();
+        PcRangeFilter(ranges).apply_in_place(output);
+        return output;
+    }
+
+    // Each table entry is a pair of `int32_t`, (initial location, FDE
+    // address), both relative to the .eh_frame_hdr
+    auto table_field = [&](size_t entry, size_t field) {
+        int32_t value;
+        memcpy(&value,
+                table + entry * HDR_TABLE_ENTRY_SIZE + field * sizeof(int32_t),
+                sizeof(int32_t));
+        return (uintptr_t) (eh_frame_hdr_addr + value);
+    };
+
+    // The FDEs to read, in .eh_frame order
+    set<uintptr_t> fde_addrs;
+    for(const PcRange& range: ranges) {
+        // Last FDE starting at or before `range.beg`
+        size_t low = 0, high = fde_count;
+        while(high - low > 1) {
+            size_t mid = (low + high) / 2;
+            if(table_field(mid, 0) <= range.beg)
+                low = mid;
+            else
+                high = mid;
+        }
+
+        for(size_t entry = low;
+                entry < fde_count && table_field(entry, 0) < range.end;
+                ++entry)
+        {
+            fde_addrs.insert(table_field(entry, 1));
+        }
+    }
+
+    SimpleDwarf output;
+    for(uintptr_t fde_addr: fde_addrs) {
+        if(fde_addr < eh_frame_addr
+                || fde_addr >= eh_frame_addr + eh_frame_size)
+            throw InvalidDwarf();
+        Cursor cur(eh_frame + (fde_addr - eh_frame_addr),
+                eh_frame + eh_frame_size);
+        read_entry(cur, output);
+    }
+
+    // The FDE starting before a range may also end before it
+    PcRangeFilter(ranges).apply_in_place(output);
+    return output;
+}
+
+bool EhFrameReader::read_entry(Cursor& cur, SimpleDwarf& output) {
+    const uint8_t* entry_ptr = cur.pos;
+    uint64_t length = cur.read<uint32_t>();
+    if(length == 0) // Terminator
+        return false;
+    bool is_64 = false;
+    if(length == 0xffffffff) {
+        length = cur.read<uint64_t>();
+        is_64 = true;
+    }
+
+    Cursor entry_cur(cur.pos, cur.pos);
+    cur.skip(length);
+    entry_cur.end = cur.pos;
+
+    const uint8_t* cie_id_ptr = entry_cur.pos;
+    uint64_t cie_id =
+        is_64 ? entry_cur.read<uint64_t>() : entry_cur.read<uint32_t>();
+    if(cie_id == 0) // This is a CIE
+        return true;
+
+    // In .eh_frame, the CIE pointer is relative to its own position
+    read_fde(entry_ptr, cie_id_ptr - cie_id, entry_cur, output);
+    return true;
+}
+
+void EhFrameReader::read_fde(
+        const uint8_t* fde_ptr, const uint8_t* cie_ptr,
+        Cursor& cur, SimpleDwarf& output)
+{
+    const Cie& cie = get_cie(cie_ptr);
+
+    SimpleDwarf::Fde fde;
+    fde.fde_offset = fde_ptr - eh_frame;
+    fde.beg_ip = read_encoded(cur, cie.fde_encoding);
+    fde.end_ip = fde.beg_ip + read_encoded(cur, cie.fde_encoding & 0x0f);
+    if(cie.has_augmentation_data)
+        cur.skip(cur.read_uleb());
+
+    // As DwarfReader does, first output the rows of the CIE's initial
+    // instructions alone, then the rows of the whole FDE.
+    vector<pair<uintptr_t, CfiRow>> rows;
+    CfiRow cie_row;
+    cie_row.cfa.kind = CfaRule::UNSET;
+    uintptr_t loc = fde.beg_ip;
+    run_instructions(cie.instrs, cie.instrs_len, cie, loc,
+            nullptr, cie_row, rows);
+
+    for(const auto& row: rows)
+        append_row_to_fde(row.first, row.second, cie.ra_reg, fde);
+    if(cie_row.cfa.kind != CfaRule::UNSET || !cie_row.regs.empty()) {
+        try {
+            append_row_to_fde(loc, cie_row, cie.ra_reg, fde);
+        } catch(const InvalidDwarf&) {
+            // Ignore: the unfinished row can be undefined
+        }
+    }
+
+    rows.clear();
+    CfiRow fde_row = cie_row;
+    loc = fde.beg_ip;
+    run_instructions(cur.pos, cur.end - cur.pos, cie, loc,
+            &cie_row, fde_row, rows);
+
+    for(const auto& row: rows)
+        append_row_to_fde(row.first, row.second, cie.ra_reg, fde);
+    if(fde_row.cfa.kind != CfaRule::UNSET || !fde_row.regs.empty()) {
+        try {
+            append_row_to_fde(loc, fde_row, cie.ra_reg, fde);
+        } catch(const InvalidDwarf&) {
+            // Ignore: the unfinished row can be undefined
+        }
+    }
+
+    output.fde_list.push_back(fde);
+}
+
+// ========== CFA instructions ================================================
+
+void EhFrameReader::run_instructions(
+        const uint8_t* instrs, size_t len,
+        const Cie& cie,
+        uintptr_t& loc,
+        const CfiRow* initial_row,
+        CfiRow& row,
+        std::vector<std::pair<uintptr_t, CfiRow>>& rows) const
+{
+    Cursor cur(instrs, instrs + len);
+    vector<CfiRow> state_stack;
+
+    auto advance = [&](uintptr_t new_loc) {
+        if(new_loc != loc)
+            rows.push_back(make_pair(loc, row));
+        loc = new_loc;
+    };
+    auto set_rule = [&row](int reg, RegRule::Kind kind, int64_t offset) {
+        RegRule rule;
+        rule.kind = kind;
+        rule.reg = reg;
+        rule.offset = offset;
+        rule.expr = nullptr;
+        rule.expr_len = 0;
+        row.regs[reg] = rule;
+    };
+    auto restore = [&row, initial_row](int reg) {
+        if(initial_row != nullptr && initial_row->regs.count(reg) > 0)
+            row.regs[reg] = initial_row->regs.at(reg);
+        else
+            row.regs.erase(reg);
+    };
+
+    while(!cur.at_end()) {
+        uint8_t opcode = cur.read<uint8_t>();
+        uint8_t low_bits = opcode & 0x3f;
+
+        switch(opcode & 0xc0) {
+            case DW_CFA_advance_loc:
+                advance(loc + low_bits * cie.code_align);
+                continue;
+            case DW_CFA_offset:
+                set_rule(low_bits, RegRule::OFFSET,
+                        cur.read_uleb() * cie.data_align);
+                continue;
+            case DW_CFA_restore:
+                restore(low_bits);
+                continue;
+        }
+
+        switch(opcode) {
+            case DW_CFA_nop:
+                break;
+            case DW_CFA_set_loc:
+                advance(read_encoded(cur, cie.fde_encoding));
+                break;
+            case DW_CFA_advance_loc1:
+                advance(loc + cur.read<uint8_t>() * cie.code_align);
+                break;
+            case DW_CFA_advance_loc2:
+                advance(loc + cur.read<uint16_t>() * cie.code_align);
+                break;
+            case DW_CFA_advance_loc4:
+                advance(loc + cur.read<uint32_t>() * cie.code_align);
+                break;
+            case DW_CFA_offset_extended: {
+                int reg = cur.read_uleb();
+                set_rule(reg, RegRule::OFFSET,
+                        cur.read_uleb() * cie.data_align);
+                break;
+            }
+            case DW_CFA_restore_extended:
+                restore(cur.read_uleb());
+                break;
+            case DW_CFA_undefined:
+                set_rule(cur.read_uleb(), RegRule::UNDEFINED, 0);
+                break;
+            case DW_CFA_same_value:
+                set_rule(cur.read_uleb(), RegRule::SAME_VALUE, 0);
+                break;
+            case DW_CFA_register: {
+                int reg = cur.read_uleb();
+                set_rule(reg, RegRule::REGISTER, 0);
+                row.regs[reg].reg = cur.read_uleb();
+                break;
+            }
+            case DW_CFA_remember_state:
+                state_stack.push_back(row);
+                break;
+            case DW_CFA_restore_state:
+                if(state_stack.empty())
+                    throw InvalidDwarf();
+                row = state_stack.back();
+                state_stack.pop_back();
+                break;
+            case DW_CFA_def_cfa:
+                row.cfa.kind = CfaRule::REG_OFFSET;
+                row.cfa.reg = cur.read_uleb();
+                row.cfa.offset = cur.read_uleb();
+                break;
+            case DW_CFA_def_cfa_sf:
+                row.cfa.kind = CfaRule::REG_OFFSET;
+                row.cfa.reg = cur.read_uleb();
+                row.cfa.offset = cur.read_sleb() * cie.data_align;
+                break;
+            case DW_CFA_def_cfa_register:
+                row.cfa.kind = CfaRule::REG_OFFSET;
+                row.cfa.reg = cur.read_uleb();
+                break;
+            case DW_CFA_def_cfa_offset:
+                row.cfa.kind = CfaRule::REG_OFFSET;
+                row.cfa.offset = cur.read_uleb();
+                break;
+            case DW_CFA_def_cfa_offset_sf:
+                row.cfa.kind = CfaRule::REG_OFFSET;
+                row.cfa.offset = cur.read_sleb() * cie.data_align;
+                break;
+            case DW_CFA_def_cfa_expression: {
+                row.cfa.kind = CfaRule::EXPRESSION;
+                row.cfa.expr_len = cur.read_uleb();
+                row.cfa.expr = cur.pos;
+                cur.skip(row.cfa.expr_len);
+                break;
+            }
+            case DW_CFA_expression:
+            case DW_CFA_val_expression: {
+                int reg = cur.read_uleb();
+                set_rule(reg,
+                        (opcode == DW_CFA_expression) ?
+                            RegRule::EXPRESSION : RegRule::VAL_EXPRESSION,
+                        0);
+                row.regs[reg].expr_len = cur.read_uleb();
+                row.regs[reg].expr = cur.pos;
+                cur.skip(row.regs[reg].expr_len);
+                break;
+            }
+            case DW_CFA_offset_extended_sf: {
+                int reg = cur.read_uleb();
+                set_rule(reg, RegRule::OFFSET,
+                        cur.read_sleb() * cie.data_align);
+                break;
+            }
+            case DW_CFA_val_offset: {
+                int reg = cur.read_uleb();
+                set_rule(reg, RegRule::VAL_OFFSET,
+                        cur.read_uleb() * cie.data_align);
+                break;
+            }
+            case DW_CFA_val_offset_sf: {
+                int reg = cur.read_uleb();
+                set_rule(reg, RegRule::VAL_OFFSET,
+                        cur.read_sleb() * cie.data_align);
+                break;
+            }
+            case DW_CFA_GNU_args_size:
+                cur.read_uleb();
+                break;
+            case DW_CFA_GNU_negative_offset_extended: {
+                int reg = cur.read_uleb();
+                set_rule(reg, RegRule::OFFSET,
+                        -(int64_t) cur.read_uleb() * cie.data_align);
+                break;
+            }
+            default:
+                throw InvalidDwarf();
+        }
+    }
+}
+
+// ========== Conversion to SimpleDwarf =======================================
+
+void EhFrameReader::append_row_to_fde(
+        uintptr_t row_addr,
+        const CfiRow& row,
+        int ra_reg,
+        SimpleDwarf::Fde& output) const
+{
+    SimpleDwarf::DwRow cur_row;
+    cur_row.ip = row_addr;
+    cur_row.cfa = read_cfa(row.cfa);
+
+    for(const auto& cell: row.regs) {
+        try {
+            switch(from_dwarf_reg(cell.first, ra_reg)) {
+                case SimpleDwarf::REG_RBP:
+                    cur_row.rbp = read_register(cell.second);
+                    break;
+                case SimpleDwarf::REG_RBX:
+                    cur_row.rbx = read_register(cell.second);
+                    break;
+                case SimpleDwarf::REG_RA:
+                    cur_row.ra = read_register(cell.second);
+                    if(cell.second.kind == RegRule::SAME_VALUE) {
+                        // Would be the return address itself
+                        cur_row.ra.type =
+                            SimpleDwarf::DwRegister::REG_NOT_IMPLEMENTED;
+                    }
+                    break;
+                default:
+                    break;
+            }
+        }
+        catch(const UnsupportedRegister&) {} // Just ignore it.
+    }
+
+    if(cur_row.cfa.type == SimpleDwarf::DwRegister::REG_UNDEFINED)
+        throw InvalidDwarf(); // Not set
+
+    output.rows.push_back(cur_row);
+}
+
+SimpleDwarf::DwRegister EhFrameReader::read_register(
+        const RegRule& rule) const
+{
+    SimpleDwarf::DwRegister output;
+
+    try {
+        switch(rule.kind) {
+            case RegRule::REGISTER:
+            case RegRule::SAME_VALUE: // Same as "in the register itself"
+                output.type = SimpleDwarf::DwRegister::REG_REGISTER;
+                output.offset = 0;
+                output.reg = from_dwarf_reg(rule.reg);
+                break;
+
+            case RegRule::OFFSET:
+                output.type = SimpleDwarf::DwRegister::REG_CFA_OFFSET;
+                output.offset = rule.offset;
+                break;
+
+            case RegRule::UNDEFINED:
+                output.type = SimpleDwarf::DwRegister::REG_UNDEFINED;
+                break;
+
+            case RegRule::EXPRESSION:
+                read_expr(rule.expr, rule.expr_len, output);
+                break;
+
+            default:
+                output.type = SimpleDwarf::DwRegister::REG_NOT_IMPLEMENTED;
+                break;
+        }
+    }
+    catch(const UnsupportedRegister&) {
+        output.type = SimpleDwarf::DwRegister::REG_NOT_IMPLEMENTED;
+    }
+
+    return output;
+}
+
+SimpleDwarf::DwRegister EhFrameReader::read_cfa(const CfaRule& rule) const {
+    SimpleDwarf::DwRegister output;
+
+    switch(rule.kind) {
+        case CfaRule::UNSET:
+            output.type = SimpleDwarf::DwRegister::REG_UNDEFINED;
+            break;
+
+        case CfaRule::REG_OFFSET:
+            try {
+                output.type = SimpleDwarf::DwRegister::REG_REGISTER;
+                output.offset = rule.offset;
+                output.reg = from_dwarf_reg(rule.reg);
+            }
+            catch(const UnsupportedRegister&) {
+                output.type = SimpleDwarf::DwRegister::REG_NOT_IMPLEMENTED;
+            }
+            break;
+
+        case CfaRule::EXPRESSION:
+            read_expr(rule.expr, rule.expr_len, output);
+            break;
+    }
+
+    return output;
+}
+
+/** Length of the operands of the DWARF expression operation `atom`, or -1 if
+ * variable or unknown */
+static int expr_operands_length(uint8_t atom) {
+    switch(atom) {
+        case DW_OP_addr:
+        case DW_OP_const8u:
+        case DW_OP_const8s:
+            return 8;
+        case DW_OP_const4u:
+        case DW_OP_const4s:
+            return 4;
+        case DW_OP_const2u:
+        case DW_OP_const2s:
+        case DW_OP_skip:
+        case DW_OP_bra:
+            return 2;
+        case DW_OP_const1u:
+        case DW_OP_const1s:
+        case DW_OP_pick:
+        case DW_OP_deref_size:
+        case DW_OP_xderef_size:
+            return 1;
+        default:
+            if(DW_OP_lit0 <= atom && atom <= DW_OP_reg31)
+                return 0;
+            if(DW_OP_deref <= atom && atom <= DW_OP_ne
+                    && atom != DW_OP_constu && atom != DW_OP_consts
+                    && atom != DW_OP_plus_uconst)
+                return 0;
+            return -1;
+    }
+}
+
+void EhFrameReader::read_expr(
+        const uint8_t* expr, size_t len,
+        SimpleDwarf::DwRegister& output) const
+{
+    if(len == sizeof(PLT_EXPR) && memcmp(expr, PLT_EXPR, len) == 0) {
+        output.type = SimpleDwarf::DwRegister::REG_PLT_EXPR;
+        return;
+    }
+
+    // Other expressions are not implemented. DwarfReader still fills the
+    // register and offset of one- or two-operations expressions starting
+    // with DW_OP_breg<n>, so do the same.
+    output.type = SimpleDwarf::DwRegister::REG_NOT_IMPLEMENTED;
+
+    Cursor cur(expr, expr + len);
+    if(cur.at_end())
+        return;
+    uint8_t first_atom = cur.read<uint8_t>();
+    if(first_atom < DW_OP_breg0 || first_atom > DW_OP_breg31)
+        return;
+    int64_t offset = cur.read_sleb();
+
+    if(!cur.at_end()) { // At most one more operation
+        int operands = expr_operands_length(cur.read<uint8_t>());
+        if(operands < 0 || (size_t)(cur.end - cur.pos) != (size_t) operands)
+            return;
+    }
+
+    try {
+        output.reg = from_dwarf_reg(first_atom - DW_OP_breg0);
+        output.offset = offset;
+    } catch(const UnsupportedRegister&) {}
+}
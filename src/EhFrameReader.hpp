@@ -0,0 +1,158 @@
+/** Reads the `.eh_frame` of an ELF file directly from a memory mapping of the
+ * file, and outputs a SimpleDwarf structure. This is an alternative to
+ * DwarfReader that does not need libdwarfpp, and only looks at the CFI. */
+
+#pragma once
+
+#include <string>
+#include <vector>
+#include <map>
+#include <cstdint>
+
+#include "SimpleDwarf.hpp"
+#include "PcRangeReader.hpp"
+
+class EhFrameReader {
+    public:
+        /// The file cannot be read, or is not a x86_64 ELF with a .eh_frame
+        class InvalidElf: public std::exception {};
+        /// The .eh_frame is malformed, or unsupported
+        class InvalidDwarf: public std::exception {};
+
+        /** Map the elf file located at `path`. */
+        EhFrameReader(const std::string& path);
+        ~EhFrameReader();
+
+        EhFrameReader(const EhFrameReader&) = delete;
+        EhFrameReader& operator=(const EhFrameReader&) = delete;
+
+        /** Actually read the ELF file, generating a `SimpleDwarf` output. The
+         * registers are interpreted the same way as DwarfReader does. */
+        SimpleDwarf read();
+
+        /** Same as `read`, but only for the FDEs overlapping `ranges`, which
+         * must be sorted and disjoint. Those FDEs are looked up in the
+         * `.eh_frame_hdr` binary search table, when there is one, instead of
+         * decoding the whole `.eh_frame`. */
+        SimpleDwarf read(const std::vector<PcRange>& ranges);
+
+    private: //types
+        /// Size of an entry of the .eh_frame_hdr binary search table
+        static const size_t HDR_TABLE_ENTRY_SIZE = 8;
+
+        /// The rule for a register in a CFI row
+        struct RegRule {
+            enum Kind {
+                UNDEFINED,
+                SAME_VALUE,
+                OFFSET, ///< Saved at CFA + offset
+                VAL_OFFSET, ///< Value is CFA + offset
+                REGISTER, ///< Value of the register `reg`
+                EXPRESSION, ///< Saved at the address computed by `expr`
+                VAL_EXPRESSION ///< Value computed by `expr`
+            };
+
+            Kind kind;
+            int reg;
+            int64_t offset;
+            const uint8_t* expr;
+            size_t expr_len;
+        };
+
+        /// The rule for the CFA in a CFI row
+        struct CfaRule {
+            enum Kind {
+                UNSET,
+                REG_OFFSET, ///< Value of `reg` + `offset`
+                EXPRESSION ///< Computed by `expr`
+            };
+
+            Kind kind;
+            int reg;
+            int64_t offset;
+            const uint8_t* expr;
+            size_t expr_len;
+        };
+
+        /// The rules in effect at some point of a function
+        struct CfiRow {
+            CfaRule cfa;
+            std::map<int, RegRule> regs;
+        };
+
+        struct Cie {
+            uint64_t code_align;
+            int64_t data_align;
+            int ra_reg;
+            uint8_t fde_encoding;
+            bool has_augmentation_data;
+            const uint8_t* instrs;
+            size_t instrs_len;
+        };
+
+        /// Reads through a bounded piece of memory
+        class Cursor {
+            public:
+                Cursor(const uint8_t* pos, const uint8_t* end)
+                    : pos(pos), end(end) {}
+
+                template<typename T> T read();
+                uint64_t read_uleb();
+                int64_t read_sleb();
+                const char* read_cstr();
+                void skip(size_t len);
+                bool at_end() const { return pos >= end; }
+
+                const uint8_t* pos;
+                const uint8_t* end;
+        };
+
+    private: //meth
+        void find_eh_frame();
+        bool find_hdr_table(const uint8_t*& table, size_t& fde_count) const;
+        const uint8_t* vaddr_to_ptr(uintptr_t vaddr, size_t* avail) const;
+        uintptr_t ptr_to_vaddr(const uint8_t* ptr) const;
+
+        uint64_t read_encoded(Cursor& cur, uint8_t encoding) const;
+
+        bool read_entry(Cursor& cur, SimpleDwarf& output);
+        const Cie& get_cie(const uint8_t* cie_ptr);
+        Cie parse_cie(const uint8_t* cie_ptr) const;
+        void read_fde(
+                const uint8_t* fde_ptr, const uint8_t* cie_ptr,
+                Cursor& cur, SimpleDwarf& output);
+
+        void run_instructions(
+                const uint8_t* instrs, size_t len,
+                const Cie& cie,
+                uintptr_t& loc,
+                const CfiRow* initial_row,
+                CfiRow& row,
+                std::vector<std::pair<uintptr_t, CfiRow>>& rows) const;
+
+        void append_row_to_fde(
+                uintptr_t row_addr,
+                const CfiRow& row,
+                int ra_reg,
+                SimpleDwarf::Fde& output) const;
+        SimpleDwarf::DwRegister read_register(const RegRule& rule) const;
+        SimpleDwarf::DwRegister read_cfa(const CfaRule& rule) const;
+        void read_expr(
+                const uint8_t* expr, size_t len,
+                SimpleDwarf::DwRegister& output) const;
+
+    private:
+        std::string path;
+        const uint8_t* map_beg;
+        size_t map_size;
+
+        const uint8_t* eh_frame;
+        size_t eh_frame_size;
+        uintptr_t eh_frame_addr;
+
+        const uint8_t* eh_frame_hdr;
+        size_t eh_frame_hdr_size;
+        uintptr_t eh_frame_hdr_addr;
+
+        std::map<const uint8_t*, Cie> cies;
+};
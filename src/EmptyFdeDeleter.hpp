@@ -11,5 +11,5 @@ class EmptyFdeDeleter: public SimpleDwarfFilter {
         EmptyFdeDeleter(bool enable=true);
 
     private:
-        SimpleDwarf do_apply(const SimpleDwarf& dw) const;
+        void do_apply(SimpleDwarf& dw) const;
 };
@@ -3,6 +3,7 @@
 #include <sstream>
 #include <string>
 #include <iostream>
+#include <algorithm>
 using namespace std;
 
 FactoredSwitchCompiler::FactoredSwitchCompiler(int indent):
@@ -41,7 +42,7 @@ void FactoredSwitchCompiler::to_stream(
        << indent_str(sw.default_case) << "\n"
        << indent() << "/* ===== LABELS  ============================== */\n\n";
 
-    gen_jump_points_code(os, jump_points);
+    gen_jump_points_code(os, sw, jump_points);
 }
 
 FactoredSwitchCompiler::FactorJumpPoint
@@ -72,11 +73,20 @@ FactoredSwitchCompiler::get_jump_point(
 }
 
 void FactoredSwitchCompiler::gen_jump_points_code(std::ostream& os,
+        const SwitchStatement& sw,
         const FactoredSwitchCompiler::JumpPointMap& jump_map)
 {
-    for(const auto& block: jump_map) {
-        os << indent() << block.second << ":\n"
-           << indent_str(block.first.code) << "\n\n";
+    // Only the unique blocks are generated here. They are written ordered by
+    // their code, as they always were.
+    vector<pair<string, const FactorJumpPoint*>> blocks;
+    blocks.reserve(jump_map.size());
+    for(const auto& block: jump_map)
+        blocks.push_back(make_pair(content_code(sw, block.first), &block.second));
+    sort(blocks.begin(), blocks.end());
+
+    for(const auto& block: blocks) {
+        os << indent() << *block.second << ":\n"
+           << indent_str(block.first) << "\n\n";
     }
     os << indent() << "assert(0);\n";
 }
@@ -33,6 +33,7 @@ class FactoredSwitchCompiler: public AbstractSwitchCompiler {
                 const SwitchStatement::SwitchCaseContent& sw_case);
 
         void gen_jump_points_code(std::ostream& os,
+                const SwitchStatement& sw,
                 const JumpPointMap& jump_map);
 
         void gen_binsearch_tree(
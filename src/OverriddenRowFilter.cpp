@@ -4,28 +4,20 @@ OverriddenRowFilter::OverriddenRowFilter(bool enable)
     : SimpleDwarfFilter(enable)
 {}
 
-SimpleDwarf OverriddenRowFilter::do_apply(const SimpleDwarf& dw) const {
-    SimpleDwarf out;
+void OverriddenRowFilter::do_apply(SimpleDwarf& dw) const {
+    for(auto& fde: dw.fde_list) {
+        auto& rows = fde.rows;
 
-    for(const auto& fde: dw.fde_list) {
-        out.fde_list.push_back(SimpleDwarf::Fde());
-        SimpleDwarf::Fde& cur_fde = out.fde_list.back();
-        cur_fde.fde_offset = fde.fde_offset;
-        cur_fde.beg_ip = fde.beg_ip;
-        cur_fde.end_ip = fde.end_ip;
-
-        if(fde.rows.empty())
-            continue;
-
-        for(size_t pos=0; pos < fde.rows.size(); ++pos) {
-            const auto& row = fde.rows[pos];
-            if(pos == fde.rows.size() - 1
-                    || row.ip != fde.rows[pos+1].ip)
-            {
-                cur_fde.rows.push_back(row);
+        // Rows are compacted towards the front: `out_pos <= pos`, so
+        // `rows[pos + 1]` is never overwritten before it is read
+        size_t out_pos = 0;
+        for(size_t pos=0; pos < rows.size(); ++pos) {
+            if(pos == rows.size() - 1 || rows[pos].ip != rows[pos+1].ip) {
+                if(out_pos != pos)
+                    rows[out_pos] = rows[pos];
+                ++out_pos;
             }
         }
+        rows.resize(out_pos);
     }
-
-    return out;
 }
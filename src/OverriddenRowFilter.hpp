@@ -11,5 +11,5 @@ class OverriddenRowFilter: public SimpleDwarfFilter {
         OverriddenRowFilter(bool enable=true);
 
     private:
-        SimpleDwarf do_apply(const SimpleDwarf& dw) const;
+        void do_apply(SimpleDwarf& dw) const;
 };
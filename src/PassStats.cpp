@@ -0,0 +1,116 @@
+#include "PassStats.hpp"
+
+#include <fstream>
+#include <sstream>
+#include <sys/resource.h>
+#include <unistd.h>
+
+using namespace std;
+
+/// Current resident set size of this process, in KiB
+static long current_rss_kb() {
+    long pages_total, pages_resident;
+    ifstream statm("/proc/self/statm");
+    if(!(statm >> pages_total >> pages_resident))
+        return -1;
+    return pages_resident * (sysconf(_SC_PAGESIZE) / 1024);
+}
+
+/** Resets the peak resident set size of this process to its current resident
+ * set size. Returns false if the kernel does not allow it. */
+static bool reset_peak_rss() {
+    ofstream clear_refs("/proc/self/clear_refs");
+    clear_refs << "5";
+    clear_refs.flush();
+    return clear_refs.good();
+}
+
+/// Peak resident set size of this process since the last reset, in KiB
+static long peak_rss_kb() {
+    ifstream status("/proc/self/status");
+    string line;
+    while(getline(status, line)) {
+        if(line.compare(0, 6, "VmHWM:") == 0) {
+            long peak;
+            if(istringstream(line.substr(6)) >> peak)
+                return peak;
+            break;
+        }
+    }
+
+    struct rusage usage;
+    getrusage(RUSAGE_SELF, &usage);
+    return usage.ru_maxrss;
+}
+
+void PassStats::begin(const std::string& name, const SimpleDwarf* input) {
+    Pass pass;
+    pass.name = name;
+    pass.wall_time = 0;
+    pass.has_input = (input != nullptr);
+    pass.has_output = false;
+    pass.fdes_in = pass.rows_in = pass.fdes_out = pass.rows_out = 0;
+    if(input != nullptr) {
+        pass.fdes_in = input->fde_list.size();
+        pass.rows_in = count_rows(*input);
+    }
+    pass.peak_rss_is_pass = reset_peak_rss();
+    passes.push_back(pass);
+
+    pass_start = chrono::steady_clock::now();
+}
+
+void PassStats::end(const SimpleDwarf* output) {
+    chrono::duration<double> elapsed =
+        chrono::steady_clock::now() - pass_start;
+
+    Pass& pass = passes.back();
+    pass.wall_time = elapsed.count();
+    pass.has_output = (output != nullptr);
+    if(output != nullptr) {
+        pass.fdes_out = output->fde_list.size();
+        pass.rows_out = count_rows(*output);
+    }
+
+    pass.peak_rss_kb = peak_rss_kb();
+    pass.rss_kb = current_rss_kb();
+}
+
+void PassStats::dump_json(std::ostream& os) const {
+    os << "{\"passes\": [";
+    for(size_t pos = 0; pos < passes.size(); ++pos) {
+        const Pass& pass = passes[pos];
+        if(pos > 0)
+            os << ", ";
+        os << "{\"name\": \"" << pass.name << "\""
+           << ", \"wall_time\": " << pass.wall_time;
+        if(pass.has_input) {
+            os << ", \"fdes_in\": " << pass.fdes_in
+               << ", \"rows_in\": " << pass.rows_in;
+        }
+        if(pass.has_output) {
+            os << ", \"fdes_out\": " << pass.fdes_out
+               << ", \"rows_out\": " << pass.rows_out;
+        }
+        os << ", \"rss_kb\": " << pass.rss_kb
+           << ", \"peak_rss_kb\": " << pass.peak_rss_kb;
+        if(!pass.peak_rss_is_pass)
+            os << ", \"peak_rss_cumulative\": true";
+        os << "}";
+    }
+    os << "]}" << endl;
+}
+
+void PassStats::dump_json(const std::string& path) const {
+    ofstream handle(path);
+    if(!handle.good())
+        throw PassStats::CannotWriteFile();
+    dump_json(handle);
+}
+
+size_t PassStats::count_rows(const SimpleDwarf& dw) {
+    size_t out = 0;
+    for(const auto& fde: dw.fde_list)
+        out += fde.rows.size();
+    return out;
+}
@@ -0,0 +1,55 @@
+/** Collects statistics about each pass of the pipeline turning an ELF into C
+ * code: wall time, size of the SimpleDwarf consumed and produced, memory
+ * usage once the pass is done and peak memory usage during the pass. These can
+ * then be dumped as JSON. */
+
+#pragma once
+
+#include <string>
+#include <vector>
+#include <chrono>
+#include <ostream>
+
+#include "SimpleDwarf.hpp"
+
+class PassStats {
+    public:
+        /// Thrown when the output file cannot be written
+        class CannotWriteFile: public std::exception {};
+
+        struct Pass {
+            std::string name;
+            double wall_time; ///< in seconds
+            bool has_input, has_output;
+            size_t fdes_in, rows_in; ///< Meaningful iff has_input
+            size_t fdes_out, rows_out; ///< Meaningful iff has_output
+            long rss_kb; ///< Resident set size at the end of the pass
+            /// Peak resident set size during the pass, or since the start of
+            /// the process if it cannot be reset (see `peak_rss_is_pass`)
+            long peak_rss_kb;
+            /// Whether `peak_rss_kb` only covers this pass
+            bool peak_rss_is_pass;
+        };
+
+        /** Start timing the pass `name`, that consumes `input` (or nothing
+         * if `input` is null) */
+        void begin(const std::string& name, const SimpleDwarf* input);
+
+        /** End the pass started by the last call to `begin`, that produced
+         * `output` (or nothing if `output` is null) */
+        void end(const SimpleDwarf* output);
+
+        const std::vector<Pass>& get_passes() const { return passes; }
+
+        /// Dump the collected statistics as JSON to `os`
+        void dump_json(std::ostream& os) const;
+
+        /// Dump the collected statistics as JSON to the file at `path`
+        void dump_json(const std::string& path) const;
+
+    private:
+        static size_t count_rows(const SimpleDwarf& dw);
+
+        std::vector<Pass> passes;
+        std::chrono::steady_clock::time_point pass_start;
+};
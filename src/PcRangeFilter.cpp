@@ -0,0 +1,19 @@
+#include "PcRangeFilter.hpp"
+
+#include <algorithm>
+
+using namespace std;
+
+PcRangeFilter::PcRangeFilter(
+        const std::vector<PcRange>& ranges, bool enable):
+    SimpleDwarfFilter(enable), ranges(ranges)
+{}
+
+void PcRangeFilter::do_apply(SimpleDwarf& dw) const {
+    dw.fde_list.erase(
+            remove_if(dw.fde_list.begin(), dw.fde_list.end(),
+                [this](const SimpleDwarf::Fde& fde) {
+                    return !pc_ranges_overlap(ranges, fde.beg_ip, fde.end_ip);
+                }),
+            dw.fde_list.end());
+}
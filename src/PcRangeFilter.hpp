@@ -0,0 +1,22 @@
+/** Only keeps the FDEs overlapping some given PC ranges, for partial
+ * generation. */
+
+#pragma once
+
+#include <vector>
+
+#include "SimpleDwarf.hpp"
+#include "SimpleDwarfFilter.hpp"
+#include "PcRangeReader.hpp"
+
+class PcRangeFilter: public SimpleDwarfFilter {
+    public:
+        /** `ranges` must be sorted and disjoint, as output by
+         * `PcRangeReader`. It must outlive this filter. */
+        PcRangeFilter(const std::vector<PcRange>& ranges, bool enable=true);
+
+    private:
+        void do_apply(SimpleDwarf& dw) const;
+
+        const std::vector<PcRange>& ranges;
+};
@@ -0,0 +1,69 @@
+#include "PcRangeReader.hpp"
+
+#include <fstream>
+#include <sstream>
+#include <algorithm>
+
+using namespace std;
+
+bool pc_ranges_overlap(
+        const std::vector<PcRange>& ranges, uintptr_t beg, uintptr_t end)
+{
+    // First range ending after `beg`
+    auto range = upper_bound(ranges.begin(), ranges.end(), beg,
+            [](uintptr_t pc, const PcRange& range) {
+                return pc < range.end;
+            });
+    return range != ranges.end() && range->beg < end;
+}
+
+PcRangeReader::PcRangeReader(const std::string& path): path(path)
+{}
+
+void PcRangeReader::read() {
+    ifstream handle(path);
+    if(!handle.good()) {
+        throw PcRangeReader::CannotReadFile();
+    }
+
+    string line;
+    while(getline(handle, line)) {
+        istringstream line_stream(line);
+        line_stream >> ws;
+        if(line_stream.eof() || line_stream.peek() == '#')
+            continue;
+
+        PcRange range;
+        line_stream >> hex >> range.beg;
+        if(line_stream.fail())
+            throw PcRangeReader::BadFormat();
+        line_stream >> ws;
+        if(line_stream.eof())
+            range.end = range.beg + 1;
+        else {
+            line_stream >> hex >> range.end;
+            if(line_stream.fail() || !(line_stream >> ws).eof())
+                throw PcRangeReader::BadFormat();
+        }
+        if(range.end <= range.beg)
+            throw PcRangeReader::BadFormat();
+
+        ranges.push_back(range);
+    }
+
+    sort(ranges.begin(), ranges.end(),
+            [](const PcRange& lhs, const PcRange& rhs) {
+                return lhs.beg < rhs.beg;
+            });
+
+    size_t out_pos = 0;
+    for(size_t pos = 0; pos < ranges.size(); ++pos) {
+        if(out_pos > 0 && ranges[pos].beg <= ranges[out_pos - 1].end) {
+            ranges[out_pos - 1].end =
+                max(ranges[out_pos - 1].end, ranges[pos].end);
+        }
+        else
+            ranges[out_pos++] = ranges[pos];
+    }
+    ranges.resize(out_pos);
+}
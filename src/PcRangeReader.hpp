@@ -0,0 +1,45 @@
+/** Reads .pc_ranges files, listing the program counters ranges of some elf
+ * file that the generated code must cover.
+ *
+ * This is a text file, each line of which is either a `BEG END` range, `END`
+ * being excluded, or a single `PC`. The addresses are in hexadecimal. Empty
+ * lines, and lines starting with `#`, are ignored.
+ */
+
+#pragma once
+
+#include <vector>
+#include <string>
+#include <cstdint>
+
+/// A range of program counters, `end` excluded
+struct PcRange {
+    uintptr_t beg, end;
+};
+
+/** Checks whether [beg, end) overlaps one of `ranges`, which must be sorted
+ * and disjoint, as output by `PcRangeReader` */
+bool pc_ranges_overlap(
+        const std::vector<PcRange>& ranges, uintptr_t beg, uintptr_t end);
+
+class PcRangeReader {
+    public:
+        /// Thrown when the file is somehow not readable
+        class CannotReadFile: public std::exception {};
+
+        /// Thrown when a line of the file cannot be parsed
+        class BadFormat: public std::exception {};
+
+        PcRangeReader(const std::string& path);
+
+        /// Actually read and process the file
+        void read();
+
+        /** Access the ranges, sorted and merged when overlapping (filled iff
+         * `read` was called before) */
+        std::vector<PcRange>& get_ranges() { return ranges; }
+
+    private:
+        std::string path;
+        std::vector<PcRange> ranges;
+};
@@ -1,14 +1,41 @@
 #include "SimpleDwarfFilter.hpp"
 
+#include <algorithm>
+
 SimpleDwarfFilter::SimpleDwarfFilter(bool enable): enable(enable)
 {}
 
 SimpleDwarf SimpleDwarfFilter::apply(const SimpleDwarf& dw) const {
+    SimpleDwarf out(dw);
+    apply_in_place(out);
+    return out;
+}
+
+void SimpleDwarfFilter::apply_in_place(SimpleDwarf& dw) const {
     if(!enable)
-        return dw;
-    return do_apply(dw);
+        return;
+    do_apply(dw);
 }
 
 SimpleDwarf SimpleDwarfFilter::operator()(const SimpleDwarf& dw) {
     return apply(dw);
 }
+
+void SimpleDwarfFilter::sort_fdes(SimpleDwarf& dw) {
+    // If all the `beg_ip`s are distinct and increasing, sorting is a no-op.
+    // Otherwise, sort anyway: `std::sort` is not stable, and the order it
+    // gives to FDEs starting at the same address must not depend on which
+    // filters ran before.
+    auto strictly_increasing = std::adjacent_find(
+            dw.fde_list.begin(), dw.fde_list.end(),
+            [](const SimpleDwarf::Fde& a, const SimpleDwarf::Fde& b) {
+                return a.beg_ip >= b.beg_ip;
+            }) == dw.fde_list.end();
+    if(strictly_increasing)
+        return;
+
+    std::sort(dw.fde_list.begin(), dw.fde_list.end(),
+            [](const SimpleDwarf::Fde& a, const SimpleDwarf::Fde& b) {
+                return a.beg_ip < b.beg_ip;
+            });
+}
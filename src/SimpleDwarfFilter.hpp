@@ -15,14 +15,24 @@ class SimpleDwarfFilter {
          * convenient for compact filter-chaining code. */
         SimpleDwarfFilter(bool enable=true);
 
-        /// Applies the filter
+        /// Applies the filter to a copy of `dw`
         SimpleDwarf apply(const SimpleDwarf& dw) const;
 
+        /** Applies the filter directly to `dw`. This avoids copying the whole
+         * FDE list, and should be preferred when chaining filters. */
+        void apply_in_place(SimpleDwarf& dw) const;
+
         /// Same as apply()
         SimpleDwarf operator()(const SimpleDwarf& dw);
 
+    protected:
+        /** Sorts the FDEs of `dw` by increasing `beg_ip`. This is skipped
+         * when they already are strictly increasing, which is the common case
+         * once a previous filter sorted them. */
+        static void sort_fdes(SimpleDwarf& dw);
+
     private:
-        virtual SimpleDwarf do_apply(const SimpleDwarf& dw) const = 0;
+        virtual void do_apply(SimpleDwarf& dw) const = 0;
 
         bool enable;
 };
@@ -40,6 +40,15 @@ std::string AbstractSwitchCompiler::indent_str(const std::string& str) {
     return out.str();
 }
 
+std::string AbstractSwitchCompiler::content_code(
+        const SwitchStatement& sw,
+        const SwitchStatement::SwitchCaseContent& content) const
+{
+    ostringstream out;
+    sw.gen_content(out, content);
+    return out.str();
+}
+
 std::string AbstractSwitchCompiler::indent() const {
     return string(indent_count, '\t');
 }
@@ -7,16 +7,20 @@
 #include <vector>
 #include <ostream>
 #include <memory>
+#include <functional>
 
 struct SwitchStatement {
+    /** The content of a case, as an identifier. Two contents with the same
+     * identifier generate the same code; the code itself is only generated
+     * when written, by `gen_content`. */
     struct SwitchCaseContent {
-        std::string code;
+        size_t id;
 
         bool operator==(const SwitchCaseContent& oth) const {
-            return code == oth.code;
+            return id == oth.id;
         }
         bool operator<(const SwitchCaseContent& oth) const {
-            return code < oth.code;
+            return id < oth.id;
         }
     };
     struct SwitchCase {
@@ -24,9 +28,14 @@ struct SwitchStatement {
         SwitchCaseContent content;
     };
 
+    /// Writes the code of a case's content to a stream
+    typedef std::function<void(std::ostream&, const SwitchCaseContent&)>
+        ContentGenerator;
+
     std::string switch_var;
     std::string default_case;
     std::vector<SwitchCase> cases;
+    ContentGenerator gen_content;
 };
 
 class AbstractSwitchCompiler {
@@ -39,6 +48,9 @@ class AbstractSwitchCompiler {
         virtual void to_stream(
                 std::ostream& os, const SwitchStatement& sw) = 0;
         std::string indent_str(const std::string& str) ;
+        std::string content_code(
+                const SwitchStatement& sw,
+                const SwitchStatement::SwitchCaseContent& content) const;
         std::string indent() const;
         std::string endcl() const;
 
@@ -3,9 +3,14 @@
 #include <iostream>
 #include <sstream>
 #include <cstdlib>
+#include <thread>
+#include <memory>
+#include <algorithm>
+#include <iterator>
 
 #include "SimpleDwarf.hpp"
 #include "DwarfReader.hpp"
+#include "EhFrameReader.hpp"
 #include "CodeGenerator.hpp"
 #include "SwitchStatement.hpp"
 #include "NativeSwitchCompiler.hpp"
@@ -15,6 +20,9 @@
 #include "EmptyFdeDeleter.hpp"
 #include "ConseqEquivFilter.hpp"
 #include "OverriddenRowFilter.hpp"
+#include "PcRangeFilter.hpp"
+#include "PcRangeReader.hpp"
+#include "PassStats.hpp"
 
 #include "settings.hpp"
 
@@ -54,6 +62,13 @@ MainOptions options_parse(int argc, char** argv) {
                 settings::SGP_GlobalSwitch;
         }
 
+        else if(option == "--eh-frame-reader") {
+            settings::dwarf_reader_policy = settings::DRP_EhFrame;
+        }
+        else if(option == "--cross-check-readers") {
+            settings::cross_check_readers = true;
+        }
+
         else if(option == "--pc-list") {
             if(option_pos + 1 == argc) { // missing parameter
                 exit_status = 1;
@@ -65,16 +80,72 @@ MainOptions options_parse(int argc, char** argv) {
             }
         }
 
+        else if(option == "--pc-ranges") {
+            if(option_pos + 1 == argc) { // missing parameter
+                exit_status = 1;
+                print_helptext = true;
+            }
+            else {
+                ++option_pos;
+                settings::pc_ranges = argv[option_pos];
+            }
+        }
+
         else if(option == "--enable-deref-arg") {
             settings::enable_deref_arg = true;
         }
 
+        else if(option == "--enable-batch") {
+            settings::enable_batch = true;
+        }
+
+        else if(option == "--enable-rule-table") {
+            settings::enable_rule_table = true;
+        }
+
         else if(option == "--keep-holes") {
             settings::keep_holes = true;
         }
+
+        else if(option == "--threads") {
+            if(option_pos + 1 == argc) { // missing parameter
+                exit_status = 1;
+                print_helptext = true;
+            }
+            else {
+                ++option_pos;
+                int threads = atoi(argv[option_pos]);
+                if(threads <= 0)
+                    threads = std::thread::hardware_concurrency();
+                settings::reader_threads = (threads > 0) ? threads : 1;
+            }
+        }
+
+        else if(option == "--shards") {
+            if(option_pos + 1 == argc) { // missing parameter
+                exit_status = 1;
+                print_helptext = true;
+            }
+            else {
+                ++option_pos;
+                int shards = atoi(argv[option_pos]);
+                settings::shards = (shards > 0) ? shards : 1;
+            }
+        }
+
+        else if(option == "--stats-json") {
+            if(option_pos + 1 == argc) { // missing parameter
+                exit_status = 1;
+                print_helptext = true;
+            }
+            else {
+                ++option_pos;
+                settings::stats_json = argv[option_pos];
+            }
+        }
     }
 
-    if(!seen_switch_gen_policy) {
+    if(!seen_switch_gen_policy && !settings::cross_check_readers) {
         cerr << "Error: please use either --switch-per-func or "
              << "--global-switch." << endl;
         print_helptext = true;
@@ -91,8 +162,15 @@ MainOptions options_parse(int argc, char** argv) {
              << argv[0]
              << " [--switch-per-func | --global-switch]"
              << " [--enable-deref-arg]"
+             << " [--enable-batch]"
+             << " [--enable-rule-table]"
              << " [--keep-holes]"
-             << " [--pc-list PC_LIST_FILE] elf_path"
+             << " [--eh-frame-reader | --cross-check-readers]"
+             << " [--pc-list PC_LIST_FILE]"
+             << " [--pc-ranges PC_RANGES_FILE]"
+             << " [--threads N]"
+             << " [--shards N]"
+             << " [--stats-json STATS_FILE] elf_path"
              << endl;
     }
     if(exit_status >= 0)
@@ -101,17 +179,149 @@ MainOptions options_parse(int argc, char** argv) {
     return out;
 }
 
+/** Applies in place `filter` to `dw`, accounting it as the pass `name` in
+ * `stats` */
+static void apply_filter(
+        PassStats& stats,
+        const std::string& name,
+        const SimpleDwarfFilter& filter,
+        SimpleDwarf& dw)
+{
+    stats.begin(name, &dw);
+    filter.apply_in_place(dw);
+    stats.end(&dw);
+}
+
+/** Reads the DWARF of `elf_path` with the reader selected in the settings.
+ * If `ranges` is not null, only the FDEs overlapping them are needed. */
+static SimpleDwarf read_dwarf(
+        PassStats& stats,
+        const std::string& elf_path,
+        const std::vector<PcRange>* ranges)
+{
+    SimpleDwarf output;
+    switch(settings::dwarf_reader_policy) {
+        case settings::DRP_Libdwarfpp:
+            stats.begin("DwarfReader", nullptr);
+            output = DwarfReader(elf_path).read();
+            if(ranges != nullptr) // No random access: filter afterwards
+                PcRangeFilter(*ranges).apply_in_place(output);
+            break;
+        case settings::DRP_EhFrame:
+            stats.begin("EhFrameReader", nullptr);
+            if(ranges != nullptr)
+                output = EhFrameReader(elf_path).read(*ranges);
+            else
+                output = EhFrameReader(elf_path).read();
+            break;
+    }
+    stats.end(&output);
+    return output;
+}
+
+/** Applies the whole filter chain to `dw`, in place. In `partial` generation,
+ * the PCs between the FDEs are left uncovered. */
+static void apply_filters(PassStats& stats, SimpleDwarf& dw, bool partial) {
+    apply_filter(stats, "ConseqEquivFilter", ConseqEquivFilter(), dw);
+    apply_filter(stats, "OverriddenRowFilter", OverriddenRowFilter(), dw);
+    apply_filter(stats, "EmptyFdeDeleter", EmptyFdeDeleter(), dw);
+    apply_filter(stats, "AntiOverlapFilter",
+            AntiOverlapFilter(true, !partial), dw);
+    apply_filter(stats, "PcHoleFiller",
+            PcHoleFiller(!settings::keep_holes && !partial), dw);
+}
+
+/** The PC ranges to generate, or null if the whole file must be generated */
+static std::unique_ptr<std::vector<PcRange>> read_pc_ranges() {
+    if(settings::pc_ranges.empty())
+        return nullptr;
+    PcRangeReader range_reader(settings::pc_ranges);
+    range_reader.read();
+    return make_unique<std::vector<PcRange>>(range_reader.get_ranges());
+}
+
+/** Dumps each FDE of `dw` (with its rows, but not its offset) as text, sorted
+ */
+static std::vector<std::string> fde_dumps(const SimpleDwarf& dw) {
+    std::vector<std::string> output;
+    for(const auto& fde: dw.fde_list) {
+        std::ostringstream dump;
+        dump << fde;
+        output.push_back(dump.str());
+    }
+    sort(output.begin(), output.end());
+    return output;
+}
+
+/** Reports on stderr the FDEs that differ between `reference` and `native`,
+ * and returns their count */
+static size_t report_differences(
+        const SimpleDwarf& reference,
+        const SimpleDwarf& native,
+        const std::string& stage)
+{
+    static const size_t MAX_REPORTED = 5;
+
+    std::vector<std::string> ref_dumps = fde_dumps(reference),
+        native_dumps = fde_dumps(native),
+        ref_only, native_only;
+    set_difference(ref_dumps.begin(), ref_dumps.end(),
+            native_dumps.begin(), native_dumps.end(),
+            back_inserter(ref_only));
+    set_difference(native_dumps.begin(), native_dumps.end(),
+            ref_dumps.begin(), ref_dumps.end(),
+            back_inserter(native_only));
+
+    cerr << stage << ": "
+         << reference.fde_list.size() << " FDEs with libdwarfpp, "
+         << native.fde_list.size() << " with the .eh_frame reader, "
+         << ref_only.size() << " + " << native_only.size()
+         << " differing" << endl;
+    for(size_t pos = 0; pos < ref_only.size() && pos < MAX_REPORTED; ++pos)
+        cerr << "Only with libdwarfpp: " << ref_only[pos];
+    for(size_t pos = 0; pos < native_only.size() && pos < MAX_REPORTED; ++pos)
+        cerr << "Only with the .eh_frame reader: " << native_only[pos];
+
+    return ref_only.size() + native_only.size();
+}
+
+/** Reads `elf_path` with both DwarfReader and EhFrameReader, and compares
+ * their output, both raw and after the filter chain. Returns the exit
+ * status. */
+static int cross_check_readers(const std::string& elf_path) {
+    PassStats pass_stats;
+    auto ranges = read_pc_ranges();
+    settings::dwarf_reader_policy = settings::DRP_Libdwarfpp;
+    SimpleDwarf reference = read_dwarf(pass_stats, elf_path, ranges.get());
+    settings::dwarf_reader_policy = settings::DRP_EhFrame;
+    SimpleDwarf native = read_dwarf(pass_stats, elf_path, ranges.get());
+
+    size_t raw_differences =
+        report_differences(reference, native, "Raw");
+    apply_filters(pass_stats, reference, ranges != nullptr);
+    apply_filters(pass_stats, native, ranges != nullptr);
+    size_t filtered_differences =
+        report_differences(reference, native, "Filtered");
+
+    if(!settings::stats_json.empty())
+        pass_stats.dump_json(settings::stats_json);
+
+    return (raw_differences > 0 || filtered_differences > 0) ? 1 : 0;
+}
+
 int main(int argc, char** argv) {
     MainOptions opts = options_parse(argc, argv);
-    SimpleDwarf parsed_dwarf = DwarfReader(opts.elf_path).read();
 
+    if(settings::cross_check_readers)
+        return cross_check_readers(opts.elf_path);
+
+    PassStats pass_stats;
+    auto ranges = read_pc_ranges();
     SimpleDwarf filtered_dwarf =
-        PcHoleFiller(!settings::keep_holes)(
-        AntiOverlapFilter()(
-        EmptyFdeDeleter()(
-        OverriddenRowFilter()(
-        ConseqEquivFilter()(
-            parsed_dwarf)))));
+        read_dwarf(pass_stats, opts.elf_path, ranges.get());
+
+    // The filters all work on this single FDE list, in place
+    apply_filters(pass_stats, filtered_dwarf, ranges != nullptr);
 
     FactoredSwitchCompiler* sw_compiler = new FactoredSwitchCompiler(1);
     CodeGenerator code_gen(
@@ -126,7 +336,12 @@ int main(int argc, char** argv) {
             sw_compiler
             );
 
+    pass_stats.begin("CodeGenerator", &filtered_dwarf);
     code_gen.generate();
+    pass_stats.end(nullptr);
+
+    if(!settings::stats_json.empty())
+        pass_stats.dump_json(settings::stats_json);
 
 #ifdef STATS
     cerr << "Factoring stats:\nRefers: "
@@ -2,7 +2,15 @@
 
 namespace settings {
     SwitchGenerationPolicy switch_generation_policy = SGP_SwitchPerFunc;
+    DwarfReaderPolicy dwarf_reader_policy = DRP_Libdwarfpp;
+    bool cross_check_readers = false;
     std::string pc_list = "";
+    std::string pc_ranges = "";
     bool enable_deref_arg = false;
+    bool enable_batch = false;
+    bool enable_rule_table = false;
     bool keep_holes = false;
+    std::string stats_json = "";
+    unsigned reader_threads = 1;
+    unsigned shards = 1;
 }
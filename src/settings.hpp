@@ -13,9 +13,30 @@ namespace settings {
         SGP_GlobalSwitch ///< One big switch per ELF file
     };
 
+    /// Controls how the DWARF is read from the ELF file
+    enum DwarfReaderPolicy {
+        DRP_Libdwarfpp, ///< Through libdwarfpp (DwarfReader)
+        DRP_EhFrame ///< Directly from the mapped `.eh_frame` (EhFrameReader)
+    };
+
     extern SwitchGenerationPolicy switch_generation_policy;
+    extern DwarfReaderPolicy dwarf_reader_policy;
+    extern bool cross_check_readers; /**< Read with both readers, report the
+                                       differences and exit */
     extern std::string pc_list;
+    extern std::string pc_ranges; /**< If not empty, only generate the FDEs
+                                    covering the ranges of this file */
     extern bool enable_deref_arg;
+    extern bool enable_batch; /**< Also generate `_eh_elf_batch`, unwinding
+                                arrays of contexts in one call */
+    extern bool enable_rule_table; /**< Also generate `_eh_elf_rule`, giving
+                                     the decoded row of a PC */
     extern bool keep_holes; /**< Keep holes between FDEs. Larger eh_elf files,
                               but more accurate unwinding. */
+    extern std::string stats_json; /**< If not empty, dump statistics about
+                                     each pass as JSON to this path */
+    extern unsigned reader_threads; /**< Number of threads decoding the FDEs
+                                      in parallel */
+    extern unsigned shards; /**< Number of parts the generated code is split
+                              into, each compilable on its own */
 }
@@ -7,35 +7,174 @@
 #include <cassert>
 #include <cctype>
 #include <cstdio>
+#include <cstddef>
 #include <string>
-#include <map>
+#include <vector>
+#include <algorithm>
+#include <atomic>
+#include <memory>
+#include <mutex>
 
 #define UNUSED(x) (void)(x)
 
 typedef void* dl_handle_t;
+typedef _fde_func_t (*_fde_lookup_t)(uintptr_t);
+
+/** The eh_elf of an object, loaded on first use. It is shared by all the
+ * memory maps in which its object stays mapped at the same place, and unloaded
+ * along with the last of them. */
+struct EhElf {
+    /// Whether the eh_elf was loaded
+    enum EhElfState {
+        EH_NOT_LOADED, ///< Not tried yet: will be loaded on first use
+        EH_LOADED,
+        EH_UNAVAILABLE ///< Could not be loaded: frames here can't be unwound
+    };
+
+    EhElf():
+        eh_state(EH_NOT_LOADED), eh_dl_handle(nullptr),
+        eh_elf_func(nullptr), fde_lookup(nullptr), rule_lookup(nullptr)
+    {}
+    ~EhElf() {
+        if(eh_dl_handle != nullptr)
+            dlclose(eh_dl_handle);
+    }
+    EhElf(const EhElf&) = delete;
+    EhElf& operator=(const EhElf&) = delete;
+
+    /// Only the first thread to use this eh_elf loads it
+    std::once_flag load_once;
+    EhElfState eh_state;
+    dl_handle_t eh_dl_handle;
+
+    // Entry points of the eh_elf, resolved once when it is loaded
+    _fde_func_t eh_elf_func; ///< `_eh_elf`, for global switch eh_elfs
+    _fde_lookup_t fde_lookup; ///< `_fde_lookup`, for switch-per-func eh_elfs
+    /// `_eh_elf_rule`, if the eh_elf was generated with `--enable-rule-table`
+    _eh_elf_rule_func_t rule_lookup;
+};
 
 /** Describes a line in the memory map (which SO is loaded where) */
 struct MemoryMapEntry {
     MemoryMapEntry():
-        beg(0), end(0), offset(0), obj_path(), eh_dl_handle(nullptr)
+        beg(0), end(0), load_base(0), offset(0), obj_path(),
+        eh_elf(std::make_shared<EhElf>())
     {}
 
     uintptr_t beg, end;
+    /// Runtime address of the object's address 0, as seen by its eh_elf
+    uintptr_t load_base;
     int offset;
     std::string obj_path;
 
-    dl_handle_t eh_dl_handle;
+    std::shared_ptr<EhElf> eh_elf;
+};
+
+/** `MemoryMapEntry`es sorted by their `beg` */
+typedef std::vector<MemoryMapEntry> MemoryMap;
+
+/** A memory map, as published to the unwinding threads */
+typedef std::shared_ptr<const MemoryMap> MemoryMapSnapshot;
+
+/** The current memory map. It is never modified, only replaced as a whole
+ * under `memory_map_mutex`, and always accessed through `std::atomic_load` and
+ * `std::atomic_store`: each unwinding thread works on its own snapshot, which
+ * stays valid — eh_elfs included — for as long as the thread holds it. */
+static MemoryMapSnapshot memory_map;
+static std::mutex memory_map_mutex;
+
+/** Incremented each time `memory_map` is replaced, so that the threads notice
+ * it without touching the shared pointer itself */
+static std::atomic<uint64_t> memory_map_version(0);
+
+/** Number of objects loaded and unloaded in the process, as reported by
+ * `dl_iterate_phdr` */
+struct DlCounters {
+    DlCounters(): adds(0), subs(0) {}
+
+    unsigned long long adds, subs;
+};
+
+/** The `DlCounters` when `memory_map` was last filled. Guarded by
+ * `memory_map_mutex`. */
+static DlCounters memory_map_counters;
+
+/** Number of entries of the rule cache, a power of two */
+static const size_t RULE_CACHE_BITS = 12;
+static const size_t RULE_CACHE_SIZE = 1 << RULE_CACHE_BITS;
+static const size_t RULE_WORDS =
+    (sizeof(unwind_rule_t) + sizeof(uint64_t) - 1) / sizeof(uint64_t);
+
+/** An entry of the rule cache: the decoded row of the eh_elf covering `pc`.
+ *
+ * Entries are written under a per-entry sequence lock: `seq` is odd while the
+ * entry is being written. Readers never wait: a torn read is a miss. The entry
+ * is only valid if `generation` is the current `rule_cache_generation`. */
+struct RuleCacheEntry {
+    std::atomic<uint64_t> seq;
+    std::atomic<uint64_t> generation;
+    std::atomic<uintptr_t> pc;
+    std::atomic<uint64_t> rule[RULE_WORDS];
+};
+
+static RuleCacheEntry rule_cache[RULE_CACHE_SIZE];
+
+/** Bumped to drop every entry of the rule cache at once. Starts at 1, so that
+ * the zero-initialized entries are invalid. */
+static std::atomic<uint64_t> rule_cache_generation(1);
+static std::atomic<bool> rule_cache_enabled(false);
+
+static std::atomic<uint64_t> rule_cache_invalidations(0);
+
+/** Per-thread state of the walker. Only its own thread uses it, except for the
+ * counters, read by `stack_walker_cache_stats`. */
+struct ThreadState {
+    ThreadState();
+    ~ThreadState();
+
+    MemoryMapSnapshot memory_map; ///< This thread's snapshot of `memory_map`
+    uint64_t memory_map_version; ///< The `memory_map_version` of the snapshot
+
+    /** Position in `memory_map` of the last entry found by `get_mmap_entry`.
+     * Consecutive frames are often in the same object. */
+    size_t last_hit_entry;
+
+    // Only written by this thread, so they need no atomic increment
+    std::atomic<uint64_t> rule_cache_hits, rule_cache_misses;
 };
 
-/** `MemoryMapEntry`es mapped by their `beg` */
-typedef std::map<
-    uintptr_t,
-    MemoryMapEntry,
-    std::greater<uintptr_t> > MemoryMap;
-// here, std::greater is used because it allows easy access to the
-// corresponding segment by using lower_bound
+/** The `ThreadState`s of the live threads, and the counters of the threads
+ * gone, guarded by `thread_states_mutex` */
+static std::vector<ThreadState*> thread_states;
+static StackWalkerCacheStats retired_cache_stats = {0, 0, 0};
+/** Subtracted from the counters since the last reset */
+static StackWalkerCacheStats cache_stats_baseline = {0, 0, 0};
+static std::mutex thread_states_mutex;
+
+static thread_local ThreadState thread_state;
+
+ThreadState::ThreadState():
+    memory_map(), memory_map_version(0), last_hit_entry(0),
+    rule_cache_hits(0), rule_cache_misses(0)
+{
+    std::lock_guard<std::mutex> lock(thread_states_mutex);
+    thread_states.push_back(this);
+}
+
+ThreadState::~ThreadState() {
+    std::lock_guard<std::mutex> lock(thread_states_mutex);
+    retired_cache_stats.hits += rule_cache_hits.load();
+    retired_cache_stats.misses += rule_cache_misses.load();
+    thread_states.erase(
+            std::find(thread_states.begin(), thread_states.end(), this));
+}
 
-static MemoryMap memory_map;
+/** Increment `counter`, which only the calling thread writes */
+static inline void count(std::atomic<uint64_t>& counter) {
+    counter.store(
+            counter.load(std::memory_order_relaxed) + 1,
+            std::memory_order_relaxed);
+}
 
 
 /** Equivalent to a shell command `readlink -f` */
@@ -56,12 +195,15 @@ std::string readlink_rec(const char* path) {
     return std::string(buf[1 - parity]);
 }
 
-/** Called by `dl_iterate_phdr` later, initializes `memory_map` */
+/** Called by `dl_iterate_phdr` later, fills the `MemoryMap` pointed to by
+ * `data` */
 int fill_memory_map_callback(
         struct dl_phdr_info* info,
         size_t /*size*/,
-        void* /*data*/)
+        void* data)
 {
+    MemoryMap& out_map = *((MemoryMap*) data);
+
     for(int sec = 0; sec < info->dlpi_phnum; ++sec) {
         const ElfW(Phdr)& cur_hdr = info->dlpi_phdr[sec];
         if(cur_hdr.p_type != PT_LOAD || (cur_hdr.p_flags & PF_X) == 0)
@@ -74,6 +216,7 @@ int fill_memory_map_callback(
 
         MemoryMapEntry entry;
         entry.beg = info->dlpi_addr + cur_hdr.p_vaddr;
+        entry.load_base = info->dlpi_addr;
         entry.obj_path = std::string(info->dlpi_name);
         entry.offset = cur_hdr.p_offset;
 
@@ -83,63 +226,324 @@ int fill_memory_map_callback(
             entry.obj_path = readlink_rec("/proc/self/exe");
         }
 
-        memory_map.insert(std::make_pair(entry.beg, entry));
+        out_map.push_back(entry);
     }
     return 0;
 }
 
-void stack_walker_close() {
-    for(auto& mmap_entry_pair: memory_map) {
-        auto& mmap_entry = mmap_entry_pair.second;
+/** Called by `dl_iterate_phdr`, reads the `DlCounters` pointed to by `data` */
+static int read_dl_counters_callback(
+        struct dl_phdr_info* info,
+        size_t size,
+        void* data)
+{
+    DlCounters& counters = *((DlCounters*) data);
+    if(size >= offsetof(struct dl_phdr_info, dlpi_subs)
+            + sizeof(info->dlpi_subs))
+    {
+        counters.adds = info->dlpi_adds;
+        counters.subs = info->dlpi_subs;
+    }
+    return 1; // Every object carries the counters, the first one is enough
+}
+
+/** Fill `out_map` with the executable segments currently loaded, sorted, and
+ * `counters` with the matching `DlCounters` */
+static bool read_memory_map(MemoryMap& out_map, DlCounters& counters) {
+    // Read the counters first: an object loaded meanwhile only causes an
+    // extra refresh later on
+    dl_iterate_phdr(&read_dl_counters_callback, &counters);
+    if(dl_iterate_phdr(&fill_memory_map_callback, &out_map) != 0)
+        return false;
+
+    std::sort(out_map.begin(), out_map.end(),
+            [](const MemoryMapEntry& a, const MemoryMapEntry& b) {
+                return a.beg < b.beg;
+            });
+    return true;
+}
+
+/** Resolve once and for all the entry points of the loaded `eh_elf`. Returns
+ * false if the expected entry point is missing. */
+static bool resolve_entry_points(EhElf& eh_elf) {
+#ifdef SGP_SWITCH_PER_FUNC
+    eh_elf.fde_lookup = (_fde_lookup_t) (
+            dlsym(eh_elf.eh_dl_handle, "_fde_lookup"));
+    return eh_elf.fde_lookup != nullptr;
+#elif SGP_GLOBAL_SWITCH
+    eh_elf.eh_elf_func = (_fde_func_t) (
+            dlsym(eh_elf.eh_dl_handle, "_eh_elf"));
+    return eh_elf.eh_elf_func != nullptr;
+#else
+    UNUSED(eh_elf);
+    assert(false); // Please compile with either -DSCP_SWITCH_PER_FUNC or
+                   // -DSCP_GLOBAL_SWITCH
+#endif
+}
 
-        if(mmap_entry.eh_dl_handle != nullptr)
-            dlclose(mmap_entry.eh_dl_handle);
+/** Call `dlopen` on the `eh_elf.so` matching `mmap_entry` */
+static void do_load_eh_elf(const MemoryMapEntry& mmap_entry) {
+    EhElf& eh_elf = *mmap_entry.eh_elf;
+
+    // Find SO's basename
+    size_t last_slash = mmap_entry.obj_path.rfind("/");
+    if(last_slash == std::string::npos)
+        last_slash = 0;
+    else
+        last_slash++;
+    std::string basename(mmap_entry.obj_path, last_slash);
+
+    // Load the SO
+    std::string eh_elf_name = basename + ".eh_elf.so";
+    eh_elf.eh_state = EhElf::EH_UNAVAILABLE;
+    eh_elf.eh_dl_handle = dlopen(eh_elf_name.c_str(), RTLD_LAZY);
+
+    if(eh_elf.eh_dl_handle == nullptr) {
+        fprintf(stderr,
+                "Warning: cannot load shared object %s, frames in %s will "
+                "not be unwound.\ndlerror: %s\n",
+                eh_elf_name.c_str(),
+                mmap_entry.obj_path.c_str(),
+                dlerror());
+        return;
     }
+
+    if(!resolve_entry_points(eh_elf)) {
+        fprintf(stderr,
+                "Warning: missing entry point in shared object %s, frames "
+                "in %s will not be unwound.\n",
+                eh_elf_name.c_str(),
+                mmap_entry.obj_path.c_str());
+        dlclose(eh_elf.eh_dl_handle);
+        eh_elf.eh_dl_handle = nullptr;
+        return;
+    }
+
+    // Optional: without it, the frames of this object are never cached
+    eh_elf.rule_lookup = (_eh_elf_rule_func_t) (
+            dlsym(eh_elf.eh_dl_handle, "_eh_elf_rule"));
+
+    eh_elf.eh_state = EhElf::EH_LOADED;
 }
 
-bool stack_walker_init() {
-    if(dl_iterate_phdr(&fill_memory_map_callback, nullptr) != 0) {
-        stack_walker_close();
+/** Load the eh_elf of `mmap_entry`, unless it was already tried. Returns true
+ * iff the eh_elf is loaded. */
+static bool load_eh_elf(const MemoryMapEntry& mmap_entry) {
+    EhElf& eh_elf = *mmap_entry.eh_elf;
+    std::call_once(eh_elf.load_once, &do_load_eh_elf, std::cref(mmap_entry));
+    return eh_elf.eh_state == EhElf::EH_LOADED;
+}
+
+/** The rule cache entry of `pc` */
+static RuleCacheEntry& rule_cache_entry(uintptr_t pc) {
+    // Fibonacci hashing: the low bits of the PCs are far from uniform
+    return rule_cache[
+        (uint64_t(pc) * 0x9e3779b97f4a7c15ULL) >> (64 - RULE_CACHE_BITS)];
+}
+
+/** Fill `rule` with the cached rule of `pc`. Returns false on a miss. */
+static bool rule_cache_lookup(uintptr_t pc, unwind_rule_t& rule) {
+    RuleCacheEntry& entry = rule_cache_entry(pc);
+    uint64_t seq = entry.seq.load(std::memory_order_acquire);
+    if(seq & 1)
         return false;
+
+    uint64_t words[RULE_WORDS];
+    bool match = entry.pc.load(std::memory_order_relaxed) == pc
+        && entry.generation.load(std::memory_order_relaxed)
+            == rule_cache_generation.load(std::memory_order_relaxed);
+    for(size_t word = 0; word < RULE_WORDS; ++word)
+        words[word] = entry.rule[word].load(std::memory_order_relaxed);
+
+    std::atomic_thread_fence(std::memory_order_acquire);
+    if(!match || entry.seq.load(std::memory_order_relaxed) != seq)
+        return false;
+    memcpy(&rule, words, sizeof(rule));
+    return true;
+}
+
+/** Cache `rule` as the rule of `pc`, read from the memory map as of the
+ * cache generation `generation` */
+static void rule_cache_insert(
+        uintptr_t pc,
+        const unwind_rule_t& rule,
+        uint64_t generation)
+{
+    RuleCacheEntry& entry = rule_cache_entry(pc);
+    uint64_t seq = entry.seq.load(std::memory_order_relaxed);
+    // If another thread is writing this entry, let it have it
+    if((seq & 1) || !entry.seq.compare_exchange_strong(
+                seq, seq + 1, std::memory_order_relaxed))
+    {
+        return;
+    }
+    std::atomic_thread_fence(std::memory_order_release);
+
+    uint64_t words[RULE_WORDS] = {0};
+    memcpy(words, &rule, sizeof(rule));
+    entry.pc.store(pc, std::memory_order_relaxed);
+    entry.generation.store(generation, std::memory_order_relaxed);
+    for(size_t word = 0; word < RULE_WORDS; ++word)
+        entry.rule[word].store(words[word], std::memory_order_relaxed);
+
+    entry.seq.store(seq + 2, std::memory_order_release);
+}
+
+/** Drop every entry of the rule cache */
+static void invalidate_rule_cache() {
+    rule_cache_generation.fetch_add(1, std::memory_order_relaxed);
+    rule_cache_invalidations.fetch_add(1, std::memory_order_relaxed);
+}
+
+/** The value of the register `reg`, an `unwind_flags_t` bit, in `ctx` */
+static uintptr_t rule_register(const unwind_context_t& ctx, uint8_t reg) {
+    switch(reg) {
+        case UNWF_RSP:
+            return ctx.rsp;
+        case UNWF_RBP:
+            return ctx.rbp;
+        case UNWF_RBX:
+            return ctx.rbx;
     }
+    assert(0);
+    return 0;
+}
 
-    for(const auto& mmap_entry: memory_map) {
-        printf("%012lx-%012lx %08x    %s\n",
-                mmap_entry.second.beg,
-                mmap_entry.second.end,
-                mmap_entry.second.offset,
-                mmap_entry.second.obj_path.c_str());
+/** The value of a register recovered by `reg_rule`, unwinding `ctx` whose CFA
+ * is `cfa` */
+static uintptr_t apply_reg_rule(
+        const unwind_reg_rule_t& reg_rule,
+        const unwind_context_t& ctx,
+        uintptr_t cfa)
+{
+    switch(reg_rule.kind) {
+        case UNWR_REGISTER:
+            return rule_register(ctx, reg_rule.reg) + reg_rule.offset;
+        case UNWR_CFA_OFFSET:
+            return *((uintptr_t*)(cfa + reg_rule.offset));
+        case UNWR_PLT_EXPR:
+            return (((ctx.rip & 15) >= 11) ? 8 : 0) + ctx.rsp;
     }
+    assert(0);
+    return 0;
+}
 
-    // Call `dlopen` on the `eh_elf.so` maching every entry in `memory_map`
-    for(auto& mmap_entry_pair: memory_map) {
-        auto& mmap_entry = mmap_entry_pair.second;
+/** Unwind `ctx` once, in place, following `rule`, as the eh_elf would.
+ * Returns false if `rule` does not allow to go further up the call stack. */
+static bool apply_rule(unwind_context_t& ctx, const unwind_rule_t& rule) {
+    if(rule.error || rule.ra.kind == UNWR_UNDEFINED)
+        return false;
 
-        // Find SO's basename
-        size_t last_slash = mmap_entry.obj_path.rfind("/");
-        if(last_slash == std::string::npos)
-            last_slash = 0;
-        else
-            last_slash++;
-        std::string basename(mmap_entry.obj_path, last_slash);
-
-        // Load the SO
-        std::string eh_elf_name = basename + ".eh_elf.so";
-        mmap_entry.eh_dl_handle = dlopen(eh_elf_name.c_str(), RTLD_LAZY);
-
-        if(mmap_entry.eh_dl_handle == nullptr) {
-            fprintf(stderr,
-                    "Error: cannot load shared object %s.\ndlerror: %s\n",
-                    eh_elf_name.c_str(),
-                    dlerror());
-            stack_walker_close();
-            return false;
+    unwind_context_t out_ctx = ctx;
+    out_ctx.flags = 1 << UNWF_RSP | 1 << UNWF_RIP;
+    out_ctx.rsp = apply_reg_rule(rule.cfa, ctx, 0);
+    if(rule.rbp.kind != UNWR_UNDEFINED) {
+        out_ctx.flags |= 1 << UNWF_RBP;
+        out_ctx.rbp = apply_reg_rule(rule.rbp, ctx, out_ctx.rsp);
+    }
+    out_ctx.rip = apply_reg_rule(rule.ra, ctx, out_ctx.rsp);
+    if(rule.rbx.kind != UNWR_UNDEFINED) {
+        out_ctx.flags |= 1 << UNWF_RBX;
+        out_ctx.rbx = apply_reg_rule(rule.rbx, ctx, out_ctx.rsp);
+    }
+
+    ctx = out_ctx;
+    return true;
+}
+
+/** Publish `new_map` as the current memory map. Must be called with
+ * `memory_map_mutex` held. */
+static void publish_memory_map(MemoryMapSnapshot new_map) {
+    std::atomic_store(&memory_map, std::move(new_map));
+    memory_map_version.fetch_add(1, std::memory_order_release);
+    invalidate_rule_cache();
+}
+
+/** The calling thread's snapshot of the memory map, first replaced by the
+ * current one if it was since published. Null before `stack_walker_init`. */
+static const MemoryMap* thread_memory_map() {
+    uint64_t version = memory_map_version.load(std::memory_order_acquire);
+    if(thread_state.memory_map_version != version) {
+        thread_state.memory_map = std::atomic_load(&memory_map);
+        thread_state.memory_map_version = version;
+        thread_state.last_hit_entry = 0;
+    }
+    return thread_state.memory_map.get();
+}
+
+/** Re-read the memory map if objects were loaded or unloaded since it was last
+ * read, keeping the eh_elfs already loaded for the mappings still present.
+ * Returns true iff a memory map newer than the calling thread's snapshot is
+ * now published. */
+static bool refresh_memory_map() {
+    DlCounters counters;
+    dl_iterate_phdr(&read_dl_counters_callback, &counters);
+
+    std::lock_guard<std::mutex> lock(memory_map_mutex);
+    if(counters.adds != memory_map_counters.adds
+            || counters.subs != memory_map_counters.subs)
+    {
+        // Another thread may have refreshed the map meanwhile: re-read the
+        // counters along with the map
+        MemoryMapSnapshot old_map = std::atomic_load(&memory_map);
+        std::shared_ptr<MemoryMap> new_map = std::make_shared<MemoryMap>();
+        DlCounters new_counters;
+        if(old_map != nullptr && read_memory_map(*new_map, new_counters)) {
+            for(auto& new_entry: *new_map) {
+                auto old_entry = std::lower_bound(
+                        old_map->begin(), old_map->end(), new_entry.beg,
+                        [](const MemoryMapEntry& entry, uintptr_t beg) {
+                            return entry.beg < beg;
+                        });
+                if(old_entry == old_map->end()
+                        || old_entry->beg != new_entry.beg
+                        || old_entry->obj_path != new_entry.obj_path)
+                {
+                    continue;
+                }
+                new_entry.eh_elf = old_entry->eh_elf;
+            }
+
+            // The eh_elfs left behind are unloaded once no thread holds a
+            // snapshot using them anymore
+            memory_map_counters = new_counters;
+            publish_memory_map(std::move(new_map));
         }
     }
 
+    return memory_map_version.load(std::memory_order_acquire)
+        != thread_state.memory_map_version;
+}
+
+void stack_walker_close() {
+    {
+        std::lock_guard<std::mutex> lock(memory_map_mutex);
+        memory_map_counters = DlCounters();
+        publish_memory_map(nullptr);
+    }
+    stack_walker_release_thread();
+}
+
+bool stack_walker_init() {
+    // The eh_elfs themselves are loaded lazily, when a frame is first unwound
+    // through their object
+    std::shared_ptr<MemoryMap> new_map = std::make_shared<MemoryMap>();
+    std::lock_guard<std::mutex> lock(memory_map_mutex);
+    if(!read_memory_map(*new_map, memory_map_counters)) {
+        memory_map_counters = DlCounters();
+        return false;
+    }
+
+    publish_memory_map(std::move(new_map));
     return true;
 }
 
+void stack_walker_release_thread() {
+    thread_state.memory_map.reset();
+    thread_state.memory_map_version = 0;
+    thread_state.last_hit_entry = 0;
+}
+
 unwind_context_t get_context() {
     unwind_context_t out;
     ucontext_t uctx;
@@ -151,6 +555,8 @@ unwind_context_t get_context() {
     out.rip = uctx.uc_mcontext.gregs[REG_RIP];
     out.rsp = uctx.uc_mcontext.gregs[REG_RSP];
     out.rbp = uctx.uc_mcontext.gregs[REG_RBP];
+    out.rbx = uctx.uc_mcontext.gregs[REG_RBX];
+    out.flags = 0;
 
     if(!unwind_context(out)) {
         memset(&out, 0, sizeof(unwind_context_t));
@@ -159,52 +565,67 @@ unwind_context_t get_context() {
     return out;
 }
 
-MemoryMapEntry* get_mmap_entry(uintptr_t pc) {
-    // Get the memory_map entry
-    auto mmap_entry_it = memory_map.lower_bound(pc);
-    if(mmap_entry_it == memory_map.end()) {
+static const MemoryMapEntry* find_mmap_entry(uintptr_t pc) {
+    const MemoryMap* map = thread_memory_map();
+    if(map == nullptr || map->empty())
+        return nullptr;
+
+    // Fast path: same object as the last lookup
+    const MemoryMapEntry& last_hit = (*map)[thread_state.last_hit_entry];
+    if(last_hit.beg <= pc && pc <= last_hit.end)
+        return &last_hit;
+
+    // Get the memory_map entry: the last one starting at or before `pc`
+    auto mmap_entry_it = std::upper_bound(
+            map->begin(), map->end(), pc,
+            [](uintptr_t pc, const MemoryMapEntry& entry) {
+                return pc < entry.beg;
+            });
+    if(mmap_entry_it == map->begin()) {
         return nullptr;
     }
-    MemoryMapEntry& mmap_entry = mmap_entry_it->second;
+    --mmap_entry_it;
+    const MemoryMapEntry& mmap_entry = *mmap_entry_it;
     if(!(mmap_entry.beg <= pc && pc <= mmap_entry.end))
         return nullptr;
 
+    thread_state.last_hit_entry = mmap_entry_it - map->begin();
     return &mmap_entry;
 }
 
+/** The entry of the calling thread's memory map containing `pc`, or null. It
+ * stays valid until the thread next looks up an entry. */
+const MemoryMapEntry* get_mmap_entry(uintptr_t pc) {
+    const MemoryMapEntry* mmap_entry = find_mmap_entry(pc);
+
+    // `pc` might belong to an object loaded since the map was last read
+    if(mmap_entry == nullptr && refresh_memory_map())
+        mmap_entry = find_mmap_entry(pc);
+
+    return mmap_entry;
+}
+
 /** Get the `fde_func_t` function handling the given program counter — it may
  * be by calling a lookup function, or by directly looking into the ELF
  * symbols, depending on the state of the experiment. This is an abstraction
  * function. */
-_fde_func_t fde_handler_for_pc(uintptr_t pc, MemoryMapEntry& mmap_entry) {
+_fde_func_t fde_handler_for_pc(
+        uintptr_t pc,
+        const MemoryMapEntry& mmap_entry)
+{
 #ifdef SGP_SWITCH_PER_FUNC
     // Get the lookup function
-    _fde_func_t (*lookup)(uintptr_t) =
-        (_fde_func_t (*)(uintptr_t)) (
-                dlsym(mmap_entry.eh_dl_handle, "_fde_lookup"));
-
-    if(lookup == nullptr)
+    if(mmap_entry.eh_elf->fde_lookup == nullptr)
         return nullptr;
 
     // Get the translated pc
-    uintptr_t tr_pc = pc - mmap_entry.beg;
+    uintptr_t tr_pc = pc - mmap_entry.load_base;
 
     // Get the actual function
-    _fde_func_t rfunc = lookup(tr_pc);
-
-    if(rfunc == nullptr)
-        return nullptr;
-
-    return rfunc;
+    return mmap_entry.eh_elf->fde_lookup(tr_pc);
 #elif SGP_GLOBAL_SWITCH
     UNUSED(pc);
-    _fde_func_t global_switch =
-        (_fde_func_t) (dlsym(mmap_entry.eh_dl_handle, "_eh_elf"));
-
-    if(global_switch == nullptr)
-        return nullptr;
-
-    return global_switch;
+    return mmap_entry.eh_elf->eh_elf_func;
 #else
     UNUSED(pc);
     UNUSED(mmap_entry);
@@ -214,23 +635,62 @@ _fde_func_t fde_handler_for_pc(uintptr_t pc, MemoryMapEntry& mmap_entry) {
 }
 
 bool unwind_context(unwind_context_t& ctx) {
-    if(ctx.rbp == 0 || ctx.rip + 1 == 0)
+    // The outermost frame is found through its undefined return address: %rbp
+    // is not a frame pointer in optimized code, and may well be null
+    if(ctx.rip + 1 == 0)
         return false;
 
-    MemoryMapEntry* mmap_entry = get_mmap_entry(ctx.rip);
-    if(mmap_entry == nullptr)
+    bool use_cache = rule_cache_enabled.load(std::memory_order_relaxed);
+    uint64_t generation = 0;
+    if(use_cache) {
+        unwind_rule_t rule;
+        if(rule_cache_lookup(ctx.rip, rule)) {
+            count(thread_state.rule_cache_hits);
+            return apply_rule(ctx, rule);
+        }
+        count(thread_state.rule_cache_misses);
+        // Read before the memory map, so that an entry filled from a map
+        // replaced meanwhile is already stale
+        generation = rule_cache_generation.load(std::memory_order_relaxed);
+    }
+
+    const MemoryMapEntry* mmap_entry = get_mmap_entry(ctx.rip);
+    if(mmap_entry == nullptr || !load_eh_elf(*mmap_entry))
         return false;
 
+    _eh_elf_rule_func_t rule_lookup = mmap_entry->eh_elf->rule_lookup;
+    if(use_cache && rule_lookup != nullptr) {
+        unwind_rule_t rule;
+        if(rule_lookup(ctx.rip - mmap_entry->load_base, &rule)) {
+            rule_cache_insert(ctx.rip, rule, generation);
+            return apply_rule(ctx, rule);
+        }
+    }
+
     _fde_func_t fde_func = fde_handler_for_pc(ctx.rip, *mmap_entry);
     if(fde_func == nullptr)
         return false;
 
-    uintptr_t tr_pc = ctx.rip - mmap_entry->beg;
-    ctx = fde_func(ctx, tr_pc);
+    uintptr_t tr_pc = ctx.rip - mmap_entry->load_base;
+    unwind_context_t out_ctx = fde_func(ctx, tr_pc);
 
-    if(ctx.rip + 1 == 0 && ctx.rsp + 1 == 0 && ctx.rbp + 1 == 0) // no entry
+    if(out_ctx.rip + 1 == 0 && out_ctx.rsp + 1 == 0
+            && out_ctx.rbp + 1 == 0) // no entry
         return false;
 
+    uint8_t required = 1 << UNWF_RIP | 1 << UNWF_RSP;
+    if((out_ctx.flags & (1 << UNWF_ERROR))
+            || (out_ctx.flags & required) != required)
+        return false;
+
+    // The registers the eh_elf leaves unset keep their value
+    ctx.flags = out_ctx.flags;
+    ctx.rip = out_ctx.rip;
+    ctx.rsp = out_ctx.rsp;
+    if(out_ctx.flags & (1 << UNWF_RBP))
+        ctx.rbp = out_ctx.rbp;
+    if(out_ctx.flags & (1 << UNWF_RBX))
+        ctx.rbx = out_ctx.rbx;
     return true;
 }
 
@@ -241,6 +701,50 @@ void walk_stack(const std::function<void(const unwind_context_t&)>& mapped) {
     } while(unwind_context(ctx));
 }
 
+size_t walk_stack(unwind_context_t* frames, size_t max_frames) {
+    if(max_frames == 0)
+        return 0;
+
+    size_t frame_count = 0;
+    unwind_context_t ctx = get_context();
+    do {
+        frames[frame_count++] = ctx;
+    } while(frame_count < max_frames && unwind_context(ctx));
+    return frame_count;
+}
+
+void stack_walker_set_rule_cache(bool enabled) {
+    rule_cache_enabled.store(enabled, std::memory_order_relaxed);
+}
+
+/** The counters of the rule cache, summed over all threads since the start.
+ * Must be called with `thread_states_mutex` held. */
+static StackWalkerCacheStats total_cache_stats() {
+    StackWalkerCacheStats stats = retired_cache_stats;
+    for(const ThreadState* state: thread_states) {
+        stats.hits += state->rule_cache_hits.load(std::memory_order_relaxed);
+        stats.misses +=
+            state->rule_cache_misses.load(std::memory_order_relaxed);
+    }
+    stats.invalidations =
+        rule_cache_invalidations.load(std::memory_order_relaxed);
+    return stats;
+}
+
+StackWalkerCacheStats stack_walker_cache_stats() {
+    std::lock_guard<std::mutex> lock(thread_states_mutex);
+    StackWalkerCacheStats stats = total_cache_stats();
+    stats.hits -= cache_stats_baseline.hits;
+    stats.misses -= cache_stats_baseline.misses;
+    stats.invalidations -= cache_stats_baseline.invalidations;
+    return stats;
+}
+
+void stack_walker_reset_cache_stats() {
+    std::lock_guard<std::mutex> lock(thread_states_mutex);
+    cache_stats_baseline = total_cache_stats();
+}
+
 uintptr_t get_register(const unwind_context_t& ctx, StackWalkerRegisters reg) {
     switch(reg) {
         case SW_REG_RIP:
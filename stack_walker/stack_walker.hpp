@@ -4,6 +4,7 @@
 
 #pragma once
 
+#include <cstddef>
 #include <cstdint>
 #include <functional>
 
@@ -17,19 +18,37 @@ enum StackWalkerRegisters {
 };
 
 /** Initialize the stack walker. This must be called only once.
+ *
+ * The eh_elfs are loaded lazily, the first time a frame is unwound through
+ * their object; a missing eh_elf only makes the frames in its object
+ * impossible to unwind. Objects loaded after this call are picked up when
+ * first met.
+ *
+ * Once initialized, the stack walker can be used by any number of threads at
+ * once. Each thread works on its own snapshot of the memory map, replaced
+ * when objects are loaded or unloaded; the map is only locked to be re-read.
  *
  * \return true iff everything was correctly initialized.
  */
 bool stack_walker_init();
 
-/** Deallocate everything that was allocated by the stack walker */
+/** Deallocate everything that was allocated by the stack walker. The eh_elfs
+ * still in use by other threads are unloaded once these threads are done with
+ * them — see `stack_walker_release_thread`. */
 void stack_walker_close();
 
+/** Release the per-thread state of the calling thread, in particular its
+ * snapshot of the memory map. This is done anyway when the thread exits; the
+ * state is created again if the thread unwinds later on. */
+void stack_walker_release_thread();
+
 /** Get the unwind context of the point from which this function was called.
  *
  * This context must then be exploited straight away: it is unsafe to alter the
  * call stack before using it, in particular by returning from the calling
- * function. */
+ * function. With the libunwind stack walker, the contexts returned by
+ * `get_context` and `walk_stack` also only stay valid until the next of these
+ * calls by the same thread. */
 unwind_context_t get_context();
 
 /** Unwind the passed context once, in place.
@@ -42,6 +61,34 @@ bool unwind_context(unwind_context_t& ctx);
  * frame first, with the current context as its sole argument. */
 void walk_stack(const std::function<void(const unwind_context_t&)>& mapped);
 
+/** Fill `frames` with the contexts of the frames in the call stack, most
+ * recent frame first, stopping after `max_frames` frames. Returns the number
+ * of frames written. */
+size_t walk_stack(unwind_context_t* frames, size_t max_frames);
+
+/** Hit and miss counts of the rule cache, since the last reset */
+struct StackWalkerCacheStats {
+    uint64_t hits; ///< Frames unwound from a cached rule
+    uint64_t misses; ///< Frames unwound while the cache did not know their PC
+    uint64_t invalidations; ///< Times the whole cache was dropped
+};
+
+/** Enable or disable the rule cache, disabled by default.
+ *
+ * When enabled, the decoded row of each PC unwound through — how to recover
+ * the CFA and the registers — is kept in a fixed-size, lock-free cache, and
+ * later frames at the same PC are unwound from it without going through the
+ * eh_elf. Only the eh_elfs generated with `--enable-rule-table` provide these
+ * rows; the other ones are always used directly. The cache is dropped by
+ * `stack_walker_close` and whenever objects are loaded or unloaded. */
+void stack_walker_set_rule_cache(bool enabled);
+
+/** Get the counters of the rule cache */
+StackWalkerCacheStats stack_walker_cache_stats();
+
+/** Reset the counters of the rule cache */
+void stack_walker_reset_cache_stats();
+
 /** Get a register's value on an unwind_context_t. This is useful for other
  * implementations of stack_walker that use different unwind_context_t */
 uintptr_t get_register(const unwind_context_t& ctx, StackWalkerRegisters reg);
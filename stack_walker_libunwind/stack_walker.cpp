@@ -1,26 +1,44 @@
 #include "../stack_walker/stack_walker.hpp"
 
 #include <libunwind.h>
-#include <vector>
+#include <deque>
 #include <cassert>
 
-struct UnwPtrs {
-    unw_context_t* ctx;
-    unw_cursor_t* cursor;
+/** The libunwind state of a thread, recycled from one walk to the next: the
+ * contexts handed out by a walk are only valid until the next walk of the
+ * same thread. */
+struct ThreadCursors {
+    ThreadCursors(): used(0) {}
+
+    unw_context_t unw_context;
+    std::deque<unw_cursor_t> cursors; ///< A deque: the cursors never move
+    size_t used; ///< Number of `cursors` in use by the current walk
 };
 
-static std::vector<UnwPtrs> to_delete;
+static thread_local ThreadCursors thread_cursors;
 
 
 bool stack_walker_init() {
+    // Threads unwind independently, don't make them share a locked cache
+    unw_set_caching_policy(unw_local_addr_space, UNW_CACHE_PER_THREAD);
     return true;
 }
 
 void stack_walker_close() {
-    for(auto& del: to_delete) {
-        delete del.ctx;
-        delete del.cursor;
-    }
+    stack_walker_release_thread();
+}
+
+void stack_walker_release_thread() {
+    thread_cursors.cursors.clear();
+    thread_cursors.cursors.shrink_to_fit();
+    thread_cursors.used = 0;
+}
+
+/** A cursor of the calling thread that is not used by its current walk */
+static unw_cursor_t* new_cursor() {
+    if(thread_cursors.used == thread_cursors.cursors.size())
+        thread_cursors.cursors.emplace_back();
+    return &thread_cursors.cursors[thread_cursors.used++];
 }
 
 static unw_cursor_t* get_cursor(const unwind_context_t& context) {
@@ -37,13 +55,14 @@ static void set_cursor(unwind_context_t& context, unw_cursor_t* unw_cursor) {
 
 unwind_context_t get_context() {
     int rc;
-    unw_context_t* unw_context = new unw_context_t;
-    rc = unw_getcontext(unw_context);
+    // A new walk: the cursors of the previous one are recycled
+    thread_cursors.used = 0;
+    rc = unw_getcontext(&thread_cursors.unw_context);
     if(rc < 0)
         assert(0);
 
-    unw_cursor_t* cursor = new unw_cursor_t;
-    rc = unw_init_local(cursor, unw_context);
+    unw_cursor_t* cursor = new_cursor();
+    rc = unw_init_local(cursor, &thread_cursors.unw_context);
     if(rc < 0)
         assert(0);
 
@@ -55,8 +74,6 @@ unwind_context_t get_context() {
 
     set_cursor(out, cursor);
 
-    to_delete.push_back(UnwPtrs({unw_context, cursor}));
-
     return out;
 }
 
@@ -72,6 +89,33 @@ void walk_stack(const std::function<void(const unwind_context_t&)>& mapped) {
     } while(unwind_context(context));
 }
 
+size_t walk_stack(unwind_context_t* frames, size_t max_frames) {
+    if(max_frames == 0)
+        return 0;
+
+    size_t frame_count = 0;
+    unwind_context_t context = get_context();
+    unw_cursor_t* cursor = get_cursor(context);
+    do {
+        // Each frame needs its own cursor, `cursor` will keep moving
+        unw_cursor_t* frame_cursor = new_cursor();
+        *frame_cursor = *cursor;
+        set_cursor(frames[frame_count++], frame_cursor);
+    } while(frame_count < max_frames && unwind_context(context));
+    return frame_count;
+}
+
+void stack_walker_set_rule_cache(bool /* enabled */) {
+    // Rules are an eh_elf feature: libunwind keeps its own caches
+}
+
+StackWalkerCacheStats stack_walker_cache_stats() {
+    StackWalkerCacheStats stats = {0, 0, 0};
+    return stats;
+}
+
+void stack_walker_reset_cache_stats() {}
+
 uintptr_t get_register(const unwind_context_t& ctx, StackWalkerRegisters reg) {
     unw_cursor_t* cursor = get_cursor(ctx);
     unw_regnum_t regnum = 0;
@@ -4,6 +4,7 @@
 
 #pragma once
 
+#include <cstddef>
 #include <cstdint>
 #include <functional>
 
@@ -35,3 +36,8 @@ bool unwind_context(unwind_context_t& ctx);
 /** Call the passed function once per frame in the call stack, most recent
  * frame first, with the current context as its sole argument. */
 void walk_stack(const std::function<void(const unwind_context_t&)>& mapped);
+
+/** Fill `frames` with the contexts of the frames in the call stack, most
+ * recent frame first, stopping after `max_frames` frames. Returns the number
+ * of frames written. */
+size_t walk_stack(unwind_context_t* frames, size_t max_frames);
@@ -72,7 +72,7 @@ def process_fde(fde, data):
         process_reg(data.regs.cfa, row['cfa'])
         for entry in row:
             if isinstance(entry, int):
-                process_reg(data.regs.regs[entry], row[entry])
+                process_reg(data.regs.reg(entry), row[entry])
 
 
 def process_reg(out_reg, reg_def):
@@ -2,6 +2,7 @@ from elftools.dwarf import callframe
 import gather_stats
 import itertools
 import functools
+import collections
 
 REGS_IDS = {
     'RAX': 0,
@@ -71,8 +72,8 @@ def filter_none(lst):
 
 
 def deco_filter_none(fct):
-    def wrap(lst):
-        return fct(filter_none(lst))
+    def wrap(lst, *args, **kwargs):
+        return fct(filter_none(lst), *args, **kwargs)
     return wrap
 
 
@@ -135,6 +136,8 @@ def find_non_cfa(path, fde, decoded):
         callframe.RegisterRule.ARCHITECTURAL: 0,
     }
     problematic_paths = set()
+    # (expr, path, FDE offset) -> count
+    unhandled_exprs = collections.Counter()
 
     for row in decoded.table:
         for entry in row:
@@ -147,6 +150,8 @@ def find_non_cfa(path, fde, decoded):
                     if not is_handled_expr(reg_def.expr):
                         non_handled_exp += 1
                         problematic_paths.add(path)
+                        unhandled_exprs[(tuple(reg_def.expr), path,
+                                         fde.offset)] += 1
                 elif reg_def:
                     if reg_def.reg not in HANDLED_REGS:
                         non_handled_regs += 1
@@ -173,14 +178,11 @@ def find_non_cfa(path, fde, decoded):
                 expr = reg_def.arg
                 if not is_handled_expr(reg_def.arg):
                     problematic_paths.add(path)
-                    with open('/tmp/exprs', 'a') as handle:
-                        handle.write('[{} - {}] {}\n'.format(
-                            path, fde.offset,
-                            ', '.join(map(lambda x: hex(x), expr))))
+                    unhandled_exprs[(tuple(expr), path, fde.offset)] += 1
                     non_handled_exp += 1
 
     return (regs_seen, non_handled_regs, non_handled_exp, rule_type, cfa_dat,
-            problematic_paths)
+            problematic_paths, unhandled_exprs)
 
 
 def reduce_non_cfa(lst):
@@ -196,24 +198,40 @@ def reduce_non_cfa(lst):
         return out
 
     def merge_elts(accu, elt):
-        accu_regs, accu_nh, accu_exp, accu_rt, accu_cfa, accu_paths = accu
-        elt_regs, elt_nh, elt_exp, elt_rt, elt_cfa, elf_paths = elt
+        (accu_regs, accu_nh, accu_exp, accu_rt, accu_cfa, accu_paths,
+         accu_exprs) = accu
+        elt_regs, elt_nh, elt_exp, elt_rt, elt_cfa, elf_paths, elt_exprs = elt
+        # The sets and counters are updated in place: copying them at each
+        # step would make the reduction quadratic
+        accu_paths.update(elf_paths)
+        accu_exprs.update(elt_exprs)
         return (
             accu_regs + elt_regs,
             accu_nh + elt_nh,
             accu_exp + elt_exp,
             merge_dict(accu_rt, elt_rt),
             merge_list(accu_cfa, elt_cfa),
-            accu_paths.union(elf_paths),
+            accu_paths,
+            accu_exprs,
         )
 
-    return functools.reduce(merge_elts, lst)
+    # Only the accumulator is updated: start from a copy of the first result
+    lst = iter(lst)
+    (first_regs, first_nh, first_exp, first_rt, first_cfa, first_paths,
+     first_exprs) = next(lst)
+    first = (first_regs, first_nh, first_exp, dict(first_rt), first_cfa,
+             set(first_paths), collections.Counter(first_exprs))
+    return functools.reduce(merge_elts, lst, first)
 
 
 @deco_filter_none
-def flatten_non_cfa(result):
+def flatten_non_cfa(result, catalog_path=None):
+    ''' Merges the results of `find_non_cfa`. If `catalog_path` is set, the
+    ranked catalog of the unhandled expressions is written there. '''
     flat = itertools.chain.from_iterable(result)
     out = reduce_non_cfa(flat)
+    if catalog_path is not None:
+        dump_expr_catalog(out[6], catalog_path)
     out_cfa = {
         'seen': out[4][0],
         'expr': out[4][1],
@@ -224,5 +242,36 @@ def flatten_non_cfa(result):
            (out[2], out[3]['EXPRESSION'] + out_cfa['expr']),
            out[3],
            out_cfa,
-           out[5])
+           out[5],
+           out[6])
     return out
+
+
+def expr_catalog(unhandled_exprs):
+    ''' Ranks the unhandled expressions gathered by `find_non_cfa`, most
+    frequent first. Returns a list of `(expr, count, locations)`, `locations`
+    being a `Counter` mapping each `(path, fde_offset)` at which `expr` was
+    found to its occurrence count there. '''
+
+    per_expr = collections.defaultdict(collections.Counter)
+    for (expr, path, fde_offset), count in unhandled_exprs.items():
+        per_expr[expr][(path, fde_offset)] += count
+
+    catalog = [(expr, sum(locations.values()), locations)
+               for expr, locations in per_expr.items()]
+    catalog.sort(key=lambda entry: entry[1], reverse=True)
+    return catalog
+
+
+def dump_expr_catalog(unhandled_exprs, path):
+    ''' Writes the ranked catalog of unhandled expressions, as returned in the
+    last element of `flatten_non_cfa`'s result, to `path` '''
+
+    with open(path, 'w') as handle:
+        for expr, count, locations in expr_catalog(unhandled_exprs):
+            files = set(expr_path for expr_path, _ in locations)
+            handle.write('{} [{} files] {}\n'.format(
+                count, len(files), ', '.join(map(hex, expr))))
+            for (expr_path, fde_offset), loc_count in locations.most_common():
+                handle.write('\t{} {} - {}\n'.format(
+                    loc_count, expr_path, fde_offset))
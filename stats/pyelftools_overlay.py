@@ -77,15 +77,20 @@ def system_elfs():
             continue
 
         for direntry in os.scandir(bindir):
-            if not direntry.is_file():
-                if direntry.is_dir():
-                    to_explore.append((direntry.path, elftype))
+            try:
+                if not direntry.is_file():
+                    # Symlinks to directories are not followed: some, eg.
+                    # /usr/bin/X11 -> ., would make us loop forever
+                    if direntry.is_dir(follow_symlinks=False):
+                        to_explore.append((direntry.path, elftype))
+                    continue
+            except OSError:  # eg. symlink loop
                 continue
 
             canonical_name = readlink_rec(direntry.path)
-            for blacked in ELF_BLACKLIST:
-                if canonical_name.startswith(blacked):
-                    continue
+            if any(canonical_name.startswith(blacked)
+                   for blacked in ELF_BLACKLIST):
+                continue
             if canonical_name in seen_elfs:
                 continue
 
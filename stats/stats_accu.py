@@ -4,42 +4,57 @@ import subprocess
 import re
 import json
 import collections
-
-from math import ceil
+import collections.abc
+import numpy as np
 
 
 class ProportionFinder:
     ''' Finds figures such as median, etc. on the original structure of a
-    dictionnary mapping a value to its occurrence count '''
+    dictionnary mapping a value to its occurrence count
+
+    The occurrence counts may be weights (floats), in which case the figures
+    found are weighted quantiles. '''
 
     def __init__(self, count_per_value):
-        self.cumulative = []
-        prev_count = 0
-        for key in sorted(count_per_value.keys()):
-            n_count = prev_count + count_per_value[key]
-            self.cumulative.append(
-                (key, n_count))
-            prev_count = n_count
+        keys = sorted(count_per_value.keys())
+        self.values = np.array(keys)
+        self.cumulative = np.cumsum(
+            np.array([count_per_value[key] for key in keys], dtype=float))
 
-        self.elem_count = prev_count
+        self.elem_count = self.cumulative[-1] if keys else 0
 
-    def find_at_proportion(self, proportion):
-        if not self.cumulative:  # Empty list
-            return None
+    @staticmethod
+    def merged(histograms, weights=None):
+        ''' Build a single ProportionFinder out of a list of histograms (as
+        passed to the constructor). If `weights` is given, the counts of the
+        i-th histogram are multiplied by `weights[i]`. '''
+
+        if weights is None:
+            weights = [1] * len(histograms)
+
+        merged_hist = collections.Counter()
+        for histogram, weight in zip(histograms, weights):
+            for key in histogram:
+                merged_hist[key] += histogram[key] * weight
+        return ProportionFinder(merged_hist)
 
-        low_bound = ceil(self.elem_count * proportion)
+    def find_at_proportion(self, proportion):
+        ''' Finds the smallest value such that at least `proportion` of the
+        elements are lower or equal to it.
 
-        def binsearch(beg, end):
-            med = ceil((beg + end) / 2)
+        `proportion` can also be a list or array of proportions, in which case
+        an array of values is returned. '''
 
-            if beg + 1 == end:
-                return self.cumulative[beg][0]
+        if not self.values.size:  # Empty list
+            return None
 
-            if self.cumulative[med - 1][1] < low_bound:
-                return binsearch(med, end)
-            return binsearch(beg, med)
+        low_bounds = self.elem_count * np.asarray(proportion, dtype=float)
+        positions = np.searchsorted(self.cumulative, low_bounds, side='left')
+        out = self.values[np.minimum(positions, self.values.size - 1)]
 
-        return binsearch(0, len(self.cumulative))
+        if np.ndim(proportion) == 0:
+            return out.item()
+        return out
 
 
 def elf_so_deps(path):
@@ -116,17 +131,112 @@ def intify_dict(d):
     return out
 
 
+REG_COUNT = 17  # Number of machine registers tracked
+COUNTS_DTYPE = np.uint32
+
+
+class InstrCounts(collections.abc.MutableMapping):
+    ''' Dictionary-like view over the instruction counters of a `RegData`,
+    keyed by `DwarfInstr`. Only the instructions seen at least once are
+    keys. '''
+
+    __slots__ = ('_counts',)
+
+    def __init__(self, counts):
+        self._counts = counts
+
+    def __getitem__(self, instr):
+        count = self._counts[instr.value - 1]
+        if not count:
+            raise KeyError(instr)
+        return int(count)
+
+    def __setitem__(self, instr, count):
+        self._counts[instr.value - 1] = count
+
+    def __delitem__(self, instr):
+        self[instr]  # Raises KeyError if unset
+        self._counts[instr.value - 1] = 0
+
+    def __iter__(self):
+        for instr in DwarfInstr:
+            if self._counts[instr.value - 1]:
+                yield instr
+
+    def __len__(self):
+        return int(np.count_nonzero(self._counts))
+
+
+class RegCounts(collections.abc.Sequence):
+    ''' List-like view over the register counters of a `RegData`, indexed by
+    register id. The counts are read as Python ints. '''
+
+    __slots__ = ('_counts',)
+
+    def __init__(self, counts):
+        self._counts = counts
+
+    def __getitem__(self, reg_id):
+        return self._counts[reg_id].tolist()
+
+    def __setitem__(self, reg_id, count):
+        self._counts[reg_id] = count
+
+    def __len__(self):
+        return len(self._counts)
+
+
 class RegData:
+    ''' Counters for a single register column. This is usually a view over
+    a row of the counts block of a `RegsList`; a standalone `RegData` owns its
+    own row. '''
+
+    __slots__ = ('_counts', '_owner', '_row', '_exprs')
+
+    ROW_SIZE = len(DwarfInstr) + REG_COUNT  # instrs, then regs
+
     def __init__(self, instrs=None, regs=None, exprs=None):
-        if instrs is None:
-            instrs = {}
-        if regs is None:
-            regs = [0]*17
-        if exprs is None:
-            exprs = {}
-        self.instrs = intify_dict(instrs)
-        self.regs = regs
-        self.exprs = intify_dict(exprs)
+        self._counts = np.zeros(RegData.ROW_SIZE, dtype=COUNTS_DTYPE)
+        self._owner = None
+        self._row = None
+        self._exprs = intify_dict(exprs) if exprs else None
+
+        if instrs:
+            self.instrs.update(instrs)
+        if regs is not None:
+            self.regs[:] = regs
+
+    @staticmethod
+    def view(owner, row):
+        ''' A `RegData` backed by the `row`-th row of `owner`, a `RegsList`
+        '''
+        out = RegData.__new__(RegData)
+        out._counts = owner.counts[row]
+        out._owner = owner
+        out._row = row
+        out._exprs = None
+        return out
+
+    @property
+    def instrs(self):
+        return InstrCounts(self._counts[:len(DwarfInstr)])
+
+    @property
+    def regs(self):
+        return RegCounts(self._counts[len(DwarfInstr):])
+
+    @property
+    def exprs(self):
+        if self._owner is not None:
+            return self._owner.exprs_of(self._row)
+        if self._exprs is None:
+            self._exprs = {}
+        return self._exprs
+
+    def has_exprs(self):
+        if self._owner is not None:
+            return self._owner.has_exprs(self._row)
+        return bool(self._exprs)
 
     @staticmethod
     def map_dict_keys(fnc, dic):
@@ -138,8 +248,8 @@ class RegData:
     def dump(self):
         return {
             'instrs': RegData.map_dict_keys(lambda x: x.value, self.instrs),
-            'regs': self.regs,
-            'exprs': self.exprs,
+            'regs': self.regs[:],
+            'exprs': self.exprs if self.has_exprs() else {},
         }
 
     @staticmethod
@@ -154,18 +264,55 @@ class RegData:
 
 
 class RegsList:
+    ''' The `RegData` of the CFA and of every machine register, stored as a
+    single counts block: one row per column (CFA first), one column per
+    instruction or register counter. '''
+
+    __slots__ = ('counts', '_exprs')
+
     def __init__(self, cfa=None, regs=None):
-        if cfa is None:
-            cfa = RegsList.fresh_reg()
-        if regs is None:
-            regs = [RegsList.fresh_reg() for _ in range(17)]
-        self.cfa = cfa
-        self.regs = regs
+        self.counts = np.zeros((REG_COUNT + 1, RegData.ROW_SIZE),
+                               dtype=COUNTS_DTYPE)
+        self._exprs = None  # row -> exprs dict, allocated on demand
+
+        if cfa is not None:
+            self.set_row(0, cfa)
+        if regs is not None:
+            for reg_id, reg in enumerate(regs):
+                self.set_row(reg_id + 1, reg)
 
     @staticmethod
     def fresh_reg():
         return RegData()
 
+    @property
+    def cfa(self):
+        return RegData.view(self, 0)
+
+    def reg(self, reg_id):
+        ''' The `RegData` of the machine register `reg_id` '''
+        return RegData.view(self, reg_id + 1)
+
+    @property
+    def regs(self):
+        return [self.reg(reg_id) for reg_id in range(REG_COUNT)]
+
+    def set_row(self, row, reg_data):
+        ''' Copy `reg_data` into the `row`-th row of this block '''
+        self.counts[row] = reg_data._counts
+        if reg_data.has_exprs():
+            self.exprs_of(row).update(reg_data.exprs)
+
+    def exprs_of(self, row):
+        if self._exprs is None:
+            self._exprs = {}
+        if row not in self._exprs:
+            self._exprs[row] = {}
+        return self._exprs[row]
+
+    def has_exprs(self, row):
+        return self._exprs is not None and bool(self._exprs.get(row))
+
     def dump(self):
         return {
             'cfa': RegData.dump(self.cfa),
@@ -174,13 +321,20 @@ class RegsList:
 
     @staticmethod
     def load(data):
-        return RegsList(
-            cfa=RegData.load(data['cfa']),
-            regs=[RegData.load(r) for r in data['regs']],
-        )
+        out = RegsList()
+        n_instrs = len(DwarfInstr)
+        for row, reg_data in enumerate([data['cfa']] + data['regs']):
+            for instr, count in reg_data['instrs'].items():
+                out.counts[row, int(instr) - 1] = count
+            out.counts[row, n_instrs:] = reg_data['regs']
+            if reg_data['exprs']:
+                out.exprs_of(row).update(intify_dict(reg_data['exprs']))
+        return out
 
 
 class FdeData:
+    __slots__ = ('fde_count', 'fde_with_lines', 'regs')
+
     def __init__(self, fde_count=0, fde_with_lines=None, regs=None):
         if fde_with_lines is None:
             fde_with_lines = {}
@@ -207,6 +361,8 @@ class FdeData:
 
 
 class SingleFdeData:
+    __slots__ = ('path', 'elf_type', 'data', 'deps')
+
     def __init__(self, path, elf_type, data):
         self.path = path
         self.elf_type = elf_type
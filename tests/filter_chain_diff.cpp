@@ -0,0 +1,249 @@
+/** Differential test of the in-place filter chain of dwarf-assembly: applies
+ * both the current filters and a copy of their original, copying
+ * implementation to many random SimpleDwarfs, and checks that the results
+ * are identical.
+ *
+ * Usage: filter_chain_diff.bin [rounds [max_fdes]]
+ */
+
+#include <algorithm>
+#include <cstdio>
+#include <cstdlib>
+#include <random>
+#include <sstream>
+
+#include "../src/SimpleDwarf.hpp"
+#include "../src/PcHoleFiller.hpp"
+#include "../src/AntiOverlapFilter.hpp"
+#include "../src/EmptyFdeDeleter.hpp"
+#include "../src/ConseqEquivFilter.hpp"
+#include "../src/OverriddenRowFilter.hpp"
+
+using namespace std;
+
+/** The filters, as they were implemented before they worked in place. They
+ * are kept verbatim, except for the guard against an empty FDE list, on
+ * which they used to crash. */
+namespace legacy {
+    static bool equiv_reg(
+            const SimpleDwarf::DwRegister& r1,
+            const SimpleDwarf::DwRegister& r2)
+    {
+        return r1.type == r2.type
+            && r1.offset == r2.offset
+            && r1.reg == r2.reg;
+    }
+
+    static bool equiv_row(
+            const SimpleDwarf::DwRow& r1,
+            const SimpleDwarf::DwRow& r2)
+    {
+        return r1.ip == r2.ip
+            && equiv_reg(r1.cfa, r2.cfa)
+            && equiv_reg(r1.rbp, r2.rbp)
+            && equiv_reg(r1.rbx, r2.rbx)
+            && equiv_reg(r1.ra, r2.ra);
+    }
+
+    SimpleDwarf conseq_equiv(const SimpleDwarf& dw) {
+        SimpleDwarf out;
+
+        for(const auto& fde: dw.fde_list) {
+            out.fde_list.push_back(SimpleDwarf::Fde());
+            SimpleDwarf::Fde& cur_fde = out.fde_list.back();
+            cur_fde.fde_offset = fde.fde_offset;
+            cur_fde.beg_ip = fde.beg_ip;
+            cur_fde.end_ip = fde.end_ip;
+
+            if(fde.rows.empty())
+                continue;
+
+            cur_fde.rows.push_back(fde.rows.front());
+            for(size_t pos=1; pos < fde.rows.size(); ++pos) {
+                const auto& row = fde.rows[pos];
+                if(!equiv_row(row, cur_fde.rows.back())) {
+                    cur_fde.rows.push_back(row);
+                }
+            }
+        }
+
+        return out;
+    }
+
+    SimpleDwarf overridden_row(const SimpleDwarf& dw) {
+        SimpleDwarf out;
+
+        for(const auto& fde: dw.fde_list) {
+            out.fde_list.push_back(SimpleDwarf::Fde());
+            SimpleDwarf::Fde& cur_fde = out.fde_list.back();
+            cur_fde.fde_offset = fde.fde_offset;
+            cur_fde.beg_ip = fde.beg_ip;
+            cur_fde.end_ip = fde.end_ip;
+
+            if(fde.rows.empty())
+                continue;
+
+            for(size_t pos=0; pos < fde.rows.size(); ++pos) {
+                const auto& row = fde.rows[pos];
+                if(pos == fde.rows.size() - 1
+                        || row.ip != fde.rows[pos+1].ip)
+                {
+                    cur_fde.rows.push_back(row);
+                }
+            }
+        }
+
+        return out;
+    }
+
+    SimpleDwarf empty_fde_deleter(const SimpleDwarf& dw) {
+        SimpleDwarf out(dw);
+
+        auto fde = out.fde_list.begin();
+        while(fde != out.fde_list.end()) {
+            if(fde->rows.empty())
+                fde = out.fde_list.erase(fde);
+            else
+                ++fde;
+        }
+        return out;
+    }
+
+    SimpleDwarf anti_overlap(const SimpleDwarf& dw) {
+        SimpleDwarf out(dw);
+        if(out.fde_list.empty())
+            return out;
+        sort(out.fde_list.begin(), out.fde_list.end(),
+                [](const SimpleDwarf::Fde& a, const SimpleDwarf::Fde& b) {
+                    return a.beg_ip < b.beg_ip;
+                });
+
+        for(size_t pos=0; pos < out.fde_list.size() - 1; ++pos) {
+            if(out.fde_list[pos].end_ip >= out.fde_list[pos + 1].beg_ip)
+                out.fde_list[pos].end_ip = out.fde_list[pos + 1].beg_ip - 1;
+            out.fde_list[pos].end_ip = out.fde_list[pos + 1].beg_ip;
+        }
+        return out;
+    }
+
+    SimpleDwarf pc_hole_filler(const SimpleDwarf& dw) {
+        SimpleDwarf out(dw);
+        if(out.fde_list.empty())
+            return out;
+        sort(out.fde_list.begin(), out.fde_list.end(),
+                [](const SimpleDwarf::Fde& a, const SimpleDwarf::Fde& b) {
+                    return a.beg_ip < b.beg_ip;
+                });
+
+        for(size_t pos=0; pos < out.fde_list.size() - 1; ++pos)
+            out.fde_list[pos].end_ip = out.fde_list[pos + 1].beg_ip;
+        return out;
+    }
+
+    SimpleDwarf filter_chain(const SimpleDwarf& dw, bool keep_holes) {
+        SimpleDwarf out =
+            anti_overlap(
+            empty_fde_deleter(
+            overridden_row(
+            conseq_equiv(dw))));
+        if(!keep_holes)
+            out = pc_hole_filler(out);
+        return out;
+    }
+}
+
+/// The filter chain as applied by dwarf-assembly
+static SimpleDwarf filter_chain(const SimpleDwarf& dw, bool keep_holes) {
+    SimpleDwarf out(dw);
+    ConseqEquivFilter().apply_in_place(out);
+    OverriddenRowFilter().apply_in_place(out);
+    EmptyFdeDeleter().apply_in_place(out);
+    AntiOverlapFilter().apply_in_place(out);
+    PcHoleFiller(!keep_holes).apply_in_place(out);
+    return out;
+}
+
+/** A random SimpleDwarf, with unsorted, overlapping and empty FDEs, as well as
+ * duplicate and overridden rows */
+static SimpleDwarf random_dwarf(mt19937& rng, size_t max_fdes) {
+    auto rand_below = [&rng](unsigned bound) {
+        return (unsigned) (rng() % bound);
+    };
+
+    SimpleDwarf dw;
+    size_t fde_count = rand_below(max_fdes + 1);
+    uintptr_t ip = 0x1000;
+    for(size_t fde_id = 0; fde_id < fde_count; ++fde_id) {
+        SimpleDwarf::Fde fde;
+        fde.fde_offset = 0x20 * fde_id;
+        fde.beg_ip = ip;
+
+        uintptr_t row_ip = ip;
+        size_t row_count = rand_below(6);
+        for(size_t row_id = 0; row_id < row_count; ++row_id) {
+            SimpleDwarf::DwRow row;
+            row.ip = row_ip;
+            row_ip += rand_below(3);
+            row.cfa.type = SimpleDwarf::DwRegister::REG_REGISTER;
+            row.cfa.reg = rand_below(4) == 0 ?
+                SimpleDwarf::REG_RBP : SimpleDwarf::REG_RSP;
+            row.cfa.offset = 8 * (1 + rand_below(2));
+            if(rand_below(2) == 0) {
+                row.rbp.type = SimpleDwarf::DwRegister::REG_CFA_OFFSET;
+                row.rbp.offset = -16;
+            }
+            row.ra.type = SimpleDwarf::DwRegister::REG_CFA_OFFSET;
+            row.ra.offset = -8;
+            fde.rows.push_back(row);
+        }
+
+        fde.end_ip = row_ip + 1 + rand_below(4);
+        ip = fde.end_ip + rand_below(5);
+        if(rand_below(7) == 0)
+            ip -= std::min<uintptr_t>(ip - fde.beg_ip, 1 + rand_below(8));
+        dw.fde_list.push_back(fde);
+    }
+
+    // Shuffle a few FDEs around, as they may come unsorted from the ELF
+    for(size_t swap_id = 0; swap_id < fde_count / 8; ++swap_id) {
+        swap(dw.fde_list[rand_below(fde_count)],
+                dw.fde_list[rand_below(fde_count)]);
+    }
+
+    return dw;
+}
+
+/// Dumps `dw`, including the FDE offsets, which `operator<<` omits
+static string dump(const SimpleDwarf& dw) {
+    ostringstream out;
+    for(const auto& fde: dw.fde_list)
+        out << "[" << hex << fde.fde_offset << "] " << fde;
+    return out.str();
+}
+
+int main(int argc, char** argv) {
+    size_t rounds = (argc > 1) ? strtoul(argv[1], nullptr, 10) : 2000;
+    size_t max_fdes = (argc > 2) ? strtoul(argv[2], nullptr, 10) : 200;
+
+    // The filters warn about overlaps on stderr; this is expected here
+    if(freopen("/dev/null", "w", stderr) == nullptr)
+        return 2;
+
+    mt19937 rng(42);
+    size_t failures = 0;
+    for(size_t round = 0; round < rounds; ++round) {
+        SimpleDwarf dw = random_dwarf(rng, max_fdes);
+        for(bool keep_holes: {false, true}) {
+            string expected = dump(legacy::filter_chain(dw, keep_holes));
+            string actual = dump(filter_chain(dw, keep_holes));
+            if(expected != actual) {
+                printf("Round %lu (keep_holes=%d): filter chains differ\n",
+                        round, keep_holes);
+                ++failures;
+            }
+        }
+    }
+
+    printf("%lu rounds, %lu failures\n", rounds, failures);
+    return failures == 0 ? 0 : 1;
+}
@@ -0,0 +1,43 @@
+#!/bin/bash
+# Checks that dwarf-assembly generates the same C whatever the number of threads
+# decoding the FDEs: the output of each `--threads N` must be byte-identical to
+# the output of `--threads 1`, for each given ELF object.
+#
+# Usage: reader_threads_check.sh DWARF_ASSEMBLY OBJECT...
+# Extra arguments to dwarf-assembly can be given in $DWARF_ASSEMBLY_ARGS.
+
+THREAD_COUNTS="2 3 8"
+
+if [ "$#" -lt 2 ]; then
+    echo "Usage: $0 DWARF_ASSEMBLY OBJECT..." >&2
+    exit 2
+fi
+dwarf_assembly="$1"
+shift
+
+work_dir=$(mktemp -d)
+trap 'rm -rf "$work_dir"' EXIT
+
+status=0
+for obj in "$@"; do
+    for policy in --global-switch --switch-per-func; do
+        if ! "$dwarf_assembly" "$obj" $policy $DWARF_ASSEMBLY_ARGS \
+                --threads 1 > "$work_dir/serial.c"; then
+            echo "FAIL $obj $policy: dwarf-assembly failed" >&2
+            status=1
+            continue
+        fi
+        for threads in $THREAD_COUNTS; do
+            "$dwarf_assembly" "$obj" $policy $DWARF_ASSEMBLY_ARGS \
+                --threads "$threads" > "$work_dir/threaded.c"
+            if cmp -s "$work_dir/serial.c" "$work_dir/threaded.c"; then
+                echo "ok   $obj $policy --threads $threads"
+            else
+                echo "FAIL $obj $policy --threads $threads:" \
+                    "differs from --threads 1" >&2
+                status=1
+            fi
+        done
+    done
+done
+exit $status